@@ -1,23 +1,211 @@
-from flask import Flask, request, jsonify, session, send_file
+from flask import Flask, request, jsonify, session, send_file, Response, stream_with_context
 import json
 import re
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import os
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
 import csv
 import io
+import gzip
+import zlib
+import atexit
+import itertools
+import sqlite3
+import tempfile
+import copy
+import abc
+import array
+import base64
+import bisect
+import collections
+import functools
+import heapq
+import html
+import math
+import operator
+import time
+import random
+import threading
+import unicodedata
+import queue
+import click
 import dropbox
 from dropbox.exceptions import AuthError, ApiError
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # Exportação em Parquet/Arrow indisponível
+    pyarrow = None
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 # Configurações do Dropbox - usar variáveis de ambiente
 DROPBOX_ACCESS_TOKEN = os.getenv("DROPBOX_ACCESS_TOKEN", "seu_token_dropbox_aqui")
 DROPBOX_DB_PATH = "/mensagens_projetos.json"
 
+# Cliente Dropbox compartilhado: conexões HTTPS reaproveitadas (keep-alive) e
+# novas tentativas do SDK em erros 5xx (espera exponencial) e 429 (respeitando
+# o Retry-After enviado pelo Dropbox)
+DROPBOX_MAX_CONEXOES = int(os.getenv("DROPBOX_MAX_CONEXOES", "8"))
+DROPBOX_MAX_TENTATIVAS = int(os.getenv("DROPBOX_MAX_TENTATIVAS", "4"))
+DROPBOX_MAX_TENTATIVAS_RATE_LIMIT = int(os.getenv("DROPBOX_MAX_TENTATIVAS_RATE_LIMIT", "3"))
+DROPBOX_TIMEOUT = float(os.getenv("DROPBOX_TIMEOUT", "60"))
+
+# Cache do banco em memória (por processo). Dentro da janela abaixo (em segundos)
+# o banco em cache é usado sem consultar o Dropbox; depois dela a revisão do
+# arquivo é conferida com files_get_metadata e o download só ocorre se mudou.
+DB_CACHE_STALENESS_SECONDS = float(os.getenv("DB_CACHE_STALENESS_SECONDS", "5"))
+
+# Modo journal: cada nova mensagem é gravada como um pequeno segmento numa pasta
+# ao lado do arquivo principal (o snapshot), em vez de regravar o banco inteiro.
+# A cada DB_JOURNAL_COMPACT_EVERY segmentos a compactação os incorpora ao snapshot.
+DB_JOURNAL_ENABLED = os.getenv("DB_JOURNAL_ENABLED", "false").lower() == "true"
+DB_JOURNAL_COMPACT_EVERY = int(os.getenv("DB_JOURNAL_COMPACT_EVERY", "50"))
+# Os segmentos são numerados em sequência; a compactação só apaga os gravados
+# há mais de DB_JOURNAL_RETENCAO_SECONDS, para que um número nunca seja reusado
+# (zero desliga a retenção, o que só é seguro com um único worker).
+DB_JOURNAL_RETENCAO_SECONDS = float(os.getenv("DB_JOURNAL_RETENCAO_SECONDS", "300"))
+
+# Gravação otimista: o upload só é aceito se o arquivo ainda estiver na revisão
+# lida. Em caso de conflito o banco é relido e a gravação é refeita, com espera
+# exponencial a partir de DB_WRITE_BACKOFF_SECONDS.
+DB_WRITE_MAX_TENTATIVAS = int(os.getenv("DB_WRITE_MAX_TENTATIVAS", "8"))
+DB_WRITE_BACKOFF_SECONDS = float(os.getenv("DB_WRITE_BACKOFF_SECONDS", "0.1"))
+
+# Layout por projeto: um arquivo por projeto em DROPBOX_SHARDS_DIR e um pequeno
+# manifesto com a lista de projetos. Ao ser ativado pela primeira vez, o arquivo
+# único existente é distribuído entre os projetos.
+DB_SHARDING_ENABLED = os.getenv("DB_SHARDING_ENABLED", "false").lower() == "true"
+DROPBOX_SHARDS_DIR = "/mensagens_projetos"
+DB_MANIFEST_PATH = f"{DROPBOX_SHARDS_DIR}/manifesto.json"
+
+# Backend de armazenamento: "dropbox" (JSON no Dropbox, padrão) ou "sqlite"
+# (banco local indexado, com cópia no Dropbox a cada DB_REPLICACAO_SEGUNDOS)
+DB_BACKEND = os.getenv("DB_BACKEND", "dropbox").lower()
+DB_SQLITE_PATH = os.getenv("DB_SQLITE_PATH", "mensagens_projetos.db")
+DB_REPLICACAO_SEGUNDOS = float(os.getenv("DB_REPLICACAO_SEGUNDOS", "30"))
+
+# Write-behind (backend Dropbox): a mensagem é confirmada após ser gravada num
+# log local e as pendentes vão ao Dropbox juntas, num único upload a cada
+# janela (em milissegundos) ou ao atingir DB_WRITE_BEHIND_MAX_MENSAGENS
+DB_WRITE_BEHIND_ENABLED = os.getenv("DB_WRITE_BEHIND_ENABLED", "false").lower() == "true"
+DB_WRITE_BEHIND_JANELA_MS = int(os.getenv("DB_WRITE_BEHIND_JANELA_MS", "300"))
+DB_WRITE_BEHIND_MAX_MENSAGENS = int(os.getenv("DB_WRITE_BEHIND_MAX_MENSAGENS", "20"))
+DB_WRITE_BEHIND_DIR = os.getenv("DB_WRITE_BEHIND_DIR", "fila_gravacao")
+
+# Formato dos arquivos gravados no Dropbox: "json" (JSON indentado, legível),
+# "json-compacto", "gzip" ou "zstd" (ambos sobre JSON compacto; zstd requer o
+# pacote zstandard). Na leitura o formato é detectado, então arquivos antigos
+# continuam sendo lidos depois de uma troca de codec. Um codec desconhecido ou
+# indisponível impede a inicialização, em vez de gravar noutro formato.
+DB_CODECS = ("json", "json-compacto", "gzip", "zstd")
+DB_CODEC = os.getenv("DB_CODEC", "json").lower()
+DB_CODEC_NIVEL = int(os.getenv("DB_CODEC_NIVEL", "6"))
+if DB_CODEC not in DB_CODECS:
+    raise ValueError(f"DB_CODEC={DB_CODEC} desconhecido; use um destes: {', '.join(DB_CODECS)}")
+if DB_CODEC == "zstd" and zstandard is None:
+    raise RuntimeError("DB_CODEC=zstd requer o pacote zstandard (pip install -r requirements.txt)")
+
 # Configuração da API DeepSeek
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY", "sk-3133a53daa7b44ccabd6805286671f6b")
 DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
 
+# Cliente DeepSeek: conexões reaproveitadas (keep-alive), timeouts separados de
+# conexão e de leitura (em segundos) e novas tentativas em 429, 5xx e falhas
+# de rede, com espera exponencial a partir de DEEPSEEK_BACKOFF_SEGUNDOS
+DEEPSEEK_MAX_CONEXOES = int(os.getenv("DEEPSEEK_MAX_CONEXOES", "10"))
+DEEPSEEK_TIMEOUT_CONEXAO = float(os.getenv("DEEPSEEK_TIMEOUT_CONEXAO", "5"))
+DEEPSEEK_TIMEOUT_LEITURA = float(os.getenv("DEEPSEEK_TIMEOUT_LEITURA", "30"))
+DEEPSEEK_MAX_TENTATIVAS = int(os.getenv("DEEPSEEK_MAX_TENTATIVAS", "3"))
+DEEPSEEK_BACKOFF_SEGUNDOS = float(os.getenv("DEEPSEEK_BACKOFF_SEGUNDOS", "0.5"))
+
+# Disjuntor do DeepSeek: abre após DEEPSEEK_DISJUNTOR_FALHAS falhas seguidas
+# (uma chamada que leva mais que DEEPSEEK_DISJUNTOR_LENTIDAO do seu timeout de
+# leitura conta como falha). Aberto, as chamadas falham na hora durante
+# DEEPSEEK_DISJUNTOR_ABERTO_SEGUNDOS; depois uma chamada de sondagem decide se
+# ele fecha ou volta a abrir. O estado é de cada processo.
+DEEPSEEK_DISJUNTOR_FALHAS = int(os.getenv("DEEPSEEK_DISJUNTOR_FALHAS", "5"))
+DEEPSEEK_DISJUNTOR_LENTIDAO = float(os.getenv("DEEPSEEK_DISJUNTOR_LENTIDAO", "0.7"))
+DEEPSEEK_DISJUNTOR_ABERTO_SEGUNDOS = float(os.getenv("DEEPSEEK_DISJUNTOR_ABERTO_SEGUNDOS", "30"))
+
+# Enriquecimento assíncrono: a mensagem é gravada na hora com
+# status_enriquecimento "pendente" e o contexto e a mudança chave extraídos pelo
+# DeepSeek são preenchidos depois por um pool de threads, fora da requisição
+ENRIQUECIMENTO_ASYNC_ENABLED = os.getenv("ENRIQUECIMENTO_ASYNC_ENABLED", "true").lower() == "true"
+ENRIQUECIMENTO_WORKERS = int(os.getenv("ENRIQUECIMENTO_WORKERS", "2"))
+ENRIQUECIMENTO_MAX_TENTATIVAS = int(os.getenv("ENRIQUECIMENTO_MAX_TENTATIVAS", "3"))
+ENRIQUECIMENTO_TRAVA = os.getenv("ENRIQUECIMENTO_TRAVA", "enriquecimento.lock")
+# Intervalo entre as varreduras das mensagens que continuam pendentes (as de um
+# worker que saiu com a fila cheia, por exemplo); 0 varre só na inicialização
+ENRIQUECIMENTO_VARREDURA_SEGUNDOS = float(os.getenv("ENRIQUECIMENTO_VARREDURA_SEGUNDOS", "300"))
+
+# Execução única (single-flight): pedidos idênticos simultâneos de consulta e de
+# estatísticas são atendidos por uma única execução. Com
+# EXECUCAO_UNICA_ENTRE_WORKERS, os workers da máquina também se coordenam por
+# travas de arquivo em EXECUCAO_UNICA_DIR, esperando até
+# EXECUCAO_UNICA_ESPERA_SEGUNDOS pelo resultado de outro worker.
+EXECUCAO_UNICA_ENTRE_WORKERS = os.getenv("EXECUCAO_UNICA_ENTRE_WORKERS", "true").lower() == "true"
+EXECUCAO_UNICA_DIR = os.getenv("EXECUCAO_UNICA_DIR", os.path.join(tempfile.gettempdir(), "ppp_execucao_unica"))
+EXECUCAO_UNICA_ESPERA_SEGUNDOS = float(os.getenv("EXECUCAO_UNICA_ESPERA_SEGUNDOS", "90"))
+
+# Cache local (SQLite) das extrações do DeepSeek, endereçado pelo texto
+# normalizado da mensagem, pelo modelo e pela versão do prompt. Guarda até
+# LLM_CACHE_MAX_ENTRADAS respostas, descartando as usadas há mais tempo.
+# Ao mudar o prompt de extração, incremente PROMPT_CONTEXTO_VERSAO.
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "cache_llm.db")
+LLM_CACHE_MAX_ENTRADAS = int(os.getenv("LLM_CACHE_MAX_ENTRADAS", "5000"))
+MODELO_CONTEXTO = "deepseek-chat"
+PROMPT_CONTEXTO_VERSAO = 1
+
+# Cache em memória das respostas do assistente de consultas, por pergunta
+# normalizada, projeto e versão dos dados: uma mensagem nova ou alterada
+# invalida as respostas. Entradas expiram após CONSULTA_CACHE_TTL_SEGUNDOS.
+CONSULTA_CACHE_TTL_SEGUNDOS = float(os.getenv("CONSULTA_CACHE_TTL_SEGUNDOS", "600"))
+CONSULTA_CACHE_MAX_ENTRADAS = int(os.getenv("CONSULTA_CACHE_MAX_ENTRADAS", "500"))
+
+# Extração em lote: várias mensagens numa única chamada ao DeepSeek, com no
+# máximo LLM_LOTE_MAX_MENSAGENS por chamada e resposta estimada dentro de
+# LLM_LOTE_MAX_TOKENS (o max_tokens enviado)
+LLM_LOTE_MAX_MENSAGENS = int(os.getenv("LLM_LOTE_MAX_MENSAGENS", "20"))
+LLM_LOTE_MAX_TOKENS = int(os.getenv("LLM_LOTE_MAX_TOKENS", "4000"))
+LLM_LOTE_TIMEOUT = float(os.getenv("LLM_LOTE_TIMEOUT", "120"))
+
+# Contexto enviado ao assistente de consultas: as mensagens mais relevantes
+# para a pergunta (ranking BM25), até CONSULTA_CONTEXTO_MAX_MENSAGENS e
+# dentro de CONSULTA_CONTEXTO_MAX_TOKENS estimados
+CONSULTA_CONTEXTO_MAX_MENSAGENS = int(os.getenv("CONSULTA_CONTEXTO_MAX_MENSAGENS", "15"))
+CONSULTA_CONTEXTO_MAX_TOKENS = int(os.getenv("CONSULTA_CONTEXTO_MAX_TOKENS", "1500"))
+
+# Mensagens quase iguais a uma já registrada no projeto (similaridade de
+# Jaccard estimada por MinHash) são apontadas na entrada de dados
+DUPLICATA_SIMILARIDADE_MINIMA = float(os.getenv("DUPLICATA_SIMILARIDADE_MINIMA", "0.7"))
+DUPLICATA_MAX_SIMILARES = int(os.getenv("DUPLICATA_MAX_SIMILARES", "5"))
+
+# Listagem paginada de /api/mensagens: itens por página quando o limite não é
+# informado e o máximo aceito
+MENSAGENS_PAGINA_PADRAO = int(os.getenv("MENSAGENS_PAGINA_PADRAO", "50"))
+MENSAGENS_PAGINA_MAXIMA = int(os.getenv("MENSAGENS_PAGINA_MAXIMA", "500"))
+
+# Busca textual de /api/buscar: índice invertido num SQLite local, mantido
+# entre reinícios e compartilhado pelos workers. Cada resultado traz um
+# trecho de até BUSCA_TRECHO_CARACTERES com os termos encontrados destacados.
+BUSCA_INDICE_PATH = os.getenv("BUSCA_INDICE_PATH", "busca.db")
+BUSCA_MAX_RESULTADOS = int(os.getenv("BUSCA_MAX_RESULTADOS", "100"))
+BUSCA_TRECHO_CARACTERES = int(os.getenv("BUSCA_TRECHO_CARACTERES", "200"))
+
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "sua_chave_secreta_aqui_producao_12345")
 
@@ -31,10 +219,21 @@ DB_STRUCTURE = {
     "mensagens": [],
     "estatisticas": {
         "total_mensagens": 0,
-        "ultima_atualizacao": None
+        "ultima_atualizacao": None,
+        # projeto -> {"total", "lessons_learned", "por_categoria": {categoria: quantidade}}
+        "por_projeto": {}
     }
 }
 
+# Campos de cada mensagem guardada no banco
+CAMPOS_MENSAGEM = ['id', 'timestamp', 'remetente', 'categoria', 'contexto', 'mudanca_chave',
+                   'mensagem_original', 'projeto', 'lesson_learned', 'mensagem_hash',
+                   'status_enriquecimento']
+
+# Campos preenchidos pelo enriquecimento depois da gravação (não entram nas estatísticas).
+# status_enriquecimento: "pendente", "concluido" ou "falhou"; ausente em mensagens antigas
+CAMPOS_ENRIQUECIMENTO = ['contexto', 'mudanca_chave', 'status_enriquecimento']
+
 def carregar_projetos_csv():
     """Carrega a lista de projetos do arquivo CSV sem usar pandas"""
     try:
@@ -72,250 +271,3682 @@ def carregar_projetos_csv():
             {'id': '3', 'nome': 'Projeto C', 'display': '3 - Projeto C'}
         ]
 
-def carregar_banco_dropbox():
-    """Carrega o banco de dados do Dropbox"""
+_cliente_dropbox = None
+_cliente_dropbox_pid = None
+_cliente_dropbox_lock = threading.Lock()
+
+def cliente_dropbox():
+    """Retorna o cliente Dropbox do worker, criado uma única vez por processo"""
+    global _cliente_dropbox, _cliente_dropbox_pid
+    with _cliente_dropbox_lock:
+        # Um processo criado por fork não deve reaproveitar as conexões do pai
+        if _cliente_dropbox is None or _cliente_dropbox_pid != os.getpid():
+            _cliente_dropbox = dropbox.Dropbox(
+                DROPBOX_ACCESS_TOKEN,
+                session=dropbox.create_session(max_connections=DROPBOX_MAX_CONEXOES),
+                max_retries_on_error=DROPBOX_MAX_TENTATIVAS,
+                max_retries_on_rate_limit=DROPBOX_MAX_TENTATIVAS_RATE_LIMIT,
+                timeout=DROPBOX_TIMEOUT
+            )
+            _cliente_dropbox_pid = os.getpid()
+        return _cliente_dropbox
+
+def novo_banco():
+    """Retorna uma cópia nova da estrutura padrão do banco de dados"""
+    return copy.deepcopy(DB_STRUCTURE)
+
+def novo_manifesto():
+    """Retorna um manifesto vazio do layout por projeto"""
+    return {"projetos": {}, "criado_em": datetime.now().isoformat()}
+
+def caminho_banco(projeto_id=None):
+    """Caminho no Dropbox do arquivo que guarda as mensagens do projeto"""
+    if DB_SHARDING_ENABLED and projeto_id:
+        nome = re.sub(r'[^0-9A-Za-z_-]', '_', str(projeto_id))
+        return f"{DROPBOX_SHARDS_DIR}/projeto_{nome}.json"
+    return DROPBOX_DB_PATH
+
+# Cache do banco por caminho no Dropbox:
+# {"dados", "rev", "content_hash", "verificado_em", "indices", "segmentos_pendentes"}
+_cache_banco = {}
+_cache_banco_lock = threading.RLock()
+
+def invalidar_cache_banco(caminho=DROPBOX_DB_PATH):
+    """Descarta o banco em cache para forçar um novo download"""
+    with _cache_banco_lock:
+        _cache_banco.pop(caminho, None)
+
+def _atualizar_cache_banco(caminho, dados, metadata):
+    """Guarda o banco em cache junto com a revisão do arquivo no Dropbox"""
+    with _cache_banco_lock:
+        anterior = _cache_banco.get(caminho)
+        # Os índices continuam válidos quando quem salvou foi este processo,
+        # alterando o próprio banco em cache
+        mesmo_banco = anterior is not None and anterior["dados"] is dados
+        _cache_banco[caminho] = {
+            "dados": dados,
+            "rev": getattr(metadata, "rev", None),
+            "content_hash": getattr(metadata, "content_hash", None),
+            "verificado_em": time.monotonic(),
+            "indices": anterior["indices"] if mesmo_banco else {},
+            "segmentos_pendentes": anterior["segmentos_pendentes"] if mesmo_banco else []
+        }
+
+def _arquivo_nao_encontrado(erro):
+    """Indica se o ApiError do Dropbox corresponde a um caminho inexistente"""
+    erro_api = getattr(erro, "error", None)
     try:
-        dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
-        
-        # Tenta baixar o arquivo
-        metadata, response = dbx.files_download(DROPBOX_DB_PATH)
-        
-        # Carrega o JSON
-        dados = json.loads(response.content.decode('utf-8'))
-        print("✅ Banco de dados carregado do Dropbox com sucesso!")
-        return dados
-        
-    except dropbox.exceptions.HttpError as e:
-        if e.status == 409:  # Arquivo não encontrado
-            print("📁 Arquivo não encontrado no Dropbox. Criando novo banco de dados...")
-            # Salva a estrutura inicial
-            salvar_banco_dropbox(DB_STRUCTURE)
-            return DB_STRUCTURE
-        else:
-            print(f"❌ Erro HTTP ao carregar do Dropbox: {e}")
-            return DB_STRUCTURE
-    except Exception as e:
-        print(f"❌ Erro ao carregar do Dropbox: {e}")
-        return DB_STRUCTURE
+        if getattr(erro_api, "is_path_lookup", lambda: False)():
+            # Remoção (files_delete_v2)
+            return erro_api.get_path_lookup().is_not_found()
+        return erro_api.is_path() and erro_api.get_path().is_not_found()
+    except AttributeError:
+        return False
 
-def salvar_banco_dropbox(dados):
-    """Salva o banco de dados no Dropbox"""
+def _conflito_de_escrita(erro):
+    """Indica se o ApiError do Dropbox é um conflito de revisão no upload"""
+    erro_api = getattr(erro, "error", None)
     try:
-        dbx = dropbox.Dropbox(DROPBOX_ACCESS_TOKEN)
-        
-        # Converte para JSON
-        json_data = json.dumps(dados, ensure_ascii=False, indent=2)
-        
-        # Faz upload do arquivo
-        dbx.files_upload(
-            json_data.encode('utf-8'), 
-            DROPBOX_DB_PATH, 
-            mode=dropbox.files.WriteMode.overwrite
-        )
-        
-        print("✅ Banco de dados salvo no Dropbox com sucesso!")
-        return True
-        
-    except Exception as e:
-        print(f"❌ Erro ao salvar no Dropbox: {e}")
+        return erro_api.is_path() and erro_api.get_path().reason.is_conflict()
+    except AttributeError:
         return False
 
-def upload_db_to_dropbox():
-    """Faz upload do banco de dados para o Dropbox (para backup)"""
+def _proximo_id(banco):
+    """Próximo id livre do banco (os ids são crescentes)"""
+    mensagens = banco["mensagens"]
+    ultimo_id = (mensagens[-1].get("id") or 0) if mensagens else 0
+    return max(ultimo_id, len(mensagens)) + 1
+
+def _contar_mensagem(estatisticas, mensagem):
+    """Soma a mensagem aos contadores de estatísticas do banco"""
+    contadores = estatisticas["por_projeto"].setdefault(
+        mensagem.get("projeto") or "sem_projeto",
+        {"total": 0, "lessons_learned": 0, "por_categoria": {}}
+    )
+    categoria = mensagem.get("categoria") or "Outros"
+    contadores["total"] += 1
+    contadores["por_categoria"][categoria] = contadores["por_categoria"].get(categoria, 0) + 1
+    if mensagem.get("lesson_learned") == "sim":
+        contadores["lessons_learned"] += 1
+
+def reconstruir_estatisticas(banco):
+    """Recalcula do zero os contadores de estatísticas a partir das mensagens"""
+    estatisticas = banco.setdefault("estatisticas", {})
+    estatisticas["por_projeto"] = {}
+    for mensagem in banco.get("mensagens", []):
+        _contar_mensagem(estatisticas, mensagem)
+    estatisticas["total_mensagens"] = len(banco.get("mensagens", []))
+    return estatisticas
+
+def _aplicar_mensagem(banco, mensagem):
+    """Acrescenta uma mensagem ao banco em memória e atualiza as estatísticas"""
+    if "por_projeto" not in banco["estatisticas"]:
+        # Banco gravado antes dos contadores: calculados uma vez aqui
+        reconstruir_estatisticas(banco)
+    # Os segmentos trazem o id definido na gravação; só os segmentos antigos,
+    # nomeados por data, podem não ter id ou repetir ids
+    if not mensagem.get("id") or mensagem["id"] < _proximo_id(banco):
+        mensagem["id"] = _proximo_id(banco)
+    banco["mensagens"].append(mensagem)
+    _contar_mensagem(banco["estatisticas"], mensagem)
+    banco["estatisticas"]["total_mensagens"] = len(banco["mensagens"])
+    banco["estatisticas"]["ultima_atualizacao"] = datetime.now().isoformat()
+
+def _proxima_versao_mensagem(banco):
+    """
+    Próximo valor do contador de alterações de mensagens do banco, gravado no
+    campo "versao" da mensagem alterada. Sem o contador (banco anterior a ele
+    ou recém-migrado), parte da maior versão entre as mensagens.
+    """
+    versao = banco.get("versao_mensagens")
+    if versao is None:
+        versao = max((msg.get("versao") or 0 for msg in banco["mensagens"]), default=0)
+    banco["versao_mensagens"] = versao + 1
+    return versao + 1
+
+def _aplicar_atualizacao(banco, atualizacao):
+    """
+    Altera campos de uma mensagem do banco em memória. `atualizacao` tem
+    "projeto", "mensagem_hash" e "campos". Retorna (mensagem, valores
+    anteriores dos campos), ou None se a mensagem não estiver no banco.
+    A mensagem alterada recebe uma nova "versao" (_proxima_versao_mensagem).
+
+    A mensagem alterada é um dicionário novo, no lugar do antigo: as
+    mensagens nunca são alteradas no lugar, pois a cópia do banco feita
+    para uma gravação (veja _copia_para_gravacao) as compartilha com o cache.
+    """
+    mensagens = banco["mensagens"]
+    # As mensagens atualizadas costumam ser as mais recentes
+    for posicao in range(len(mensagens) - 1, -1, -1):
+        mensagem = mensagens[posicao]
+        if (mensagem.get("mensagem_hash") == atualizacao["mensagem_hash"]
+                and mensagem.get("projeto") == atualizacao["projeto"]):
+            anteriores = {campo: mensagem.get(campo) for campo in atualizacao["campos"]}
+            mensagens[posicao] = {**mensagem, **atualizacao["campos"],
+                                  "versao": _proxima_versao_mensagem(banco)}
+            return mensagens[posicao], anteriores
+    return None
+
+# Bytes e tempo das transferências com o Dropbox (expostos em /api/metricas)
+METRICAS_DROPBOX = {
+    "downloads": 0,
+    "bytes_baixados": 0,
+    "segundos_download": 0.0,
+    "uploads": 0,
+    "bytes_enviados": 0,
+    "bytes_json_enviados": 0,
+    "segundos_upload": 0.0
+}
+_metricas_lock = threading.Lock()
+
+def _codificar_json(dados, codec=None):
+    """
+    Serializa os dados no formato do codec (DB_CODEC por padrão).
+    Retorna (conteúdo, tamanho do JSON antes da compressão).
+    """
+    codec = codec or DB_CODEC
+    if codec == "json":
+        conteudo = json.dumps(dados, ensure_ascii=False, indent=2).encode('utf-8')
+        return conteudo, len(conteudo)
+    conteudo = json.dumps(dados, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+    if codec == "gzip":
+        return gzip.compress(conteudo, compresslevel=DB_CODEC_NIVEL), len(conteudo)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=DB_CODEC_NIVEL).compress(conteudo), len(conteudo)
+    return conteudo, len(conteudo)
+
+def _decodificar_json(conteudo):
+    """Lê dados gravados em qualquer codec, detectando o formato pelo cabeçalho"""
+    if conteudo[:2] == b'\x1f\x8b':
+        conteudo = gzip.decompress(conteudo)
+    elif conteudo[:4] == b'\x28\xb5\x2f\xfd':
+        if zstandard is None:
+            raise RuntimeError("arquivo gravado em zstd, mas o pacote zstandard não está instalado")
+        conteudo = zstandard.ZstdDecompressor().decompress(conteudo)
+    return json.loads(conteudo.decode('utf-8'))
+
+def _baixar_json(dbx, caminho):
+    """Baixa e decodifica um arquivo do Dropbox. Retorna (metadata, dados)"""
+    inicio = time.monotonic()
+    metadata, response = dbx.files_download(caminho)
+    conteudo = response.content
+    duracao = time.monotonic() - inicio
+    with _metricas_lock:
+        METRICAS_DROPBOX["downloads"] += 1
+        METRICAS_DROPBOX["bytes_baixados"] += len(conteudo)
+        METRICAS_DROPBOX["segundos_download"] += duracao
+    print(f"📥 {caminho}: {len(conteudo)} bytes baixados em {duracao:.2f}s")
+    return metadata, _decodificar_json(conteudo)
+
+def _enviar_json(dbx, caminho, dados, modo, codec=None):
+    """Codifica e envia um arquivo ao Dropbox. Retorna o metadata do upload"""
+    conteudo, tamanho_json = _codificar_json(dados, codec)
+    inicio = time.monotonic()
+    metadata = dbx.files_upload(conteudo, caminho, mode=modo)
+    duracao = time.monotonic() - inicio
+    with _metricas_lock:
+        METRICAS_DROPBOX["uploads"] += 1
+        METRICAS_DROPBOX["bytes_enviados"] += len(conteudo)
+        METRICAS_DROPBOX["segundos_upload"] += duracao
+        METRICAS_DROPBOX["bytes_json_enviados"] += tamanho_json
+    print(f"📤 {caminho}: {len(conteudo)} bytes enviados em {duracao:.2f}s ({codec or DB_CODEC})")
+    return metadata
+
+def _pasta_journal(caminho):
+    """Pasta dos segmentos do journal de um snapshot (/x.json -> /x_journal)"""
+    return caminho.rsplit(".", 1)[0] + "_journal"
+
+def _nome_segmento(numero):
+    """Nome do segmento de número `numero` (a ordem dos nomes é a numérica)"""
+    return f"seg_{numero:010d}.json"
+
+def _numero_segmento(nome):
+    """Número do segmento, ou None nos segmentos antigos, nomeados por data"""
+    if nome.startswith("seg_"):
+        return int(nome[4:-5])
+    return None
+
+def _listar_entradas_journal(dbx, caminho):
+    """Lista os segmentos do journal: {nome: data da gravação no Dropbox}"""
     try:
-        # Simplesmente salva o banco atual
-        banco = carregar_banco_dropbox()
-        success = salvar_banco_dropbox(banco)
-        if success:
-            return True, "Backup salvo no Dropbox com sucesso!"
-        else:
-            return False, "Erro ao fazer backup"
-        
-    except Exception as e:
-        return False, f"Erro ao fazer upload: {e}"
+        resultado = dbx.files_list_folder(_pasta_journal(caminho))
+    except ApiError as e:
+        if _arquivo_nao_encontrado(e):
+            return {}
+        raise
+    entradas = list(resultado.entries)
+    while resultado.has_more:
+        resultado = dbx.files_list_folder_continue(resultado.cursor)
+        entradas.extend(resultado.entries)
+    return {entrada.name: getattr(entrada, "server_modified", None)
+            for entrada in entradas if entrada.name.endswith(".json")}
+
+def _listar_segmentos(dbx, caminho):
+    """Lista os nomes dos segmentos do journal, em ordem de gravação"""
+    return sorted(_listar_entradas_journal(dbx, caminho))
+
+def _segmentos_novos(banco, nomes):
+    """
+    Segmentos da lista ainda não incorporados ao banco, na ordem em que devem
+    ser aplicados. Retorna None se falta algum número na sequência: os
+    segmentos que faltam foram compactados num snapshot mais novo que o banco.
+    """
+    journal = banco.get("journal", {})
+    aplicados = set(journal.get("segmentos", []))
+    ultimo = journal.get("ultimo", 0)
+    novos = []
+    for nome in nomes:
+        numero = _numero_segmento(nome)
+        if numero is None:
+            if nome not in aplicados:
+                novos.append(nome)
+        elif numero > ultimo:
+            if numero != ultimo + 1:
+                return None
+            novos.append(nome)
+            ultimo = numero
+    return novos
+
+def _baixar_segmento(dbx, caminho, nome):
+    """Baixa um segmento do journal. Retorna (nome, segmento)"""
+    return nome, _baixar_json(dbx, f"{_pasta_journal(caminho)}/{nome}")[1]
+
+def _baixar_segmentos(dbx, caminho, banco, nomes=None):
+    """
+    Baixa os segmentos do journal ainda não incorporados ao banco (todos os
+    da pasta, sem `nomes`). Retorna [(nome, segmento)] em ordem de gravação,
+    ou None se o banco é mais antigo que o journal (veja _segmentos_novos).
+    """
+    if nomes is None:
+        nomes = _listar_segmentos(dbx, caminho)
+    novos = _segmentos_novos(banco, nomes)
+    if novos is None:
+        return None
+    return [_baixar_segmento(dbx, caminho, nome) for nome in novos]
+
+def _aplicar_segmentos(banco, segmentos, entrada=None):
+    """
+    Aplica ao banco os segmentos baixados que ainda não foram incorporados a
+    ele, sempre em ordem de número. Um segmento traz mensagens novas
+    ("mensagens"), já com os ids, e/ou alterações de mensagens já gravadas
+    ("atualizacoes"). Com a `entrada` do cache, os índices dela são
+    atualizados junto. Retorna os nomes aplicados.
+    """
+    journal = banco.setdefault("journal", {"segmentos": []})
+    aplicados = set(journal["segmentos"])
+    novos = []
+    for nome, segmento in segmentos:
+        numero = _numero_segmento(nome)
+        if numero is None:
+            if nome in aplicados:
+                continue
+        elif numero <= journal.get("ultimo", 0):
+            continue
+        elif numero != journal.get("ultimo", 0) + 1:
+            # Fora de ordem: fica para a próxima verificação do journal
+            break
+        for mensagem in segmento.get("mensagens", []):
+            _aplicar_mensagem(banco, mensagem)
+            if entrada is not None:
+                _indexar_mensagem_cache(entrada, mensagem)
+        for atualizacao in segmento.get("atualizacoes", []):
+            alterada = _aplicar_atualizacao(banco, atualizacao)
+            if entrada is not None and alterada is not None:
+                _reindexar_mensagem_cache(entrada, *alterada)
+        journal["segmentos"].append(nome)
+        if numero is not None:
+            journal["ultimo"] = numero
+        novos.append(nome)
+    return novos
+
+def _atualizar_journal_cache(dbx, caminho, entrada):
+    """
+    Aplica ao banco em cache os segmentos gravados desde a última verificação.
+    Os downloads são feitos fora de _cache_banco_lock; só a aplicação o toma.
+    Retorna False se o snapshot em cache ficou para trás de uma compactação.
+    """
+    nomes = _listar_segmentos(dbx, caminho)
+    with _cache_banco_lock:
+        novos = _segmentos_novos(entrada["dados"], nomes)
+    if novos is None:
+        return False
+    if not novos:
+        return True
+    segmentos = [_baixar_segmento(dbx, caminho, nome) for nome in novos]
+    with _cache_banco_lock:
+        # Outra thread pode ter aplicado parte deles durante o download
+        entrada["segmentos_pendentes"].extend(_aplicar_segmentos(entrada["dados"], segmentos, entrada))
+    return True
+
+def _sincronizar_journal(dbx, caminho):
+    """
+    Entrada do cache com o snapshot atual e todos os segmentos do journal
+    aplicados, ou None se o banco não pôde ser carregado.
+    """
+    entrada = _carregar_entrada(caminho)[1]
+    for _ in range(DB_WRITE_MAX_TENTATIVAS):
+        if entrada is None:
+            return None
+        # A revisão do snapshot é conferida depois da listagem: um segmento que
+        # sumiu da pasta foi compactado num snapshot que já estará no Dropbox
+        if (_atualizar_journal_cache(dbx, caminho, entrada)
+                and dbx.files_get_metadata(caminho).rev == entrada["rev"]):
+            return entrada
+        entrada = _carregar_entrada(caminho, forcar_download=True)[1]
+    return None
+
+def _registrar_segmento_cache(caminho, entrada, nome):
+    """Marca o segmento como aplicado ao banco em cache e agenda a compactação"""
+    entrada["segmentos_pendentes"].append(nome)
+    if len(entrada["segmentos_pendentes"]) >= DB_JOURNAL_COMPACT_EVERY:
+        threading.Thread(target=compactar_journal, args=(caminho,), daemon=True).start()
+
+def _gravar_segmento(caminho, montar):
+    """
+    Envia um novo segmento ao journal do snapshot. Os segmentos são numerados
+    em sequência e criados com WriteMode.add, então cada número só é gravado
+    uma vez: antes de escolher o número, todos os segmentos anteriores são
+    aplicados ao banco em cache, e `montar(banco)` monta o segmento sobre esse
+    estado (é assim que as mensagens novas recebem os ids). Se outro worker
+    gravou o mesmo número antes, o journal é relido e o segmento remontado.
+
+    Retorna (nome, segmento); o segmento já está aplicado ao banco em cache.
+    """
+    dbx = cliente_dropbox()
+    for tentativa in range(DB_WRITE_MAX_TENTATIVAS):
+        inicio = time.monotonic()
+        entrada = _sincronizar_journal(dbx, caminho)
+        if entrada is None:
+            raise RuntimeError(f"não foi possível carregar {caminho}")
+        with _cache_banco_lock:
+            numero = entrada["dados"].get("journal", {}).get("ultimo", 0) + 1
+            segmento = montar(entrada["dados"])
+        nome = _nome_segmento(numero)
+
+        # A compactação só apaga segmentos mais velhos que a retenção: se a
+        # leitura do journal ficou para trás disso, o número pode já ter sido
+        # usado (com retenção zero a verificação fica desligada)
+        if DB_JOURNAL_RETENCAO_SECONDS <= 0 or time.monotonic() - inicio < DB_JOURNAL_RETENCAO_SECONDS / 2:
+            try:
+                _enviar_json(
+                    dbx,
+                    f"{_pasta_journal(caminho)}/{nome}",
+                    segmento,
+                    dropbox.files.WriteMode.add,
+                    # Segmentos são sempre compactos, mesmo com o snapshot indentado
+                    codec="json-compacto" if DB_CODEC == "json" else DB_CODEC
+                )
+            except ApiError as e:
+                if not _conflito_de_escrita(e):
+                    raise
+            else:
+                with _cache_banco_lock:
+                    # Se o cache mudou nesse meio tempo, a próxima verificação baixa o segmento
+                    if _aplicar_segmentos(entrada["dados"], [(nome, segmento)], entrada):
+                        _registrar_segmento_cache(caminho, entrada, nome)
+                return nome, segmento
+
+        espera = DB_WRITE_BACKOFF_SECONDS * (2 ** tentativa) * random.uniform(0.5, 1.5)
+        print(f"⚠️ Segmento {nome} já gravado por outro worker (tentativa {tentativa + 1}); nova tentativa em {espera:.2f}s")
+        time.sleep(espera)
+
+    raise RuntimeError("muitas gravações simultâneas no journal")
+
+def anexar_ao_journal(mensagens, caminho=DROPBOX_DB_PATH):
+    """
+    Grava as mensagens como um novo segmento do journal. O custo da gravação
+    depende só do tamanho das mensagens, não do tamanho do banco. Os ids são
+    definidos antes do upload e gravados no segmento, então são os mesmos em
+    todos os workers e depois da compactação.
+    """
+    def montar(banco):
+        proximo_id = _proximo_id(banco)
+        for posicao, mensagem in enumerate(mensagens):
+            mensagem["id"] = proximo_id + posicao
+        return {"mensagens": [dict(mensagem) for mensagem in mensagens]}
 
-def download_db_from_dropbox():
-    """Baixa o banco de dados do Dropbox (para restore)"""
     try:
-        # Simplesmente carrega o banco - já está sincronizado
-        banco = carregar_banco_dropbox()
-        return True, "Backup restaurado do Dropbox com sucesso!"
-        
+        nome, _ = _gravar_segmento(caminho, montar)
     except Exception as e:
-        return False, f"Erro ao baixar: {e}"
+        print(f"❌ Erro ao gravar segmento do journal: {e}")
+        return False
 
-def gerar_hash_mensagem(projeto_id, categoria, mensagem):
-    """Gera um hash único para a mensagem para evitar duplicatas"""
-    conteudo = f"{projeto_id}_{categoria}_{mensagem}".lower().strip()
-    return hashlib.md5(conteudo.encode()).hexdigest()
+    print(f"✅ Segmento {nome} gravado no journal do Dropbox")
+    return True
 
-def verificar_duplicata(projeto_id, categoria, mensagem):
-    """Verifica se já existe uma mensagem idêntica no banco de dados"""
+def atualizar_no_journal(atualizacoes, caminho=DROPBOX_DB_PATH):
+    """Grava alterações de mensagens já existentes como um novo segmento do journal"""
     try:
-        banco = carregar_banco_dropbox()
-        mensagens = banco.get("mensagens", [])
-        
-        mensagem_hash = gerar_hash_mensagem(projeto_id, categoria, mensagem)
-        
-        for msg in mensagens:
-            if msg.get("mensagem_hash") == mensagem_hash:
-                return True
-        
+        nome, _ = _gravar_segmento(caminho, lambda banco: {"atualizacoes": atualizacoes})
+    except Exception as e:
+        print(f"❌ Erro ao gravar segmento do journal: {e}")
+        return False
+
+    print(f"✅ Segmento {nome} gravado no journal do Dropbox")
+    return True
+
+_compactacao_lock = threading.Lock()
+
+def compactar_journal(caminho=DROPBOX_DB_PATH):
+    """
+    Incorpora os segmentos do journal ao snapshot e apaga os segmentos
+    incorporados. O snapshot só é regravado se não mudou desde a leitura,
+    então compactações simultâneas em workers diferentes não perdem dados.
+    Segmentos gravados há menos de DB_JOURNAL_RETENCAO_SECONDS ficam na
+    pasta (e são ignorados, pois o snapshot registra o último número
+    incorporado) para que o número deles não volte a ficar livre enquanto
+    algum worker ainda pode estar escolhendo o número do próximo.
+    """
+    if not _compactacao_lock.acquire(blocking=False):
         return False
+    try:
+        dbx = cliente_dropbox()
+
+        metadata, banco = _baixar_json(dbx, caminho)
+        entradas = _listar_entradas_journal(dbx, caminho)
+        nomes = sorted(entradas)
+        segmentos = _baixar_segmentos(dbx, caminho, banco, nomes)
+        if segmentos is None:
+            raise RuntimeError("o snapshot mudou durante a compactação")
+        _aplicar_segmentos(banco, segmentos)
+
+        # O snapshot registra os segmentos incorporados, para que sejam
+        # ignorados caso a remoção abaixo não chegue ao fim
+        banco["journal"] = {"segmentos": nomes, "ultimo": banco["journal"].get("ultimo", 0)}
+        novo_metadata = _enviar_json(dbx, caminho, banco, dropbox.files.WriteMode.update(metadata.rev))
+
+        limite = datetime.utcnow() - timedelta(seconds=DB_JOURNAL_RETENCAO_SECONDS)
+        for nome in nomes:
+            gravado_em = entradas[nome]
+            if gravado_em is not None and gravado_em.replace(tzinfo=None) > limite:
+                continue
+            try:
+                dbx.files_delete_v2(f"{_pasta_journal(caminho)}/{nome}")
+            except ApiError as e:
+                if not _arquivo_nao_encontrado(e):
+                    raise
+
+        with _cache_banco_lock:
+            anterior = _cache_banco.get(caminho)
+        entrada = _instalar_no_cache(caminho, banco, novo_metadata, anterior)
+        with _cache_banco_lock:
+            # Segmentos gravados durante a compactação entram na próxima verificação
+            entrada["verificado_em"] = 0.0
+
+        print(f"✅ Journal compactado: {len(segmentos)} segmentos incorporados ao snapshot")
+        return True
+
     except Exception as e:
-        print(f"Erro ao verificar duplicata: {e}")
+        print(f"❌ Erro ao compactar o journal: {e}")
         return False
+    finally:
+        _compactacao_lock.release()
 
-def processar_contexto_mensagem(mensagem):
+def _assinatura_entrada(entrada):
     """
-    Usa o DeepSeek APENAS para extrair o contexto e mudança chave da mensagem
+    Muda sempre que o banco da entrada é alterado no lugar (só no modo journal,
+    em que cada alteração aplica um segmento); chamar com _cache_banco_lock
     """
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    prompt = f"""
-    Analise a seguinte mensagem relacionada a projetos de construção e extraia APENAS:
-    
-    1. Um breve contexto da informação
-    2. A mudança chave ou registro importante mencionado
-    
-    MENSAGEM: "{mensagem}"
-    
-    Retorne APENAS um JSON com a seguinte estrutura:
-    {{
-        "contexto": "breve descrição do contexto",
-        "mudanca_chave": "descrição clara da mudança ou registro"
-    }}
+    dados = entrada["dados"]
+    return (id(dados.get("mensagens")), len(dados.get("mensagens", [])),
+            len(dados.get("journal", {}).get("segmentos", [])))
+
+def _diferencas_mensagens(antigas, novas):
     """
-    
-    payload = {
-        "model": "deepseek-chat",
-        "messages": [
-            {
-                "role": "system", 
-                "content": "Você é um assistente especializado em análise de mensagens de projetos de construção civil. Extraia informações de contexto de forma preciso."
-            },
-            {
-                "role": "user", 
-                "content": prompt
-            }
-        ],
-        "temperature": 0.1,
-        "max_tokens": 500
-    }
-    
+    Mensagens novas e alteradas de uma revisão do banco em relação à anterior:
+    ([mensagem], [(mensagem, valores anteriores dos campos alterados)]).
+    Retorna None se alguma mensagem sumiu ou mudou de id.
+    """
+    por_chave = {(msg.get("projeto"), msg.get("mensagem_hash")): msg for msg in antigas}
+    adicionadas, alteradas = [], []
+    for msg in novas:
+        antiga = por_chave.pop((msg.get("projeto"), msg.get("mensagem_hash")), None)
+        if antiga is None:
+            adicionadas.append(msg)
+        elif antiga != msg:
+            if antiga.get("id") != msg.get("id"):
+                return None
+            alteradas.append((msg, {campo: antiga.get(campo) for campo in msg
+                                    if antiga.get(campo) != msg.get(campo)}))
+    if por_chave:
+        return None
+    return adicionadas, alteradas
+
+def _instalar_no_cache(caminho, dados, metadata, anterior, segmentos=()):
+    """
+    Guarda no cache os dados baixados, a menos que outra thread tenha trocado
+    a entrada durante o download (`anterior` é a entrada vista antes dele):
+    nesse caso vale a dela. Retorna a entrada em vigor.
+
+    Os índices da entrada anterior passam para a nova revisão, com as
+    mensagens novas e alteradas aplicadas a eles: uma gravação de outro
+    worker não obriga a reconstruir índices caros, como o de similares.
+    """
+    diferencas = None
+    if anterior is not None:
+        with _cache_banco_lock:
+            antigas = list(anterior["dados"].get("mensagens", [])) if anterior["indices"] else None
+            assinatura = _assinatura_entrada(anterior)
+        if antigas is not None:
+            # A comparação é feita fora da trava
+            diferencas = _diferencas_mensagens(antigas, dados.get("mensagens", []))
+
+    with _cache_banco_lock:
+        atual = _cache_banco.get(caminho)
+        if atual is not None and atual is not anterior:
+            return atual
+        _atualizar_cache_banco(caminho, dados, metadata)
+        entrada = _cache_banco[caminho]
+        entrada["segmentos_pendentes"].extend(segmentos)
+        if diferencas is not None and _assinatura_entrada(anterior) == assinatura:
+            adicionadas, alteradas = diferencas
+            entrada["indices"] = anterior["indices"]
+            for msg in adicionadas:
+                _indexar_mensagem_cache(entrada, msg)
+            for msg, anteriores in alteradas:
+                _reindexar_mensagem_cache(entrada, msg, anteriores)
+        return entrada
+
+def _criar_documento(caminho, novo):
+    """
+    Cria o arquivo com o conteúdo de `novo`. Se outro worker (ou thread) o
+    criou antes, ele é baixado em vez de sobrescrito. Retorna (dados, entrada).
+    """
+    dados = novo()
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=30)
-        response.raise_for_status()
-        response_data = response.json()
-        
-        conteudo = response_data['choices'][0]['message']['content']
-        
-        # Extrair JSON da resposta
-        json_match = re.search(r'\{.*\}', conteudo, re.DOTALL)
-        if json_match:
-            json_str = json_match.group()
-            dados = json.loads(json_str)
-            return dados
+        _enviar_documento(cliente_dropbox(), caminho, dados, dropbox.files.WriteMode.add)
+        print(f"✅ {caminho} salvo no Dropbox com sucesso!")
+    except ApiError as e:
+        if _conflito_de_escrita(e):
+            return _carregar_entrada(caminho, forcar_download=True, novo=novo)
+        print(f"❌ Erro ao salvar no Dropbox: {e}")
+    except Exception as e:
+        print(f"❌ Erro ao salvar no Dropbox: {e}")
+    with _cache_banco_lock:
+        entrada = _cache_banco.get(caminho)
+    return dados, (entrada if entrada is not None and entrada["dados"] is dados else None)
+
+def _carregar_entrada(caminho, forcar_download=False, novo=novo_banco, com_journal=True):
+    """
+    Carrega um arquivo JSON do Dropbox, usando o cache em memória enquanto
+    a revisão do arquivo não mudar. Se o arquivo não existir, ele é criado
+    com o conteúdo retornado por `novo`. Retorna (dados, entrada do cache),
+    com a entrada None quando os dados não estão em cache.
+
+    As chamadas ao Dropbox são feitas fora de _cache_banco_lock, que só é
+    tomado para ler e trocar a entrada: uma chamada lenta não trava as
+    demais threads do worker.
+    """
+    with _cache_banco_lock:
+        entrada = _cache_banco.get(caminho)
+        if (entrada and not forcar_download
+                and time.monotonic() - entrada["verificado_em"] < DB_CACHE_STALENESS_SECONDS):
+            # Dentro da janela de validade o cache é usado sem chamar o Dropbox
+            return entrada["dados"], entrada
+    journal = DB_JOURNAL_ENABLED and com_journal
+    try:
+        dbx = cliente_dropbox()
+
+        if entrada and not forcar_download:
+            # Consulta barata: só os metadados do arquivo
+            metadata = dbx.files_get_metadata(caminho)
+            if (metadata.rev == entrada["rev"]
+                    or (metadata.content_hash and metadata.content_hash == entrada["content_hash"])):
+                # Só os segmentos novos são baixados; se uma compactação apagou
+                # segmentos que o cache ainda não tem, o snapshot é baixado de novo
+                if not journal or _atualizar_journal_cache(dbx, caminho, entrada):
+                    with _cache_banco_lock:
+                        entrada["verificado_em"] = time.monotonic()
+                    return entrada["dados"], entrada
+
+        # Tenta baixar o arquivo
+        for _ in range(DB_WRITE_MAX_TENTATIVAS):
+            metadata, dados = _baixar_json(dbx, caminho)
+            # Reconstrói o estado a partir do snapshot e dos segmentos; se uma
+            # compactação terminou entre os dois downloads, o snapshot é relido
+            segmentos = _baixar_segmentos(dbx, caminho, dados) if journal else []
+            if segmentos is not None:
+                break
         else:
-            print("Erro: JSON não encontrado na resposta da API")
-            return {
-                "contexto": "Informação registrada via formulário",
-                "mudanca_chave": mensagem[:100] + "..." if len(mensagem) > 100 else mensagem
-            }
-            
+            raise RuntimeError("o journal mudou durante todas as leituras")
+        aplicados = _aplicar_segmentos(dados, segmentos)
+        atual = _instalar_no_cache(caminho, dados, metadata, entrada, aplicados)
+        print(f"✅ {caminho} carregado do Dropbox com sucesso!")
+        return atual["dados"], atual
+
+    except ApiError as e:
+        if _arquivo_nao_encontrado(e):
+            print(f"📁 {caminho} não encontrado no Dropbox. Criando novo arquivo...")
+            invalidar_cache_banco(caminho)
+            return _criar_documento(caminho, novo)
+        print(f"❌ Erro da API ao carregar do Dropbox: {e}")
+    except dropbox.exceptions.HttpError as e:
+        print(f"❌ Erro HTTP ao carregar do Dropbox: {e}")
     except Exception as e:
-        print(f"Erro ao processar contexto: {e}")
-        return {
-            "contexto": "Informação registrada via formulário",
-            "mudanca_chave": mensagem[:100] + "..." if len(mensagem) > 100 else mensagem
-        }
+        print(f"❌ Erro ao carregar do Dropbox: {e}")
 
-def salvar_mensagem(projeto_id, categoria, data_info, mensagem, lesson_learned):
+    # Em caso de falha, o último banco conhecido é melhor que um banco vazio
+    if entrada:
+        print("⚠️ Usando banco de dados em cache")
+        return entrada["dados"], entrada
+    return novo(), None
+
+def _carregar_documento(caminho, forcar_download=False, novo=novo_banco, com_journal=True):
+    """Dados do arquivo JSON do Dropbox (veja _carregar_entrada)"""
+    return _carregar_entrada(caminho, forcar_download, novo, com_journal)[0]
+
+def _migrar_para_shards():
     """
-    Salva os dados processados no Dropbox
+    Cria o manifesto do layout por projeto. Se o arquivo único existir, suas
+    mensagens são distribuídas nos arquivos de cada projeto.
     """
-    # Verificar duplicata antes de processar
-    if verificar_duplicata(projeto_id, categoria, mensagem):
-        return False, "Esta informação já foi registrada anteriormente."
-    
-    # Processar apenas o contexto e mudança chave com DeepSeek
-    dados_processados = processar_contexto_mensagem(mensagem)
-    
-    # Gerar hash único para a mensagem
-    mensagem_hash = gerar_hash_mensagem(projeto_id, categoria, mensagem)
+    manifesto = novo_manifesto()
+    try:
+        cliente_dropbox().files_get_metadata(DROPBOX_DB_PATH)
+    except ApiError as e:
+        if _arquivo_nao_encontrado(e):
+            return manifesto
+        raise
+
+    legado = _carregar_documento(DROPBOX_DB_PATH)
+    por_projeto = {}
+    for msg in legado.get("mensagens", []):
+        por_projeto.setdefault(msg.get("projeto") or "sem_projeto", []).append(msg)
+
+    for projeto_id, mensagens in por_projeto.items():
+        shard = novo_banco()
+        shard["mensagens"] = mensagens
+        reconstruir_estatisticas(shard)
+        shard["estatisticas"]["ultima_atualizacao"] = datetime.now().isoformat()
+        if not salvar_banco_dropbox(shard, caminho_banco(projeto_id)):
+            raise RuntimeError(f"falha ao gravar o arquivo do projeto {projeto_id}")
+        manifesto["projetos"][projeto_id] = {"arquivo": caminho_banco(projeto_id)}
+
+    manifesto["migrado_de"] = DROPBOX_DB_PATH
+    print(f"📦 Banco migrado para arquivos por projeto: {len(por_projeto)} projetos")
+    return manifesto
+
+def carregar_manifesto(forcar_download=False):
+    """Carrega o manifesto com a lista de arquivos por projeto"""
+    return _carregar_documento(DB_MANIFEST_PATH, forcar_download, novo=_migrar_para_shards, com_journal=False)
+
+def _registrar_shard(projeto_id):
+    """Inclui o projeto no manifesto, se ainda não estiver nele. Retorna (sucesso, mensagem)"""
+    def aplicar(manifesto, entrada):
+        if projeto_id in manifesto["projetos"]:
+            return True, None
+        manifesto["projetos"][projeto_id] = {"arquivo": caminho_banco(projeto_id)}
+
+    return _gravar_com_revisao(
+        DB_MANIFEST_PATH,
+        lambda forcar_download: _carregar_entrada(
+            DB_MANIFEST_PATH, forcar_download, novo=_migrar_para_shards, com_journal=False),
+        aplicar
+    )
+
+def _banco_combinado(forcar_download=False):
+    """Junta os arquivos de todos os projetos do manifesto num único banco"""
+    combinado = novo_banco()
+    for projeto_id in carregar_manifesto(forcar_download)["projetos"]:
+        banco = _carregar_documento(caminho_banco(projeto_id), forcar_download)
+        combinado["mensagens"].extend(banco.get("mensagens", []))
+        estatisticas = banco.get("estatisticas", {})
+        if "por_projeto" not in estatisticas:
+            estatisticas = reconstruir_estatisticas(banco)
+        combinado["estatisticas"]["por_projeto"].update(estatisticas["por_projeto"])
+        atualizacao = banco.get("estatisticas", {}).get("ultima_atualizacao")
+        if atualizacao and atualizacao > (combinado["estatisticas"]["ultima_atualizacao"] or ""):
+            combinado["estatisticas"]["ultima_atualizacao"] = atualizacao
+    combinado["estatisticas"]["total_mensagens"] = len(combinado["mensagens"])
+    return combinado
+
+def preparar_shard(projeto_id):
+    """
+    Garante, antes de uma gravação, que o projeto tem seu arquivo no layout
+    por projeto. Só projetos de projetos.csv são incluídos no manifesto: o
+    projeto_id vem do cliente. Retorna (sucesso, mensagem).
+    """
+    if not DB_SHARDING_ENABLED or projeto_id in carregar_manifesto()["projetos"]:
+        return True, None
+    if projeto_id not in {p["id"] for p in PROJETOS or []}:
+        return False, "Projeto não encontrado"
+    return _registrar_shard(projeto_id)
+
+def carregar_entrada_banco(forcar_download=False, projeto_id=None):
+    """
+    Carrega o banco de dados do Dropbox. No layout por projeto, com projeto_id
+    só o arquivo daquele projeto é lido; sem ele, todos os projetos são juntados.
+    Retorna (banco, entrada do cache); a junção de projetos não fica em cache.
+
+    Leituras nunca gravam no Dropbox: um projeto fora do manifesto (ainda sem
+    mensagens, ou inexistente) tem um banco vazio, sem entrada no cache. O
+    arquivo do projeto é criado na primeira gravação (veja preparar_shard).
+    """
+    if not DB_SHARDING_ENABLED:
+        return _carregar_entrada(DROPBOX_DB_PATH, forcar_download)
+    if not projeto_id:
+        return _banco_combinado(forcar_download), None
+
+    if projeto_id not in carregar_manifesto(forcar_download)["projetos"]:
+        return novo_banco(), None
+    return _carregar_entrada(caminho_banco(projeto_id), forcar_download)
+
+def carregar_banco_dropbox(forcar_download=False, projeto_id=None):
+    """Carrega o banco de dados do Dropbox (veja carregar_entrada_banco)"""
+    return carregar_entrada_banco(forcar_download, projeto_id)[0]
+
+# Índices em memória derivados do banco: nome -> (construir, adicionar).
+# Cada índice é construído uma vez por revisão do banco e atualizado a cada
+# mensagem adicionada por este processo.
+INDICES_BANCO = {}
+
+def registrar_indice(nome, construir, adicionar, atualizar=None):
+    """
+    Registra um índice construído a partir da lista de mensagens do banco.
+    `atualizar(indice, mensagem, anteriores)` acompanha alterações de campos
+    de uma mensagem já indexada; sem ele, o índice é descartado a cada
+    alteração e reconstruído quando for usado.
+    """
+    INDICES_BANCO[nome] = (construir, adicionar, atualizar)
+
+def _indice_entrada(entrada, nome):
+    """Índice da entrada do cache, construído no primeiro uso (chamar com _cache_banco_lock)"""
+    if nome not in entrada["indices"]:
+        entrada["indices"][nome] = INDICES_BANCO[nome][0](entrada["dados"].get("mensagens", []))
+    return entrada["indices"][nome]
+
+def obter_indice(nome, projeto_id=None, apenas_pronto=False):
+    """
+    Retorna o índice da revisão atual do banco, construindo-o se necessário.
+    Com `apenas_pronto`, retorna None em vez de construir.
+    """
+    construir = INDICES_BANCO[nome][0]
+    banco, entrada = carregar_entrada_banco(projeto_id=projeto_id)
+    if entrada is None:
+        # Banco fora do cache (falha no Dropbox ou junção de projetos): índice descartável
+        return None if apenas_pronto else construir(banco.get("mensagens", []))
+    with _cache_banco_lock:
+        indice = entrada["indices"].get(nome)
+        if indice is not None or apenas_pronto:
+            return indice
+        mensagens = list(entrada["dados"].get("mensagens", []))
+        assinatura = _assinatura_entrada(entrada)
+
+    # A construção, que pode levar segundos, é feita fora da trava
+    indice = construir(mensagens)
+    with _cache_banco_lock:
+        if nome in entrada["indices"]:
+            return entrada["indices"][nome]
+        if _assinatura_entrada(entrada) != assinatura:
+            # O banco em cache recebeu segmentos do journal durante a construção
+            return _indice_entrada(entrada, nome)
+        entrada["indices"][nome] = indice
+        return indice
+
+def _indexar_mensagem_cache(entrada, mensagem):
+    for nome, indice in entrada["indices"].items():
+        adicionar = INDICES_BANCO[nome][1]
+        adicionar(indice, mensagem)
+
+def _reindexar_mensagem_cache(entrada, mensagem, anteriores):
+    for nome in list(entrada["indices"]):
+        atualizar = INDICES_BANCO[nome][2]
+        if atualizar is None:
+            del entrada["indices"][nome]
+        else:
+            atualizar(entrada["indices"][nome], mensagem, anteriores)
+
+def _enviar_documento(dbx, caminho, dados, modo):
+    """Faz upload do arquivo e guarda a versão enviada em cache"""
+    metadata = _enviar_json(dbx, caminho, dados, modo)
     
+    # O banco salvo passa a ser a versão em cache, com a nova revisão
+    _atualizar_cache_banco(caminho, dados, metadata)
+
+def salvar_banco_dropbox(dados, caminho=DROPBOX_DB_PATH):
+    """Salva o banco de dados no Dropbox"""
     try:
-        # Carrega o banco atual
-        banco = carregar_banco_dropbox()
+        dbx = cliente_dropbox()
+        _enviar_documento(dbx, caminho, dados, dropbox.files.WriteMode.overwrite)
+        print(f"✅ {caminho} salvo no Dropbox com sucesso!")
+        return True
         
-        # Cria nova mensagem
-        nova_mensagem = {
-            "id": len(banco["mensagens"]) + 1,
-            "timestamp": data_info,
-            "remetente": None,
-            "categoria": categoria,
-            "contexto": dados_processados.get("contexto", ""),
-            "mudanca_chave": dados_processados.get("mudanca_chave", ""),
-            "mensagem_original": mensagem,
-            "projeto": projeto_id,
-            "lesson_learned": lesson_learned,
-            "mensagem_hash": mensagem_hash
-        }
+    except Exception as e:
+        # Os dados em memória podem ter sido alterados sem chegar ao Dropbox
+        invalidar_cache_banco(caminho)
+        print(f"❌ Erro ao salvar no Dropbox: {e}")
+        return False
+
+def _copia_para_gravacao(dados):
+    """
+    Cópia do documento em cache que `aplicar` pode alterar sem mexer no
+    cache. A lista de mensagens é copiada, mas não as mensagens, que nunca
+    são alteradas no lugar (veja _aplicar_atualizacao); o resto do documento
+    (estatísticas, journal, manifesto) é pequeno e é copiado por inteiro.
+    """
+    copia = {chave: copy.deepcopy(valor) for chave, valor in dados.items() if chave != "mensagens"}
+    if "mensagens" in dados:
+        copia["mensagens"] = list(dados["mensagens"])
+    return copia
+
+def _gravar_com_revisao(caminho, carregar, aplicar, indexar=None):
+    """
+    Leitura-modificação-escrita otimista de um arquivo do Dropbox: o upload usa
+    WriteMode.update(rev) e, se outro worker gravou antes, o arquivo é relido,
+    `aplicar` é chamado de novo e o upload é repetido.
+
+    `carregar(forcar_download)` devolve (dados, entrada do cache) e
+    `aplicar(dados, entrada)` altera uma cópia dos dados da entrada; se
+    `aplicar` retornar uma tupla (sucesso, mensagem), nada é gravado e ela é
+    devolvida. Retorna (sucesso, mensagem).
+
+    _cache_banco_lock só é tomado para copiar os dados e, depois do upload,
+    para trocar a entrada do cache pela nova revisão, se ninguém a trocou
+    nesse meio tempo; `indexar(entrada)` atualiza os índices herdados da
+    entrada anterior junto com a troca. Downloads e uploads ficam fora dele.
+    """
+    for tentativa in range(DB_WRITE_MAX_TENTATIVAS):
+        _, entrada = carregar(tentativa > 0)
+        if entrada is None:
+            # Sem revisão conhecida não há como gravar sem risco de sobrescrever
+            return False, "Erro ao carregar o banco de dados"
+
+        with _cache_banco_lock:
+            rev = entrada["rev"]
+            dados = _copia_para_gravacao(entrada["dados"])
+            desistencia = aplicar(dados, entrada)
+        if desistencia is not None:
+            return desistencia
+
+        try:
+            metadata = _enviar_json(cliente_dropbox(), caminho, dados, dropbox.files.WriteMode.update(rev))
+        except ApiError as e:
+            if not _conflito_de_escrita(e):
+                print(f"❌ Erro ao salvar no Dropbox: {e}")
+                return False, "Erro ao salvar no banco de dados"
+        except Exception as e:
+            print(f"❌ Erro ao salvar no Dropbox: {e}")
+            return False, "Erro ao salvar no banco de dados"
+        else:
+            with _cache_banco_lock:
+                if _cache_banco.get(caminho) is entrada:
+                    _cache_banco[caminho] = nova = {
+                        "dados": dados,
+                        "rev": getattr(metadata, "rev", None),
+                        "content_hash": getattr(metadata, "content_hash", None),
+                        "verificado_em": time.monotonic(),
+                        "indices": entrada["indices"],
+                        "segmentos_pendentes": entrada["segmentos_pendentes"]
+                    }
+                    if indexar is not None:
+                        indexar(nova)
+                # Se outra thread trocou a entrada, a revisão nova é baixada na próxima verificação
+            return True, None
+
+        espera = DB_WRITE_BACKOFF_SECONDS * (2 ** tentativa) * random.uniform(0.5, 1.5)
+        print(f"⚠️ Conflito de revisão ao salvar {caminho} (tentativa {tentativa + 1}); nova tentativa em {espera:.2f}s")
+        time.sleep(espera)
+
+    return False, "Erro ao salvar no banco de dados: muitas gravações simultâneas, tente novamente"
+
+def anexar_mensagens_com_revisao(projeto_id, mensagens):
+    """
+    Acrescenta mensagens ao banco do projeto num único upload, sem risco de
+    perder gravações simultâneas de outros workers; a cada nova tentativa as
+    duplicatas são verificadas de novo e as mensagens recebem novos ids.
+    Retorna (sucesso, mensagem, gravadas); duplicatas são ignoradas.
+    """
+    gravadas = []
+
+    def aplicar(banco, entrada):
+        gravadas.clear()
+        hashes = set(_indice_entrada(entrada, "hashes").get(projeto_id, ()))
+        for nova_mensagem in mensagens:
+            if nova_mensagem["mensagem_hash"] in hashes:
+                continue
+            hashes.add(nova_mensagem["mensagem_hash"])
+            nova_mensagem["id"] = _proximo_id(banco)
+            _aplicar_mensagem(banco, nova_mensagem)
+            gravadas.append(nova_mensagem)
+        if not gravadas:
+            return True, None
+
+    def indexar(entrada):
+        for nova_mensagem in gravadas:
+            _indexar_mensagem_cache(entrada, nova_mensagem)
+
+    sucesso, mensagem = _gravar_com_revisao(
+        caminho_banco(projeto_id),
+        lambda forcar_download: carregar_entrada_banco(forcar_download, projeto_id),
+        aplicar,
+        indexar
+    )
+    if not sucesso:
+        return False, mensagem, []
+    return True, "Informação registrada com sucesso!", gravadas
+
+def atualizar_mensagens_com_revisao(projeto_id, atualizacoes):
+    """
+    Altera campos de mensagens já gravadas no banco do projeto num único
+    upload. Retorna (sucesso, mensagem, [(projeto, mensagem_hash) alteradas]);
+    mensagens que não estão no banco são ignoradas.
+    """
+    alteradas = []
+
+    def aplicar(banco, entrada):
+        alteradas.clear()
+        for atualizacao in atualizacoes:
+            alterada = _aplicar_atualizacao(banco, atualizacao)
+            if alterada is not None:
+                alteradas.append(alterada)
+        if not alteradas:
+            return True, None
+
+    def indexar(entrada):
+        for alterada in alteradas:
+            _reindexar_mensagem_cache(entrada, *alterada)
+
+    sucesso, mensagem = _gravar_com_revisao(
+        caminho_banco(projeto_id),
+        lambda forcar_download: carregar_entrada_banco(forcar_download, projeto_id),
+        aplicar,
+        indexar
+    )
+    if not sucesso:
+        return False, mensagem, []
+    return True, "Mensagens atualizadas", [(m["projeto"], m["mensagem_hash"]) for m, _ in alteradas]
+
+def anexar_mensagem_com_revisao(nova_mensagem):
+    """Acrescenta uma mensagem ao banco do seu projeto. Retorna (sucesso, mensagem)"""
+    sucesso, mensagem, gravadas = anexar_mensagens_com_revisao(nova_mensagem["projeto"], [nova_mensagem])
+    if sucesso and not gravadas:
+        return False, "Esta informação já foi registrada anteriormente."
+    return sucesso, mensagem
+
+def _filtrar_mensagens(mensagens, projeto_id=None, categoria=None, inicio=None, fim=None):
+    """Filtra mensagens por projeto, categoria e intervalo de datas (timestamps ISO)"""
+    for msg in mensagens:
+        if projeto_id and msg.get("projeto") != projeto_id:
+            continue
+        if categoria and msg.get("categoria") != categoria:
+            continue
+        timestamp = msg.get("timestamp") or ""
+        if inicio and timestamp < inicio:
+            continue
+        if fim and timestamp > fim:
+            continue
+        yield msg
+
+class Armazenamento(abc.ABC):
+    """
+    Interface dos backends de armazenamento das mensagens. As mensagens são
+    dicionários com os campos de CAMPOS_MENSAGEM.
+    """
+
+    @abc.abstractmethod
+    def inicializar(self):
+        """Prepara o armazenamento na subida da aplicação"""
+
+    @abc.abstractmethod
+    def carregar(self, projeto_id=None):
+        """Retorna o banco (ou só o projeto) no formato de DB_STRUCTURE"""
+
+    @abc.abstractmethod
+    def existe_hash(self, projeto_id, mensagem_hash):
+        """Indica se o projeto já tem uma mensagem com esse hash"""
+
+    @abc.abstractmethod
+    def anexar(self, mensagem):
+        """Grava uma nova mensagem, atribuindo seu id. Retorna (sucesso, mensagem)"""
+
+    def atualizar(self, projeto_id, mensagem_hash, campos):
+        """Altera CAMPOS_ENRIQUECIMENTO de uma mensagem gravada. Retorna (sucesso, mensagem)"""
+        sucesso, mensagem, atualizadas = self.atualizar_lote(
+            [{"projeto": projeto_id, "mensagem_hash": mensagem_hash, "campos": campos}])
+        if sucesso and not atualizadas:
+            return False, "Mensagem não encontrada"
+        return sucesso, mensagem
+
+    @abc.abstractmethod
+    def atualizar_lote(self, atualizacoes):
+        """
+        Aplica [{"projeto", "mensagem_hash", "campos"}] com o mínimo de gravações.
+        Retorna (sucesso, mensagem, [(projeto, mensagem_hash) das mensagens alteradas])
+        """
+
+    @abc.abstractmethod
+    def obter_mensagem(self, projeto_id, mensagem_hash):
+        """Retorna a mensagem do projeto com esse hash, ou None"""
+
+    @abc.abstractmethod
+    def consultar(self, projeto_id=None, categoria=None, inicio=None, fim=None, limite=None):
+        """Itera as mensagens filtradas, em ordem de gravação"""
+
+    @abc.abstractmethod
+    def paginar(self, projeto_id=None, categoria=None, lesson_learned=None, inicio=None, fim=None,
+                cursor=None, limite=MENSAGENS_PAGINA_PADRAO, crescente=False, campos=None):
+        """
+        Uma página das mensagens filtradas, em ordem de (id, projeto) — decrescente
+        por padrão. `cursor` é o (id, projeto) da última mensagem da página
+        anterior. Cada mensagem traz os `campos` pedidos, além de id e projeto.
+        """
+
+    @abc.abstractmethod
+    def estatisticas(self, projeto_id=None):
+        """Retorna {"total", "por_categoria": {categoria: quantidade}, "lessons_learned"}"""
+
+    @abc.abstractmethod
+    def reconstruir_estatisticas(self):
+        """Recalcula os contadores de estatísticas a partir das mensagens gravadas"""
+
+    @abc.abstractmethod
+    def obter_indice(self, nome, projeto_id=None, apenas_pronto=False):
+        """
+        Retorna o índice registrado em INDICES_BANCO para a versão atual dos
+        dados. Com `apenas_pronto`, retorna None se ele tiver de ser construído
+        do zero, em vez de construí-lo.
+        """
+
+    @abc.abstractmethod
+    def versao(self, projeto_id=None):
+        """Valor que muda sempre que as mensagens (do projeto) mudam; None se desconhecida"""
+
+    @abc.abstractmethod
+    def alteradas(self, projeto_id=None, desde=0):
+        """
+        Mensagens com "versao" maior que `desde`, em ordem de versão. A versão
+        de uma mensagem cresce a cada alteração dela (no SQLite, também na inclusão)
+        """
+
+    @abc.abstractmethod
+    def fazer_backup(self):
+        """Grava uma cópia das mensagens no Dropbox. Retorna (sucesso, mensagem)"""
+
+    @abc.abstractmethod
+    def restaurar_backup(self):
+        """Recarrega as mensagens a partir da cópia no Dropbox. Retorna (sucesso, mensagem)"""
+
+class FilaGravacao:
+    """
+    Fila write-behind: cada mensagem é gravada primeiro num log local (com
+    fsync) e já pode ser confirmada ao usuário; uma thread junta as mensagens
+    pendentes e as envia com `enviar(lote)` a cada janela ou ao atingir o
+    limite de mensagens. `enviar` retorna as mensagens resolvidas (gravadas ou
+    descartadas como duplicatas); as demais continuam na fila.
+    """
+
+    def __init__(self, enviar, pasta, janela_segundos, max_mensagens):
+        self.enviar = enviar
+        self.pasta = pasta
+        self.janela_segundos = janela_segundos
+        self.max_mensagens = max_mensagens
+        self._pendentes = []
+        self._condicao = threading.Condition()
+        self._envio_lock = threading.Lock()
+        self._arquivo = None
+        self._trava = None
+
+    def iniciar(self):
+        """Abre o log local do worker, recupera logs órfãos e inicia a thread de envio"""
+        os.makedirs(self.pasta, exist_ok=True)
+        self._arquivo = os.path.join(self.pasta, f"fila_{os.getpid()}.jsonl")
+        # A trava indica aos outros workers que este log tem dono vivo
+        self._trava = open(self._arquivo + ".lock", "w")
+        if fcntl is not None:
+            fcntl.flock(self._trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        # Log de um worker anterior com o mesmo pid (comum em contêineres):
+        # as mensagens dele já foram confirmadas e continuam na fila
+        try:
+            self._pendentes = self._ler_log(self._arquivo)
+        except FileNotFoundError:
+            pass
+        if self._pendentes:
+            print(f"♻️ {len(self._pendentes)} mensagens recuperadas de {os.path.basename(self._arquivo)}")
+        self._recuperar_orfaos()
+        threading.Thread(target=self._executar, daemon=True).start()
+        atexit.register(self.encerrar)
+
+    @staticmethod
+    def _ler_log(caminho):
+        """Mensagens de um log local; uma última linha incompleta (queda no meio da escrita) é ignorada"""
+        mensagens = []
+        with open(caminho, encoding="utf-8") as log:
+            for linha in log:
+                if not linha.endswith("\n"):
+                    break  # a mensagem não chegou a ser confirmada
+                if linha.strip():
+                    mensagens.append(json.loads(linha))
+        return mensagens
+
+    @staticmethod
+    def _abrir_trava_orfao(caminho):
+        """
+        Abre a trava de um log de outro worker, sem recriá-la se ela sumiu
+        junto com o log (outro worker já o adotou). Retorna (trava ou None,
+        se a trava foi criada agora).
+        """
+        try:
+            return open(caminho + ".lock", "r+"), False
+        except FileNotFoundError:
+            pass
+        if not os.path.exists(caminho):
+            return None, False
+        # Log sem trava: só um dos workers que o encontrarem consegue criá-la
+        try:
+            descritor = os.open(caminho + ".lock", os.O_RDWR | os.O_CREAT | os.O_EXCL)
+        except FileExistsError:
+            return None, False
+        return os.fdopen(descritor, "r+"), True
+
+    def _recuperar_orfaos(self):
+        """Adota as mensagens de logs deixados por workers encerrados sem enviar tudo"""
+        for nome in sorted(os.listdir(self.pasta)):
+            caminho = os.path.join(self.pasta, nome)
+            if not nome.endswith(".jsonl") or caminho == self._arquivo:
+                continue
+            trava, criada = self._abrir_trava_orfao(caminho)
+            if trava is None:
+                continue
+            with trava:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except OSError:
+                        continue  # o dono ainda está vivo
+                try:
+                    mensagens = self._ler_log(caminho)
+                except FileNotFoundError:
+                    # Adotado por outro worker enquanto esperávamos a trava
+                    if criada:
+                        os.remove(caminho + ".lock")
+                    continue
+                for mensagem in mensagens:
+                    self.enfileirar(mensagem)
+                os.remove(caminho)
+                os.remove(caminho + ".lock")
+            if mensagens:
+                print(f"♻️ {len(mensagens)} mensagens recuperadas de {nome}")
+
+    def enfileirar(self, mensagem):
+        """Grava a mensagem no log local de forma durável e a coloca na fila"""
+        with self._condicao:
+            with open(self._arquivo, "a", encoding="utf-8") as log:
+                log.write(json.dumps(mensagem, ensure_ascii=False) + "\n")
+                log.flush()
+                os.fsync(log.fileno())
+            self._pendentes.append(mensagem)
+            self._condicao.notify_all()
+
+    def _pendente(self, projeto_id, mensagem_hash):
+        for mensagem in self._pendentes:
+            if mensagem["projeto"] == projeto_id and mensagem["mensagem_hash"] == mensagem_hash:
+                return mensagem
+        return None
+
+    def obter_pendente(self, projeto_id, mensagem_hash):
+        """Retorna uma cópia da mensagem que está na fila, ainda não enviada, ou None"""
+        with self._condicao:
+            mensagem = self._pendente(projeto_id, mensagem_hash)
+            return dict(mensagem) if mensagem is not None else None
+
+    def contem_hash(self, projeto_id, mensagem_hash):
+        """Indica se uma mensagem igual está na fila, ainda não enviada"""
+        return self.obter_pendente(projeto_id, mensagem_hash) is not None
+
+    def atualizar_pendente(self, projeto_id, mensagem_hash, campos):
+        """Altera uma mensagem ainda não enviada. Retorna False se ela não está na fila"""
+        # Com o envio travado a mensagem ou está na fila ou já foi gravada
+        with self._envio_lock:
+            with self._condicao:
+                mensagem = self._pendente(projeto_id, mensagem_hash)
+                if mensagem is None:
+                    return False
+                mensagem.update(campos)
+                self._regravar_log()
+                return True
+
+    def _executar(self):
+        while True:
+            with self._condicao:
+                self._condicao.wait_for(lambda: self._pendentes)
+                # Janela de agrupamento, encerrada antes se o lote encher
+                self._condicao.wait_for(lambda: len(self._pendentes) >= self.max_mensagens,
+                                        timeout=self.janela_segundos)
+            if not self.descarregar():
+                time.sleep(self.janela_segundos)
+
+    def descarregar(self):
+        """Envia as mensagens pendentes. Retorna True se a fila ficou vazia"""
+        with self._envio_lock:
+            with self._condicao:
+                lote = list(self._pendentes)
+            if not lote:
+                return True
+            try:
+                resolvidas = self.enviar(lote)
+            except Exception as e:
+                print(f"❌ Erro ao enviar a fila de gravação: {e}")
+                resolvidas = []
+            with self._condicao:
+                ids_resolvidas = {id(m) for m in resolvidas}
+                self._pendentes = [m for m in self._pendentes if id(m) not in ids_resolvidas]
+                self._regravar_log()
+                vazia = not self._pendentes
+            if resolvidas:
+                print(f"✅ Fila de gravação: {len(resolvidas)} mensagens enviadas num único lote")
+            return vazia
+
+    def _regravar_log(self):
+        # O log local passa a conter só o que ainda não foi enviado. O novo
+        # conteúdo é gravado ao lado e troca o log de uma vez: uma queda no
+        # meio da regravação não perde mensagens já confirmadas
+        temporario = self._arquivo + ".tmp"
+        with open(temporario, "w", encoding="utf-8") as log:
+            for mensagem in self._pendentes:
+                log.write(json.dumps(mensagem, ensure_ascii=False) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+        os.replace(temporario, self._arquivo)
+        if hasattr(os, "O_DIRECTORY"):
+            # A troca de nomes também precisa chegar ao disco
+            pasta = os.open(self.pasta, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(pasta)
+            finally:
+                os.close(pasta)
+
+    def encerrar(self):
+        """Envia o que estiver pendente antes de o processo sair"""
+        for _ in range(3):
+            if self.descarregar():
+                return
+        print("⚠️ Fila de gravação não foi esvaziada; as mensagens ficam no log local para o próximo worker")
+
+class ArmazenamentoDropbox(Armazenamento):
+    """Mensagens em JSON no Dropbox (arquivo único, journal ou um arquivo por projeto)"""
+
+    def __init__(self):
+        self.fila = None
+        if DB_WRITE_BEHIND_ENABLED:
+            self.fila = FilaGravacao(self.anexar_lote, DB_WRITE_BEHIND_DIR,
+                                     DB_WRITE_BEHIND_JANELA_MS / 1000, DB_WRITE_BEHIND_MAX_MENSAGENS)
+
+    def inicializar(self):
+        # Inicializar banco no Dropbox se não existir
+        carregar_banco_dropbox()
+        if self.fila is not None:
+            self.fila.iniciar()
+
+    def carregar(self, projeto_id=None):
+        return carregar_banco_dropbox(projeto_id=projeto_id)
+
+    def existe_hash(self, projeto_id, mensagem_hash):
+        if self.fila is not None and self.fila.contem_hash(projeto_id, mensagem_hash):
+            return True
+        return mensagem_hash in obter_indice("hashes", projeto_id).get(projeto_id, ())
+
+    def anexar(self, mensagem):
+        sucesso, resultado = preparar_shard(mensagem["projeto"])
+        if not sucesso:
+            return False, resultado
+        if self.fila is not None:
+            # Confirmada após a gravação no log local; o upload vem em lote
+            self.fila.enfileirar(mensagem)
+            return True, "Informação registrada com sucesso!"
+
+        projeto_id = mensagem["projeto"]
+        if not DB_JOURNAL_ENABLED:
+            # Adiciona à lista e regrava o banco, se ninguém gravou antes
+            return anexar_mensagem_com_revisao(mensagem)
+
+        # Grava só a mensagem nova, como segmento do journal; o banco precisa
+        # estar em cache para receber a mensagem e o id
+        carregar_banco_dropbox(projeto_id=projeto_id)
+        if anexar_ao_journal([mensagem], caminho_banco(projeto_id)):
+            return True, "Informação registrada com sucesso!"
+        return False, "Erro ao salvar no banco de dados"
+
+    def atualizar_lote(self, atualizacoes):
+        atualizadas = []
+        por_projeto = {}
+        for atualizacao in atualizacoes:
+            chave = (atualizacao["projeto"], atualizacao["mensagem_hash"])
+            # Mensagens ainda na fila de gravação são alteradas lá mesmo
+            if self.fila is not None and self.fila.atualizar_pendente(*chave, atualizacao["campos"]):
+                atualizadas.append(chave)
+            else:
+                por_projeto.setdefault(atualizacao["projeto"], []).append(atualizacao)
+
+        sucesso, mensagem = True, "Mensagens atualizadas"
+        for projeto_id, grupo in por_projeto.items():
+            if DB_SHARDING_ENABLED and projeto_id not in carregar_manifesto()["projetos"]:
+                continue  # projeto sem arquivo: nenhuma das mensagens existe
+            if DB_JOURNAL_ENABLED:
+                carregar_banco_dropbox(projeto_id=projeto_id)
+                if atualizar_no_journal(grupo, caminho_banco(projeto_id)):
+                    atualizadas.extend((a["projeto"], a["mensagem_hash"]) for a in grupo)
+                else:
+                    sucesso, mensagem = False, "Erro ao salvar no banco de dados"
+            else:
+                gravou, resultado, alteradas = atualizar_mensagens_com_revisao(projeto_id, grupo)
+                atualizadas.extend(alteradas)
+                if not gravou:
+                    sucesso, mensagem = False, resultado
+        return sucesso, mensagem, atualizadas
+
+    def obter_mensagem(self, projeto_id, mensagem_hash):
+        if self.fila is not None:
+            pendente = self.fila.obter_pendente(projeto_id, mensagem_hash)
+            if pendente is not None:
+                return pendente
+        indice = obter_indice("mensagens_por_hash", projeto_id)
+        with _cache_banco_lock:
+            mensagem = indice.get((projeto_id, mensagem_hash))
+            return dict(mensagem) if mensagem is not None else None
+
+    def anexar_lote(self, mensagens):
+        """
+        Grava as mensagens com um upload por projeto. Retorna as mensagens
+        resolvidas (gravadas ou descartadas como duplicatas).
+        """
+        por_projeto = {}
+        for mensagem in mensagens:
+            por_projeto.setdefault(mensagem["projeto"], []).append(mensagem)
+
+        resolvidas = []
+        for projeto_id, grupo in por_projeto.items():
+            if not preparar_shard(projeto_id)[0]:
+                continue
+            if DB_JOURNAL_ENABLED:
+                carregar_banco_dropbox(projeto_id=projeto_id)
+                sucesso = anexar_ao_journal(grupo, caminho_banco(projeto_id))
+            else:
+                sucesso, _, _ = anexar_mensagens_com_revisao(projeto_id, grupo)
+            if sucesso:
+                resolvidas.extend(grupo)
+        return resolvidas
+
+    def consultar(self, projeto_id=None, categoria=None, inicio=None, fim=None, limite=None):
+        mensagens = self.carregar(projeto_id).get("mensagens", [])
+        filtradas = _filtrar_mensagens(mensagens, projeto_id, categoria, inicio, fim)
+        return itertools.islice(filtradas, limite)
+
+    def paginar(self, projeto_id=None, categoria=None, lesson_learned=None, inicio=None, fim=None,
+                cursor=None, limite=MENSAGENS_PAGINA_PADRAO, crescente=False, campos=None):
+        # No layout por projeto, os ids só são únicos dentro de cada arquivo:
+        # sem projeto, as páginas de cada um são intercaladas por (id, projeto)
+        if DB_SHARDING_ENABLED and not projeto_id:
+            projetos = carregar_manifesto()["projetos"]
+        else:
+            projetos = [projeto_id]
+        campos = list(dict.fromkeys(["id", "projeto"] + list(campos or CAMPOS_MENSAGEM)))
+        indices = [obter_indice("paginacao", projeto) for projeto in projetos]
+        filtro = (projeto_id, categoria, lesson_learned)
+        with _cache_banco_lock:
+            # As listas das chaves que atendem aos filtros, intercaladas na ordem da página
+            fontes = [_percorrer_paginacao(lista, cursor, crescente, inicio, fim, limite)
+                      for indice in indices for chave, lista in indice.items()
+                      if all(valor is None or valor == parte for valor, parte in zip(filtro, chave))]
+            selecionadas = heapq.merge(*fontes, key=_chave_paginacao, reverse=not crescente)
+            return [{campo: msg.get(campo) for campo in campos}
+                    for msg in itertools.islice(selecionadas, limite)]
+
+    def _bancos(self, projeto_id=None):
+        """Bancos a consultar: um por projeto no layout por projeto, senão o arquivo único"""
+        if DB_SHARDING_ENABLED and not projeto_id:
+            return [self.carregar(p) for p in carregar_manifesto()["projetos"]]
+        return [self.carregar(projeto_id)]
+
+    def estatisticas(self, projeto_id=None):
+        # Lidas dos contadores mantidos a cada gravação, sem percorrer as mensagens
+        total = 0
+        por_categoria = {}
+        lessons_learned = 0
+        for banco in self._bancos(projeto_id):
+            estatisticas = banco.get("estatisticas", {})
+            if "por_projeto" not in estatisticas:
+                estatisticas = reconstruir_estatisticas(banco)
+            for projeto, contadores in estatisticas["por_projeto"].items():
+                if projeto_id and projeto != projeto_id:
+                    continue
+                total += contadores["total"]
+                lessons_learned += contadores["lessons_learned"]
+                for cat, quantidade in contadores["por_categoria"].items():
+                    por_categoria[cat] = por_categoria.get(cat, 0) + quantidade
+        return {"total": total, "por_categoria": por_categoria, "lessons_learned": lessons_learned}
+
+    def reconstruir_estatisticas(self):
+        if DB_SHARDING_ENABLED:
+            projetos = list(carregar_manifesto()["projetos"])
+        else:
+            projetos = [None]
+        def aplicar(banco, entrada):
+            reconstruir_estatisticas(banco)
+
+        for projeto_id in projetos:
+            sucesso, mensagem = _gravar_com_revisao(
+                caminho_banco(projeto_id),
+                lambda forcar_download, p=projeto_id: carregar_entrada_banco(forcar_download, p),
+                aplicar
+            )
+            if not sucesso:
+                return False, mensagem
+        return True, f"Estatísticas reconstruídas ({len(projetos)} arquivo(s))"
+
+    def obter_indice(self, nome, projeto_id=None, apenas_pronto=False):
+        return obter_indice(nome, projeto_id, apenas_pronto)
+
+    def alteradas(self, projeto_id=None, desde=0):
+        mensagens = self.carregar(projeto_id).get("mensagens", [])
+        return sorted((msg for msg in mensagens if (msg.get("versao") or 0) > desde),
+                      key=lambda msg: msg["versao"])
+
+    def versao(self, projeto_id=None):
+        if DB_SHARDING_ENABLED and not projeto_id:
+            projetos = list(carregar_manifesto()["projetos"])
+        else:
+            projetos = [projeto_id]
+        partes = []
+        for projeto in projetos:
+            banco, entrada = carregar_entrada_banco(projeto_id=projeto)
+            if entrada is None:
+                return None
+            with _cache_banco_lock:
+                # Revisão do arquivo mais os segmentos do journal já aplicados
+                segmentos = len(banco.get("journal", {}).get("segmentos", []))
+                partes.append(f"{entrada['rev']}+{segmentos}")
+        return "|".join(partes)
+
+    def fazer_backup(self):
+        # Os arquivos do Dropbox já são o backup: regravar o banco em cache
+        # sobrescreveria gravações recentes de outros workers. Basta enviar a
+        # fila de gravação e conferir que os arquivos estão no Dropbox.
+        try:
+            if self.fila is not None and not self.fila.descarregar():
+                return False, "Erro ao fazer backup: mensagens da fila de gravação não foram enviadas"
+            if DB_SHARDING_ENABLED:
+                projetos = list(carregar_manifesto(forcar_download=True)["projetos"])
+            else:
+                projetos = [None]
+            total = 0
+            for projeto_id in projetos:
+                banco, entrada = carregar_entrada_banco(forcar_download=True, projeto_id=projeto_id)
+                if entrada is None:
+                    return False, "Erro ao fazer backup: Dropbox indisponível"
+                total += len(banco.get("mensagens", []))
+            return True, f"Backup salvo no Dropbox com sucesso! ({total} mensagens)"
+            
+        except Exception as e:
+            return False, f"Erro ao fazer upload: {e}"
+
+    def restaurar_backup(self):
+        try:
+            # Simplesmente recarrega o banco - já está sincronizado
+            carregar_banco_dropbox(forcar_download=True)
+            return True, "Backup restaurado do Dropbox com sucesso!"
+            
+        except Exception as e:
+            return False, f"Erro ao baixar: {e}"
+
+SCHEMA_SQLITE = """
+CREATE TABLE IF NOT EXISTS mensagens (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    remetente TEXT,
+    categoria TEXT,
+    contexto TEXT,
+    mudanca_chave TEXT,
+    mensagem_original TEXT,
+    projeto TEXT,
+    lesson_learned TEXT,
+    mensagem_hash TEXT,
+    status_enriquecimento TEXT,
+    versao INTEGER
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mensagens_projeto_hash ON mensagens (projeto, mensagem_hash);
+CREATE INDEX IF NOT EXISTS idx_mensagens_projeto ON mensagens (projeto);
+CREATE INDEX IF NOT EXISTS idx_mensagens_projeto_categoria ON mensagens (projeto, categoria);
+CREATE INDEX IF NOT EXISTS idx_mensagens_projeto_timestamp ON mensagens (projeto, timestamp);
+CREATE INDEX IF NOT EXISTS idx_mensagens_categoria ON mensagens (categoria);
+CREATE INDEX IF NOT EXISTS idx_mensagens_timestamp ON mensagens (timestamp);
+CREATE INDEX IF NOT EXISTS idx_mensagens_projeto_lesson ON mensagens (projeto, lesson_learned);
+CREATE TABLE IF NOT EXISTS contadores (
+    projeto TEXT NOT NULL,
+    categoria TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    lessons_learned INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (projeto, categoria)
+);
+CREATE TABLE IF NOT EXISTS controle (
+    chave TEXT PRIMARY KEY,
+    valor INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO controle (chave, valor) VALUES ('versao', 0);
+INSERT OR IGNORE INTO controle (chave, valor) VALUES ('reconstrucao', 0);
+"""
+
+class ArmazenamentoSQLite(Armazenamento):
+    """
+    Mensagens num banco SQLite local, com consultas indexadas e gravações
+    transacionais. O Dropbox passa a guardar uma cópia em JSON, atualizada
+    em segundo plano, de onde o banco é recriado se o disco local estiver vazio.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        self._indices = {}
+        self._indices_lock = threading.Lock()
+        self._replicacao = None
+        self._replicacao_lock = threading.Lock()
+
+    def _conexao(self):
+        # Conexões SQLite não podem ser compartilhadas entre threads
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def _incrementar_versao(self, conexao):
+        conexao.execute("UPDATE controle SET valor = valor + 1 WHERE chave = 'versao'")
+        return conexao.execute("SELECT valor FROM controle WHERE chave = 'versao'").fetchone()[0]
+
+    def versao(self, projeto_id=None):
+        # Número que muda a cada gravação no banco, de qualquer worker
+        return self._conexao().execute("SELECT valor FROM controle WHERE chave = 'versao'").fetchone()[0]
+
+    def inicializar(self):
+        conexao = self._conexao()
+        conexao.executescript(SCHEMA_SQLITE)
+        colunas = {linha["name"] for linha in conexao.execute("PRAGMA table_info(mensagens)")}
+        if "status_enriquecimento" not in colunas:
+            # Banco criado antes do enriquecimento assíncrono
+            try:
+                conexao.execute("ALTER TABLE mensagens ADD COLUMN status_enriquecimento TEXT")
+            except sqlite3.OperationalError:
+                pass  # outro worker acabou de adicionar a coluna
+        if "versao" not in colunas:
+            # Banco criado antes da atualização incremental dos índices
+            try:
+                conexao.execute("ALTER TABLE mensagens ADD COLUMN versao INTEGER")
+            except sqlite3.OperationalError:
+                pass
+        conexao.execute("CREATE INDEX IF NOT EXISTS idx_mensagens_versao ON mensagens (versao)")
+        if (conexao.execute("SELECT 1 FROM contadores LIMIT 1").fetchone() is None
+                and conexao.execute("SELECT 1 FROM mensagens LIMIT 1").fetchone() is not None):
+            # Banco criado antes dos contadores de estatísticas
+            self.reconstruir_estatisticas()
+        if conexao.execute("SELECT 1 FROM mensagens LIMIT 1").fetchone() is None:
+            # Disco local vazio (por exemplo, após um novo deploy): parte da cópia no Dropbox
+            banco = _carregar_documento(DROPBOX_DB_PATH)
+            importadas = self._importar(banco.get("mensagens", []), substituir=False)
+            print(f"✅ SQLite inicializado com {importadas} mensagens do Dropbox")
+
+    def _importar(self, mensagens, substituir):
+        """Grava as mensagens numa única transação; sem substituir, só importa se o banco estiver vazio"""
+        conexao = self._conexao()
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            if substituir:
+                conexao.execute("DELETE FROM mensagens")
+            elif conexao.execute("SELECT 1 FROM mensagens LIMIT 1").fetchone() is not None:
+                # Outro worker já importou
+                conexao.execute("ROLLBACK")
+                return 0
+            importadas = 0
+            for msg in mensagens:
+                valores = [msg.get(campo) for campo in CAMPOS_MENSAGEM]
+                try:
+                    conexao.execute(self._sql_insert(), valores)
+                except sqlite3.IntegrityError:
+                    if conexao.execute(
+                            "SELECT 1 FROM mensagens WHERE mensagem_hash = ? AND projeto = ? LIMIT 1",
+                            (msg.get("mensagem_hash"), msg.get("projeto"))).fetchone():
+                        continue  # mensagem repetida no JSON de origem
+                    # Id repetido no JSON de origem: a mensagem recebe um id novo
+                    conexao.execute(self._sql_insert(), [None] + valores[1:])
+                importadas += 1
+            self._recalcular_contadores(conexao)
+            # Troca em massa: os índices em memória são reconstruídos
+            versao = self._incrementar_versao(conexao)
+            conexao.execute("UPDATE controle SET valor = ? WHERE chave = 'reconstrucao'", (versao,))
+            conexao.execute("COMMIT")
+        except Exception:
+            conexao.execute("ROLLBACK")
+            raise
+        return importadas
+
+    def _recalcular_contadores(self, conexao):
+        conexao.execute("DELETE FROM contadores")
+        conexao.execute("""
+            INSERT INTO contadores (projeto, categoria, total, lessons_learned)
+            SELECT COALESCE(projeto, 'sem_projeto'), COALESCE(categoria, 'Outros'), COUNT(*),
+                   SUM(CASE WHEN lesson_learned = 'sim' THEN 1 ELSE 0 END)
+            FROM mensagens
+            GROUP BY 1, 2
+        """)
+
+    def _contar(self, conexao, mensagem):
+        conexao.execute("""
+            INSERT INTO contadores (projeto, categoria, total, lessons_learned) VALUES (?, ?, 1, ?)
+            ON CONFLICT (projeto, categoria) DO UPDATE SET
+                total = total + 1,
+                lessons_learned = lessons_learned + excluded.lessons_learned
+        """, (
+            mensagem.get("projeto") or "sem_projeto",
+            mensagem.get("categoria") or "Outros",
+            1 if mensagem.get("lesson_learned") == "sim" else 0
+        ))
+
+    def _sql_insert(self, com_versao=False):
+        campos = list(CAMPOS_MENSAGEM) + (["versao"] if com_versao else [])
+        colunas = ", ".join(campos)
+        marcadores = ", ".join("?" for _ in campos)
+        return f"INSERT INTO mensagens ({colunas}) VALUES ({marcadores})"
+
+    def carregar(self, projeto_id=None):
+        banco = {
+            "mensagens": list(self.consultar(projeto_id)),
+            "estatisticas": {"ultima_atualizacao": datetime.now().isoformat()}
+        }
+        reconstruir_estatisticas(banco)
+        return banco
+
+    def existe_hash(self, projeto_id, mensagem_hash):
+        linha = self._conexao().execute(
+            "SELECT 1 FROM mensagens WHERE mensagem_hash = ? AND projeto = ? LIMIT 1",
+            (mensagem_hash, projeto_id)
+        ).fetchone()
+        return linha is not None
+
+    def anexar(self, mensagem):
+        conexao = self._conexao()
+        try:
+            conexao.execute("BEGIN IMMEDIATE")
+            if conexao.execute(
+                    "SELECT 1 FROM mensagens WHERE mensagem_hash = ? AND projeto = ? LIMIT 1",
+                    (mensagem["mensagem_hash"], mensagem["projeto"])).fetchone():
+                conexao.execute("ROLLBACK")
+                return False, "Esta informação já foi registrada anteriormente."
+            versao = self._incrementar_versao(conexao)
+            valores = [mensagem.get(campo) for campo in CAMPOS_MENSAGEM]
+            cursor = conexao.execute(self._sql_insert(com_versao=True), [None] + valores[1:] + [versao])
+            self._contar(conexao, mensagem)
+            conexao.execute("COMMIT")
+        except Exception as e:
+            if conexao.in_transaction:
+                conexao.execute("ROLLBACK")
+            print(f"❌ Erro ao salvar no SQLite: {e}")
+            return False, "Erro ao salvar no banco de dados"
+
+        mensagem["id"] = cursor.lastrowid
+        self._indexar(mensagem, versao)
+        self._agendar_replicacao()
+        return True, "Informação registrada com sucesso!"
+
+    def atualizar_lote(self, atualizacoes):
+        for atualizacao in atualizacoes:
+            invalidos = set(atualizacao["campos"]) - set(CAMPOS_ENRIQUECIMENTO)
+            if invalidos:
+                raise ValueError(f"Campos não atualizáveis: {sorted(invalidos)}")
+        conexao = self._conexao()
+        alteradas = []
+        try:
+            conexao.execute("BEGIN IMMEDIATE")
+            for atualizacao in atualizacoes:
+                campos = atualizacao["campos"]
+                linha = conexao.execute(
+                    f"SELECT {', '.join(CAMPOS_MENSAGEM)} FROM mensagens WHERE mensagem_hash = ? AND projeto = ? LIMIT 1",
+                    (atualizacao["mensagem_hash"], atualizacao["projeto"])).fetchone()
+                if linha is None:
+                    continue
+                mensagem = dict(linha)
+                anteriores = {campo: mensagem[campo] for campo in campos}
+                mensagem.update(campos)
+                # Uma versão por mensagem, para os índices acompanharem uma a uma
+                versao = self._incrementar_versao(conexao)
+                atribuicoes = ", ".join(f"{campo} = ?" for campo in campos)
+                conexao.execute(f"UPDATE mensagens SET {atribuicoes}, versao = ? WHERE id = ?",
+                                list(campos.values()) + [versao, mensagem["id"]])
+                alteradas.append((mensagem, anteriores, versao))
+            conexao.execute("COMMIT")
+        except Exception as e:
+            if conexao.in_transaction:
+                conexao.execute("ROLLBACK")
+            print(f"❌ Erro ao atualizar mensagens no SQLite: {e}")
+            return False, "Erro ao salvar no banco de dados", []
+
+        for mensagem, anteriores, versao in alteradas:
+            self._indexar(mensagem, versao, anteriores)
+        if alteradas:
+            self._agendar_replicacao()
+        return True, "Mensagens atualizadas", [(m["projeto"], m["mensagem_hash"]) for m, _, _ in alteradas]
+
+    def obter_mensagem(self, projeto_id, mensagem_hash):
+        linha = self._conexao().execute(
+            f"SELECT {', '.join(CAMPOS_MENSAGEM)} FROM mensagens WHERE mensagem_hash = ? AND projeto = ? LIMIT 1",
+            (mensagem_hash, projeto_id)
+        ).fetchone()
+        return dict(linha) if linha is not None else None
+
+    @staticmethod
+    def _condicoes(projeto_id=None, categoria=None, inicio=None, fim=None, lesson_learned=None,
+                   periodo_indexado=True):
+        """
+        Cláusulas WHERE (e seus parâmetros) dos filtros informados. Sem
+        `periodo_indexado`, o período não escolhe índice ("+timestamp")
+        """
+        condicoes, parametros = [], []
+        timestamp = "timestamp" if periodo_indexado else "+timestamp"
+        if projeto_id:
+            condicoes.append("projeto = ?")
+            parametros.append(projeto_id)
+        if categoria:
+            condicoes.append("categoria = ?")
+            parametros.append(categoria)
+        if lesson_learned:
+            condicoes.append("lesson_learned = ?")
+            parametros.append(lesson_learned)
+        if inicio:
+            condicoes.append(f"{timestamp} >= ?")
+            parametros.append(inicio)
+        if fim:
+            condicoes.append(f"{timestamp} <= ?")
+            parametros.append(fim)
+        return condicoes, parametros
+
+    def consultar(self, projeto_id=None, categoria=None, inicio=None, fim=None, limite=None):
+        condicoes, parametros = self._condicoes(projeto_id, categoria, inicio, fim)
+        sql = f"SELECT {', '.join(CAMPOS_MENSAGEM)} FROM mensagens"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY id"
+        if limite is not None:
+            sql += " LIMIT ?"
+            parametros.append(limite)
+        for linha in self._conexao().execute(sql, parametros):
+            yield dict(linha)
+
+    def paginar(self, projeto_id=None, categoria=None, lesson_learned=None, inicio=None, fim=None,
+                cursor=None, limite=MENSAGENS_PAGINA_PADRAO, crescente=False, campos=None):
+        # Paginação por chave: os ids são únicos, então o cursor vira "id < ?"
+        # e a página sai dos índices (projeto, ...), já em ordem de id, sem
+        # percorrer as anteriores. O período fica fora da escolha do índice:
+        # por (projeto, timestamp) a página exigiria ordenar o período inteiro
+        condicoes, parametros = self._condicoes(projeto_id, categoria, inicio, fim, lesson_learned,
+                                                periodo_indexado=False)
+        if cursor is not None:
+            condicoes.append("id > ?" if crescente else "id < ?")
+            parametros.append(cursor[0])
+        colunas = list(dict.fromkeys(["id", "projeto"] + list(campos or CAMPOS_MENSAGEM)))
+        sql = f"SELECT {', '.join(colunas)} FROM mensagens"
+        if condicoes:
+            sql += " WHERE " + " AND ".join(condicoes)
+        sql += " ORDER BY id" + ("" if crescente else " DESC") + " LIMIT ?"
+        parametros.append(limite)
+        return [dict(linha) for linha in self._conexao().execute(sql, parametros)]
+
+    def alteradas(self, projeto_id=None, desde=0):
+        # A coluna versao recebe a versão do banco em cada inclusão e alteração
+        sql = f"SELECT {', '.join(CAMPOS_MENSAGEM)}, versao FROM mensagens WHERE versao > ?"
+        parametros = [desde]
+        if projeto_id:
+            sql += " AND projeto = ?"
+            parametros.append(projeto_id)
+        for linha in self._conexao().execute(sql + " ORDER BY versao", parametros):
+            yield dict(linha)
+
+    def estatisticas(self, projeto_id=None):
+        # Lidas da tabela de contadores, mantida na mesma transação de cada gravação
+        filtro = "WHERE projeto = ?" if projeto_id else ""
+        parametros = (projeto_id,) if projeto_id else ()
+        por_categoria = {}
+        lessons_learned = 0
+        for categoria, total, lessons in self._conexao().execute(
+                f"SELECT categoria, SUM(total), SUM(lessons_learned) FROM contadores {filtro} GROUP BY categoria",
+                parametros):
+            por_categoria[categoria] = total
+            lessons_learned += lessons
+        return {
+            "total": sum(por_categoria.values()),
+            "por_categoria": por_categoria,
+            "lessons_learned": lessons_learned
+        }
+
+    def reconstruir_estatisticas(self):
+        conexao = self._conexao()
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            self._recalcular_contadores(conexao)
+            self._incrementar_versao(conexao)
+            conexao.execute("COMMIT")
+        except Exception as e:
+            conexao.execute("ROLLBACK")
+            return False, f"Erro ao reconstruir estatísticas: {e}"
+        return True, "Estatísticas reconstruídas"
+
+    def obter_indice(self, nome, projeto_id=None, apenas_pronto=False):
+        versao = self.versao()
+        with self._indices_lock:
+            atual = self._indices.get((nome, projeto_id))
+            if atual is not None and atual[0] == versao:
+                return atual[1]
+            if atual is not None and self._alcancar(nome, projeto_id):
+                return self._indices[(nome, projeto_id)][1]
+        if apenas_pronto:
+            return None
+        # Índices são construídos do zero só na primeira vez ou após uma troca em massa
+        versao = self.versao()
+        mensagens = list(self.consultar(projeto_id))
+        indice = INDICES_BANCO[nome][0](mensagens)
+        ultimo_id = max((msg["id"] for msg in mensagens), default=0)
+        with self._indices_lock:
+            self._indices[(nome, projeto_id)] = (versao, indice, ultimo_id)
+        return indice
+
+    def _alcancar(self, nome, projeto_id):
+        """
+        Aplica ao índice as mensagens gravadas (por qualquer worker) depois da
+        versão dele, pela coluna versao. Retorna False se ele precisa ser
+        reconstruído (troca em massa ou índice que não acompanha alterações).
+        Chamar com _indices_lock.
+        """
+        versao_indice, indice, ultimo_id = self._indices[(nome, projeto_id)]
+        _, adicionar, atualizar = INDICES_BANCO[nome]
+        condicoes, parametros = ["versao > ?"], [versao_indice]
+        if projeto_id:
+            condicoes.append("projeto = ?")
+            parametros.append(projeto_id)
+        conexao = self._conexao()
+        # Leitura num único instantâneo do banco: versão e mensagens coerentes
+        conexao.execute("BEGIN")
+        try:
+            versao, reconstrucao = [linha[0] for linha in conexao.execute(
+                "SELECT valor FROM controle WHERE chave IN ('versao', 'reconstrucao') ORDER BY chave DESC")]
+            linhas = conexao.execute(
+                f"SELECT {', '.join(CAMPOS_MENSAGEM)} FROM mensagens WHERE {' AND '.join(condicoes)} ORDER BY versao",
+                parametros).fetchall()
+        finally:
+            conexao.execute("COMMIT")
+        if reconstrucao > versao_indice:
+            del self._indices[(nome, projeto_id)]
+            return False
+        for linha in linhas:
+            mensagem = dict(linha)
+            if mensagem["id"] > ultimo_id:
+                adicionar(indice, mensagem)
+                ultimo_id = mensagem["id"]
+            elif atualizar is not None:
+                atualizar(indice, mensagem, {})
+            else:
+                del self._indices[(nome, projeto_id)]
+                return False
+        self._indices[(nome, projeto_id)] = (versao, indice, ultimo_id)
+        return True
+
+    def _indexar(self, mensagem, versao, anteriores=None):
+        """
+        Atualiza os índices em memória com a mensagem gravada na versão
+        informada; com `anteriores`, a mensagem já existia e foi alterada.
+        """
+        with self._indices_lock:
+            for (nome, projeto_id), (versao_indice, indice, ultimo_id) in list(self._indices.items()):
+                if projeto_id not in (None, mensagem["projeto"]) or versao_indice != versao - 1:
+                    # Índice de outro projeto, ou outro worker gravou no meio:
+                    # obter_indice alcança a versão atual quando o índice for usado
+                    continue
+                _, adicionar, atualizar = INDICES_BANCO[nome]
+                if anteriores is None:
+                    adicionar(indice, mensagem)
+                    ultimo_id = max(ultimo_id, mensagem["id"])
+                elif atualizar is not None:
+                    atualizar(indice, mensagem, anteriores)
+                else:
+                    # O índice não acompanha alterações: é reconstruído quando for usado
+                    del self._indices[(nome, projeto_id)]
+                    continue
+                self._indices[(nome, projeto_id)] = (versao, indice, ultimo_id)
+
+    def _agendar_replicacao(self):
+        """Agenda o envio da cópia ao Dropbox, agrupando as gravações da janela"""
+        with self._replicacao_lock:
+            if self._replicacao is None:
+                self._replicacao = threading.Timer(DB_REPLICACAO_SEGUNDOS, self.replicar)
+                self._replicacao.daemon = True
+                self._replicacao.start()
+
+    def replicar(self):
+        """Envia ao Dropbox a cópia das mensagens, se houver gravações pendentes"""
+        with self._replicacao_lock:
+            if self._replicacao is None:
+                return
+            self._replicacao.cancel()
+            self._replicacao = None
+        self.fazer_backup()
+
+    def fazer_backup(self):
+        try:
+            if salvar_banco_dropbox(self.carregar()):
+                return True, "Backup salvo no Dropbox com sucesso!"
+            return False, "Erro ao fazer backup"
+        except Exception as e:
+            return False, f"Erro ao fazer upload: {e}"
+
+    def restaurar_backup(self):
+        try:
+            banco = _carregar_documento(DROPBOX_DB_PATH, forcar_download=True)
+            importadas = self._importar(banco.get("mensagens", []), substituir=True)
+            return True, f"Backup restaurado do Dropbox com sucesso! ({importadas} mensagens)"
+        except Exception as e:
+            return False, f"Erro ao baixar: {e}"
+
+def criar_armazenamento():
+    """Cria o backend de armazenamento configurado em DB_BACKEND"""
+    if DB_BACKEND == "sqlite":
+        armazenamento = ArmazenamentoSQLite(DB_SQLITE_PATH)
+        # Gravações ainda não replicadas vão para o Dropbox antes de o processo sair
+        atexit.register(armazenamento.replicar)
+        return armazenamento
+    return ArmazenamentoDropbox()
+
+def upload_db_to_dropbox():
+    """Faz upload do banco de dados para o Dropbox (para backup)"""
+    return armazenamento.fazer_backup()
+
+def download_db_from_dropbox():
+    """Baixa o banco de dados do Dropbox (para restore)"""
+    return armazenamento.restaurar_backup()
+
+def gerar_hash_mensagem(projeto_id, categoria, mensagem):
+    """Gera um hash único para a mensagem para evitar duplicatas"""
+    conteudo = f"{projeto_id}_{categoria}_{mensagem}".lower().strip()
+    return hashlib.md5(conteudo.encode()).hexdigest()
+
+def _construir_indice_hashes(mensagens):
+    """Monta o índice {projeto: {mensagem_hash}} usado na verificação de duplicatas"""
+    indice = {}
+    for msg in mensagens:
+        _adicionar_indice_hashes(indice, msg)
+    return indice
+
+def _adicionar_indice_hashes(indice, msg, anteriores=None):
+    # Alterações não mudam o hash: na atualização a inclusão não tem efeito
+    indice.setdefault(msg.get("projeto"), set()).add(msg.get("mensagem_hash"))
+
+registrar_indice("hashes", _construir_indice_hashes, _adicionar_indice_hashes, _adicionar_indice_hashes)
+
+def _construir_indice_mensagens(mensagens):
+    """Monta o índice {(projeto, mensagem_hash): mensagem} usado nas consultas por hash"""
+    indice = {}
+    for msg in mensagens:
+        _adicionar_indice_mensagens(indice, msg)
+    return indice
+
+def _adicionar_indice_mensagens(indice, msg, anteriores=None):
+    indice[(msg.get("projeto"), msg.get("mensagem_hash"))] = msg
+
+registrar_indice("mensagens_por_hash", _construir_indice_mensagens,
+                 _adicionar_indice_mensagens, _adicionar_indice_mensagens)
+
+def _construir_indice_paginacao(mensagens):
+    """
+    Monta o índice {(projeto, categoria, lesson_learned): lista} da listagem
+    paginada; cada mensagem entra só na lista da sua chave. Cada lista tem as
+    mensagens em ordem de id ("ids", "mensagens"), para o cursor ser
+    localizado por busca binária, e em ordem de (timestamp, id) ("tempos",
+    "por_tempo"), para o período também ser.
+    """
+    indice = {}
+    for msg in mensagens:
+        _adicionar_indice_paginacao(indice, msg)
+    return indice
+
+def _trocar_na_lista(chaves, mensagens, chave, msg):
+    """Troca no lugar a mensagem de mesma chave de ordenação e mesmo hash; False se ela não estiver na lista"""
+    posicao = bisect.bisect_left(chaves, chave)
+    while posicao < len(chaves) and chaves[posicao] == chave:
+        if mensagens[posicao].get("mensagem_hash") == msg.get("mensagem_hash"):
+            mensagens[posicao] = msg
+            return True
+        posicao += 1
+    return False
+
+def _adicionar_indice_paginacao(indice, msg, anteriores=None):
+    id_mensagem = msg.get("id") or 0
+    tempo = (msg.get("timestamp") or "", id_mensagem)
+    lista = indice.setdefault((msg.get("projeto"), msg.get("categoria"), msg.get("lesson_learned")),
+                              {"ids": [], "mensagens": [], "tempos": [], "por_tempo": []})
+    # Mensagem já indexada (alteração de campos, que nunca muda a chave nem o
+    # timestamp, ou a mesma inclusão aplicada de novo): troca a mensagem no lugar
+    if _trocar_na_lista(lista["ids"], lista["mensagens"], id_mensagem, msg):
+        _trocar_na_lista(lista["tempos"], lista["por_tempo"], tempo, msg)
+    elif anteriores is None:
+        # Os ids do banco são crescentes: quase sempre a inclusão é no fim
+        posicao = bisect.bisect_right(lista["ids"], id_mensagem)
+        lista["ids"].insert(posicao, id_mensagem)
+        lista["mensagens"].insert(posicao, msg)
+        posicao_tempo = bisect.bisect_right(lista["tempos"], tempo)
+        lista["tempos"].insert(posicao_tempo, tempo)
+        lista["por_tempo"].insert(posicao_tempo, msg)
+
+registrar_indice("paginacao", _construir_indice_paginacao,
+                 _adicionar_indice_paginacao, _adicionar_indice_paginacao)
+
+def _chave_paginacao(msg):
+    return (msg.get("id") or 0, msg.get("projeto") or "")
+
+def _percorrer_paginacao(lista, cursor, crescente, inicio=None, fim=None, limite=None):
+    """
+    Mensagens de uma lista do índice de paginação depois do cursor (id,
+    projeto), na ordem da página. Com período, as mensagens dele são
+    localizadas por busca binária nos timestamps e só as `limite` primeiras
+    na ordem da página são separadas.
+    """
+    if inicio or fim:
+        tempos = lista["tempos"]
+        de = bisect.bisect_left(tempos, (inicio,)) if inicio else 0
+        ate = bisect.bisect_right(tempos, (fim, math.inf)) if fim else len(tempos)
+        candidatas = (msg for msg in itertools.islice(lista["por_tempo"], de, ate)
+                      if cursor is None or (_chave_paginacao(msg) > cursor if crescente
+                                            else _chave_paginacao(msg) < cursor))
+        separar = heapq.nsmallest if crescente else heapq.nlargest
+        yield from separar(limite, candidatas, key=_chave_paginacao)
+        return
+    ids, mensagens = lista["ids"], lista["mensagens"]
+    if crescente:
+        posicao = bisect.bisect_left(ids, cursor[0]) if cursor else 0
+        for indice in range(posicao, len(ids)):
+            msg = mensagens[indice]
+            if cursor is None or _chave_paginacao(msg) > cursor:
+                yield msg
+    else:
+        posicao = bisect.bisect_right(ids, cursor[0]) if cursor else len(ids)
+        for indice in range(posicao - 1, -1, -1):
+            msg = mensagens[indice]
+            if cursor is None or _chave_paginacao(msg) < cursor:
+                yield msg
+
+# Palavras sem valor de busca, já sem acentos (a comparação é feita após tokenizar)
+STOPWORDS_PT = frozenset("""
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela delas
+dele deles depois do dos e ela elas ele eles em entre era essa essas esse esses esta
+estao estas estamos estava este estes estou eu foi foram ha isso isto ja lhe lhes mais
+mas me mesmo meu meus minha minhas muito na nas nao nem no nos nossa nossas nosso
+nossos num numa o onde os ou para pela pelas pelo pelos por qual quais quando quanto
+quantos quantas que quem se sem ser seu seus so sua suas tambem te tem ter teu tua um
+uma umas uns voce voces
+""".split())
+
+# Plurais e flexões mais comuns, do sufixo mais longo ao mais curto
+_SUFIXOS_PT = (("coes", "cao"), ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"),
+               ("ois", "ol"), ("ns", "m"), ("res", "r"), ("ses", "s"), ("zes", "z"), ("s", ""))
+
+def _radical(termo):
+    """Reduz plurais ao singular (regras simplificadas do português)"""
+    if len(termo) <= 3:
+        return termo
+    for sufixo, troca in _SUFIXOS_PT:
+        if termo.endswith(sufixo) and len(termo) - len(sufixo) >= 2:
+            return termo[:-len(sufixo)] + troca
+    return termo
+
+def dobrar_acentos(texto):
+    """Texto em minúsculas e sem acentos"""
+    texto = unicodedata.normalize("NFKD", texto or "")
+    return "".join(c for c in texto if not unicodedata.combining(c)).lower()
+
+def tokenizar(texto):
+    """Termos de busca do texto: sem acentos, minúsculos, sem stopwords e no singular"""
+    texto = dobrar_acentos(texto)
+    return [_radical(termo) for termo in re.findall(r"[a-z0-9]+", texto)
+            if len(termo) > 1 and termo not in STOPWORDS_PT]
+
+class IndiceBM25:
+    """
+    Índice invertido com ranking BM25 sobre mensagem_original, contexto e
+    mudanca_chave. Cada mensagem é identificada por (projeto, mensagem_hash),
+    de modo que reindexá-la substitui os termos anteriores.
+    """
+    K1 = 1.2
+    B = 0.75
+    CAMPOS = ("mensagem_original", "contexto", "mudanca_chave")
+
+    def __init__(self):
+        self._documentos = {}  # chave -> (mensagem, {termo: frequência}, comprimento)
+        self._postings = {}  # termo -> {chave: frequência}
+        self._comprimento_total = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documentos)
+
+    @staticmethod
+    def _chave(msg):
+        return (msg.get("projeto"), msg.get("mensagem_hash") or msg.get("id"))
+
+    def adicionar(self, msg):
+        termos = collections.Counter()
+        for campo in self.CAMPOS:
+            termos.update(tokenizar(msg.get(campo) or ""))
+        chave = self._chave(msg)
+        comprimento = sum(termos.values())
+        with self._lock:
+            self._remover(chave)
+            self._documentos[chave] = (msg, termos, comprimento)
+            for termo, frequencia in termos.items():
+                self._postings.setdefault(termo, {})[chave] = frequencia
+            self._comprimento_total += comprimento
+
+    def _remover(self, chave):
+        documento = self._documentos.pop(chave, None)
+        if documento is None:
+            return
+        for termo in documento[1]:
+            postings = self._postings[termo]
+            del postings[chave]
+            if not postings:
+                del self._postings[termo]
+        self._comprimento_total -= documento[2]
+
+    def buscar(self, consulta, projeto_id=None, limite=10):
+        """Retorna [(pontuação, mensagem)] das mensagens mais relevantes para a consulta"""
+        termos = set(tokenizar(consulta))
+        with self._lock:
+            total = len(self._documentos)
+            if not total or not termos:
+                return []
+            media = self._comprimento_total / total or 1
+            pontuacoes = {}
+            for termo in termos:
+                postings = self._postings.get(termo)
+                if not postings:
+                    continue
+                idf = math.log(1 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chave, frequencia in postings.items():
+                    if projeto_id and chave[0] != projeto_id:
+                        continue
+                    normalizacao = 1 - self.B + self.B * self._documentos[chave][2] / media
+                    pontuacoes[chave] = pontuacoes.get(chave, 0.0) + (
+                        idf * frequencia * (self.K1 + 1) / (frequencia + self.K1 * normalizacao))
+            melhores = heapq.nlargest(limite, pontuacoes.items(), key=lambda item: item[1])
+            return [(pontuacao, self._documentos[chave][0]) for chave, pontuacao in melhores]
+
+def _construir_indice_bm25(mensagens):
+    """Monta o índice BM25 usado na seleção de contexto do assistente de consultas"""
+    indice = IndiceBM25()
+    for msg in mensagens:
+        indice.adicionar(msg)
+    return indice
+
+def _adicionar_indice_bm25(indice, msg, anteriores=None):
+    # O enriquecimento altera contexto e mudanca_chave: a mensagem é reindexada
+    indice.adicionar(msg)
+
+registrar_indice("bm25", _construir_indice_bm25, _adicionar_indice_bm25, _adicionar_indice_bm25)
+
+class IndiceSimilares:
+    """
+    Índice LSH de assinaturas MinHash das mensagens originais, por projeto.
+    A assinatura usa hashing de permutação única (cada trecho de 4 caracteres
+    do texto normalizado é hasheado uma vez e cai em um dos compartimentos);
+    as faixas da assinatura levam às mensagens candidatas, cuja similaridade
+    é estimada pela fração de compartimentos iguais.
+    """
+    COMPARTIMENTOS = 60
+    FAIXAS = 12
+    TAMANHO_TRECHO = 4
+
+    def __init__(self):
+        self._assinaturas = {}  # chave -> (mensagem, assinatura)
+        self._faixas = {}  # hash (projeto, faixa, valores) -> [chave]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._assinaturas)
+
+    @classmethod
+    def assinatura(cls, texto):
+        """Assinatura MinHash do texto, insensível a acentos, caixa, pontuação e espaços"""
+        texto = " ".join(re.findall(r"\w+", dobrar_acentos(texto)))
+        tamanho = cls.TAMANHO_TRECHO
+        trechos = {texto[i:i + tamanho] for i in range(max(len(texto) - tamanho + 1, 1))}
+        minimos = [None] * cls.COMPARTIMENTOS
+        for trecho in trechos:
+            valor = hash(trecho) & 0xFFFFFFFFFFFF
+            compartimento = valor % cls.COMPARTIMENTOS
+            if minimos[compartimento] is None or valor < minimos[compartimento]:
+                minimos[compartimento] = valor
+        # Compartimentos vazios copiam o próximo preenchido (densificação)
+        proximo = next(i for i, valor in enumerate(minimos) if valor is not None) + cls.COMPARTIMENTOS
+        for i in range(cls.COMPARTIMENTOS - 1, -1, -1):
+            if minimos[i] is None:
+                minimos[i] = (minimos[proximo % cls.COMPARTIMENTOS] + proximo - i) & 0xFFFFFFFFFFFF
+            else:
+                proximo = i
+        return array.array("Q", minimos)
+
+    def _chaves_faixas(self, projeto_id, assinatura):
+        linhas = self.COMPARTIMENTOS // self.FAIXAS
+        return [hash((projeto_id, faixa, tuple(assinatura[faixa * linhas:(faixa + 1) * linhas])))
+                for faixa in range(self.FAIXAS)]
+
+    def adicionar(self, msg):
+        chave = (msg.get("projeto"), msg.get("mensagem_hash") or msg.get("id"))
+        assinatura = self.assinatura(msg.get("mensagem_original"))
+        with self._lock:
+            if chave in self._assinaturas:
+                # Alteração de campos: a mensagem original (e a assinatura) não muda
+                self._assinaturas[chave] = (msg, self._assinaturas[chave][1])
+                return
+            self._assinaturas[chave] = (msg, assinatura)
+            for chave_faixa in self._chaves_faixas(chave[0], assinatura):
+                self._faixas.setdefault(chave_faixa, []).append(chave)
+
+    def buscar(self, projeto_id, texto, minimo=0.7, limite=5):
+        """Retorna [(similaridade, mensagem)] das mensagens do projeto parecidas com o texto"""
+        assinatura = self.assinatura(texto)
+        with self._lock:
+            candidatos = set()
+            for chave_faixa in self._chaves_faixas(projeto_id, assinatura):
+                candidatos.update(self._faixas.get(chave_faixa, ()))
+            resultados = []
+            for chave in candidatos:
+                msg, outra = self._assinaturas[chave]
+                similaridade = sum(map(operator.eq, assinatura, outra)) / self.COMPARTIMENTOS
+                if similaridade >= minimo:
+                    resultados.append((similaridade, msg))
+        return heapq.nlargest(limite, resultados, key=lambda item: item[0])
+
+def _construir_indice_similares(mensagens):
+    """Monta o índice LSH usado na detecção de mensagens quase duplicadas"""
+    indice = IndiceSimilares()
+    for msg in mensagens:
+        indice.adicionar(msg)
+    return indice
+
+def _adicionar_indice_similares(indice, msg, anteriores=None):
+    # Alterações não mudam a mensagem original: na atualização a inclusão não tem efeito
+    indice.adicionar(msg)
+
+registrar_indice("similares", _construir_indice_similares,
+                 _adicionar_indice_similares, _adicionar_indice_similares)
+
+def verificar_duplicata(projeto_id, categoria, mensagem):
+    """Verifica se já existe uma mensagem idêntica no banco de dados"""
+    try:
+        mensagem_hash = gerar_hash_mensagem(projeto_id, categoria, mensagem)
+        
+        return armazenamento.existe_hash(projeto_id, mensagem_hash)
+    except Exception as e:
+        print(f"Erro ao verificar duplicata: {e}")
+        return False
+
+_similares_em_construcao = set()
+_similares_em_construcao_lock = threading.Lock()
+
+def _construir_similares(projeto_id):
+    try:
+        armazenamento.obter_indice("similares", projeto_id)
+    except Exception as e:
+        print(f"Erro ao construir o índice de similares: {e}")
+    finally:
+        with _similares_em_construcao_lock:
+            _similares_em_construcao.discard(projeto_id)
+
+def buscar_similares(projeto_id, mensagem, limite=DUPLICATA_MAX_SIMILARES):
+    """
+    Mensagens do projeto quase iguais à informada (diferenças de pontuação,
+    acentos, espaços ou poucas palavras), da mais para a menos parecida.
+    A verificação roda a cada tecla: se o índice ainda não existe, ele é
+    construído em segundo plano e, até ficar pronto, não há sugestões.
+    """
+    try:
+        indice = armazenamento.obter_indice("similares", projeto_id, apenas_pronto=True)
+        if indice is None:
+            with _similares_em_construcao_lock:
+                if projeto_id not in _similares_em_construcao:
+                    _similares_em_construcao.add(projeto_id)
+                    threading.Thread(target=_construir_similares, args=(projeto_id,), daemon=True).start()
+            return []
+        similares = indice.buscar(projeto_id, mensagem, DUPLICATA_SIMILARIDADE_MINIMA, limite)
+        return [{
+            "mensagem_hash": msg.get("mensagem_hash"),
+            "mensagem_original": msg.get("mensagem_original"),
+            "categoria": msg.get("categoria"),
+            "timestamp": msg.get("timestamp"),
+            "similaridade": round(similaridade, 2)
+        } for similaridade, msg in similares]
+    except Exception as e:
+        print(f"Erro ao buscar mensagens similares: {e}")
+        return []
+
+# Sufixos retirados pelo radical de busca, em etapas (versão reduzida do
+# removedor de sufixos RSLP): advérbio e diminutivo, depois substantivo ou,
+# se nenhum, verbo, e por fim a vogal temática
+_SUFIXOS_ADVERBIO = ("mente", "zinho", "zinha", "inho", "inha")
+_SUFIXOS_SUBSTANTIVO = ("amento", "imento", "idade", "mento", "agem", "anca", "encia", "acao",
+                        "icao", "ismo", "ista", "avel", "ivel", "oso", "osa")
+_SUFIXOS_VERBO = ("ariam", "eriam", "iriam", "assem", "essem", "issem", "aram", "eram", "iram",
+                  "avam", "ando", "endo", "indo", "aria", "eria", "iria", "asse", "esse", "isse",
+                  "ado", "ada", "ido", "ida", "ava", "ou", "ar", "er", "ir", "am", "em", "ei", "eu", "iu")
+_VOGAIS_TEMATICAS = ("a", "e", "o")
+
+def _sem_sufixo(termo, sufixos, minimo=3):
+    for sufixo in sufixos:
+        if termo.endswith(sufixo) and len(termo) - len(sufixo) >= minimo:
+            return termo[:-len(sufixo)]
+    return None
+
+@functools.lru_cache(maxsize=65536)
+def radical_busca(termo):
+    """
+    Radical usado pela busca textual, mais agressivo que _radical: "atraso",
+    "atrasos", "atrasou" e "atrasado" viram "atras"
+    """
+    termo = _radical(termo)
+    if not termo.isalpha():
+        return termo
+    termo = _sem_sufixo(termo, _SUFIXOS_ADVERBIO) or termo
+    termo = _sem_sufixo(termo, _SUFIXOS_SUBSTANTIVO) or _sem_sufixo(termo, _SUFIXOS_VERBO) or termo
+    return _sem_sufixo(termo, _VOGAIS_TEMATICAS) or termo
+
+@functools.lru_cache(maxsize=4096)
+def _dobrar_caractere(caractere):
+    dobrado = dobrar_acentos(caractere)
+    return dobrado if len(dobrado) == 1 else caractere.lower()
+
+def termos_busca(texto):
+    """
+    (radical, posição, início, fim) de cada termo de busca do texto. As posições
+    contam também as stopwords, e início/fim são as posições no texto original.
+    """
+    texto = texto or ""
+    # Acentos retirados caractere a caractere, para os trechos casarem com o original
+    dobrado = texto.lower() if texto.isascii() else "".join(map(_dobrar_caractere, texto))
+    for posicao, palavra in enumerate(re.finditer(r"[a-z0-9]+", dobrado)):
+        termo = palavra.group()
+        if len(termo) > 1 and termo not in STOPWORDS_PT:
+            yield radical_busca(termo), posicao, palavra.start(), palavra.end()
+
+def interpretar_busca(consulta):
+    """
+    Separa a consulta em termos soltos e frases (entre aspas). Cada frase é uma
+    lista [(radical, deslocamento em relação ao primeiro termo)].
+    """
+    frases, soltos = [], []
+    for trecho in re.findall(r'"([^"]*)"', consulta):
+        termos = [(termo, posicao) for termo, posicao, _, _ in termos_busca(trecho)]
+        if len(termos) > 1:
+            frases.append([(termo, posicao - termos[0][1]) for termo, posicao in termos])
+        else:
+            soltos.extend(termo for termo, _ in termos)
+    resto = re.sub(r'"[^"]*"', " ", consulta).replace('"', " ")
+    soltos.extend(termo for termo, _, _, _ in termos_busca(resto))
+    return soltos, frases
+
+def trecho_destacado(texto, radicais, tamanho=BUSCA_TRECHO_CARACTERES):
+    """
+    Trecho do texto (HTML escapado) com a maior concentração dos radicais
+    buscados, cada ocorrência entre <mark>. None se nenhum aparecer.
+    """
+    ocorrencias = [(inicio, fim) for termo, _, inicio, fim in termos_busca(texto) if termo in radicais]
+    if not ocorrencias:
+        return None
+    melhor = max(ocorrencias, key=lambda o: sum(1 for i, f in ocorrencias if o[0] <= i and f <= o[0] + tamanho))
+    inicio = max(0, melhor[0] - tamanho // 5)
+    if inicio:
+        # Começa numa palavra inteira
+        espaco = texto.rfind(" ", 0, inicio)
+        inicio = espaco + 1 if espaco >= 0 else 0
+    fim = min(len(texto), inicio + tamanho)
+    partes, atual = ["…"] if inicio else [], inicio
+    for i, f in ocorrencias:
+        if i < inicio or f > fim:
+            continue
+        partes.append(html.escape(texto[atual:i]))
+        partes.append(f"<mark>{html.escape(texto[i:f])}</mark>")
+        atual = f
+    partes.append(html.escape(texto[atual:fim]))
+    if fim < len(texto):
+        partes.append("…")
+    return "".join(partes)
+
+class IndiceBusca:
+    """
+    Índice invertido da busca textual sobre mensagem_original, contexto e
+    mudanca_chave, guardado num SQLite local: um worker novo aproveita o
+    índice já montado e só indexa o que mudou desde a última sincronização.
+    Cada termo guarda as posições em que aparece, para as buscas por frase.
+    O ranking é o BM25, com os parâmetros de IndiceBM25. Ao mudar a
+    tokenização (termos_busca), incremente FORMATO: o índice é refeito.
+    """
+    TAMANHO_LOTE = 500
+    FORMATO = 1
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _conexao(self):
+        # Conexões SQLite não podem ser compartilhadas entre threads
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conexao.row_factory = sqlite3.Row
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.executescript("""
+                CREATE TABLE IF NOT EXISTS documentos (
+                    projeto TEXT NOT NULL,
+                    mensagem_hash TEXT NOT NULL,
+                    id INTEGER,
+                    categoria TEXT,
+                    comprimento INTEGER NOT NULL,
+                    pendente INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (projeto, mensagem_hash)
+                );
+                CREATE INDEX IF NOT EXISTS idx_documentos_pendente ON documentos (pendente);
+                CREATE TABLE IF NOT EXISTS postings (
+                    termo TEXT NOT NULL,
+                    projeto TEXT NOT NULL,
+                    mensagem_hash TEXT NOT NULL,
+                    categoria TEXT,
+                    frequencia INTEGER NOT NULL,
+                    comprimento INTEGER NOT NULL,
+                    posicoes TEXT NOT NULL,
+                    PRIMARY KEY (termo, projeto, mensagem_hash)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_postings_documento ON postings (projeto, mensagem_hash);
+                CREATE TABLE IF NOT EXISTS controle (
+                    chave TEXT PRIMARY KEY,
+                    valor TEXT
+                );
+            """)
+            self._local.conexao = conexao
+        return conexao
+
+    def _ler(self, conexao, chave, padrao=None):
+        linha = conexao.execute("SELECT valor FROM controle WHERE chave = ?", (chave,)).fetchone()
+        return json.loads(linha[0]) if linha is not None else padrao
+
+    def _gravar(self, conexao, chave, valor):
+        conexao.execute("INSERT OR REPLACE INTO controle (chave, valor) VALUES (?, ?)", (chave, json.dumps(valor)))
+
+    def _remover(self, conexao, projeto_id, mensagem_hash):
+        conexao.execute("DELETE FROM postings WHERE projeto = ? AND mensagem_hash = ?", (projeto_id, mensagem_hash))
+        conexao.execute("DELETE FROM documentos WHERE projeto = ? AND mensagem_hash = ?", (projeto_id, mensagem_hash))
+
+    def _indexar(self, conexao, msg):
+        """(Re)indexa uma mensagem, substituindo os termos anteriores"""
+        projeto_id, mensagem_hash = msg.get("projeto") or "", msg.get("mensagem_hash") or str(msg.get("id"))
+        self._remover(conexao, projeto_id, mensagem_hash)
+        posicoes, comprimento, deslocamento = {}, 0, 0
+        for campo in IndiceBM25.CAMPOS:
+            ultima = -1
+            for termo, posicao, _, _ in termos_busca(msg.get(campo)):
+                posicoes.setdefault(termo, []).append(deslocamento + posicao)
+                comprimento += 1
+                ultima = posicao
+            # Uma posição vazia entre os campos: frases não atravessam campos
+            deslocamento += ultima + 2
+        conexao.execute(
+            "INSERT INTO documentos (projeto, mensagem_hash, id, categoria, comprimento, pendente) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (projeto_id, mensagem_hash, msg.get("id"), msg.get("categoria"), comprimento,
+             int(msg.get("status_enriquecimento") == "pendente"))
+        )
+        # Categoria e comprimento repetidos em cada termo: a busca não precisa de junção
+        conexao.executemany(
+            "INSERT INTO postings (termo, projeto, mensagem_hash, categoria, frequencia, comprimento, posicoes) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(termo, projeto_id, mensagem_hash, msg.get("categoria"), len(lista), comprimento,
+              " ".join(map(str, lista))) for termo, lista in posicoes.items()]
+        )
+
+    @staticmethod
+    def _fontes():
+        """
+        Projetos percorridos em ordem de id. No layout por projeto do Dropbox os
+        ids só são únicos dentro de cada arquivo; nos demais, um percurso só.
+        """
+        if DB_BACKEND != "sqlite" and DB_SHARDING_ENABLED:
+            return list(carregar_manifesto()["projetos"])
+        return [None]
+
+    def _cursor_valido(self, cursor):
+        # A última mensagem indexada sumiu ou mudou de id (backup restaurado):
+        # os ids deixaram de valer e o índice é refeito
+        projeto_id, mensagem_hash, id_mensagem = cursor
+        mensagem = armazenamento.obter_mensagem(projeto_id, mensagem_hash)
+        return mensagem is not None and mensagem.get("id") == id_mensagem
+
+    def sincronizar(self):
+        """Indexa as mensagens gravadas e as enriquecidas desde a última sincronização"""
+        with self._lock:
+            versao = armazenamento.versao()
+            conexao = self._conexao()
+            if (versao is not None and self._ler(conexao, "versao") == str(versao)
+                    and self._ler(conexao, "formato") == self.FORMATO):
+                return 0
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                indexadas = self._sincronizar(conexao)
+                total = conexao.execute("SELECT COUNT(*), COALESCE(SUM(comprimento), 0) FROM documentos").fetchone()
+                self._gravar(conexao, "documentos", [total[0], total[1]])
+                self._gravar(conexao, "versao", None if versao is None else str(versao))
+                conexao.execute("COMMIT")
+            except Exception:
+                conexao.execute("ROLLBACK")
+                raise
+        if indexadas:
+            print(f"🔎 Índice de busca: {indexadas} mensagens indexadas")
+        return indexadas
+
+    def _sincronizar(self, conexao):
+        cursores = self._ler(conexao, "cursores", {})
+        if (self._ler(conexao, "formato") != self.FORMATO
+                or any(not self._cursor_valido(cursor) for cursor in cursores.values())):
+            conexao.execute("DELETE FROM postings")
+            conexao.execute("DELETE FROM documentos")
+            self._gravar(conexao, "formato", self.FORMATO)
+            cursores = {}
+        marcas = self._ler(conexao, "marcas", {}) if cursores else {}
+
+        indexadas = 0
+        # Mensagens alteradas depois de indexadas (reenriquecimento, enriquecimento
+        # que falhou e foi refeito): as de versão maior que a última vista. As
+        # de id além do cursor ainda não foram indexadas e entram com as novas
+        for projeto_id in self._fontes():
+            cursor = cursores.get(projeto_id or "")
+            marca = marcas.get(projeto_id or "", 0)
+            for mensagem in armazenamento.alteradas(projeto_id, marca):
+                marca = max(marca, mensagem["versao"])
+                if cursor and (mensagem.get("id") or 0) <= cursor[2]:
+                    self._indexar(conexao, mensagem)
+                    indexadas += 1
+            marcas[projeto_id or ""] = marca
+        self._gravar(conexao, "marcas", marcas)
+
+        # Mensagens que ainda esperavam o enriquecimento: as alteradas antes de
+        # as mensagens terem versão não aparecem acima
+        pendentes = conexao.execute("SELECT projeto, mensagem_hash FROM documentos WHERE pendente = 1").fetchall()
+        for projeto_id, mensagem_hash in pendentes:
+            mensagem = armazenamento.obter_mensagem(projeto_id, mensagem_hash)
+            if mensagem is None:
+                self._remover(conexao, projeto_id, mensagem_hash)
+            elif mensagem.get("status_enriquecimento") != "pendente":
+                self._indexar(conexao, mensagem)
+                indexadas += 1
+
+        # Mensagens novas: as de id maior que a última indexada
+        for projeto_id in self._fontes():
+            cursor = cursores.get(projeto_id or "")
+            while True:
+                pagina = armazenamento.paginar(
+                    projeto_id, cursor=(cursor[2], cursor[0]) if cursor else None,
+                    limite=self.TAMANHO_LOTE, crescente=True)
+                for mensagem in pagina:
+                    self._indexar(conexao, mensagem)
+                if pagina:
+                    ultima = pagina[-1]
+                    cursor = [ultima.get("projeto") or "", ultima.get("mensagem_hash"), ultima.get("id")]
+                    indexadas += len(pagina)
+                if len(pagina) < self.TAMANHO_LOTE:
+                    break
+            if cursor:
+                cursores[projeto_id or ""] = cursor
+        self._gravar(conexao, "cursores", cursores)
+        return indexadas
+
+    def buscar(self, consulta, projeto_id=None, categoria=None, limite=20):
+        """
+        Mensagens com todos os termos e frases da consulta, da mais para a menos
+        relevante. Retorna (total encontrado, [(pontuação, projeto, mensagem_hash)], radicais).
+        """
+        soltos, frases = interpretar_busca(consulta)
+        radicais = set(soltos) | {termo for frase in frases for termo, _ in frase}
+        if not radicais:
+            return 0, [], radicais
+
+        conexao = self._conexao()
+        total_documentos, comprimento_total = self._ler(conexao, "documentos", [0, 0])
+        media = comprimento_total / total_documentos if total_documentos else 1
+        # As posições só são lidas quando há frase a conferir
+        sql = "SELECT projeto, mensagem_hash, frequencia, comprimento"
+        sql += ", posicoes FROM postings WHERE termo = ?" if frases else " FROM postings WHERE termo = ?"
+        filtros = []
+        if projeto_id:
+            sql += " AND projeto = ?"
+            filtros.append(projeto_id)
+        if categoria:
+            sql += " AND categoria = ?"
+            filtros.append(categoria)
+
+        # BM25: frequência * (K1 + 1) / (frequência + fixo + proporcional * comprimento)
+        fixo = IndiceBM25.K1 * (1 - IndiceBM25.B)
+        proporcional = IndiceBM25.K1 * IndiceBM25.B / (media or 1)
+
+        # Do termo mais raro para o mais comum: os candidatos só diminuem
+        frequencias = {termo: conexao.execute("SELECT COUNT(*) FROM postings WHERE termo = ?",
+                                              (termo,)).fetchone()[0] for termo in radicais}
+        pontuacoes, posicoes = None, {}
+        for termo in sorted(radicais, key=frequencias.get):
+            if frequencias[termo] == 0:
+                return 0, [], radicais
+            idf = math.log(1 + (total_documentos - frequencias[termo] + 0.5) / (frequencias[termo] + 0.5))
+            peso = idf * (IndiceBM25.K1 + 1)
+            encontrados = {}
+            if pontuacoes is not None and len(pontuacoes) * 8 < frequencias[termo]:
+                # Poucos candidatos para um termo comum: consulta um a um pela chave
+                linhas = (conexao.execute(sql + " AND projeto = ? AND mensagem_hash = ?",
+                                          [termo] + filtros + list(chave)).fetchone() for chave in pontuacoes)
+                linhas = [linha for linha in linhas if linha is not None]
+            else:
+                linhas = conexao.execute(sql, [termo] + filtros)
+            for linha in linhas:
+                chave = linha[0], linha[1]
+                anterior = 0.0 if pontuacoes is None else pontuacoes.get(chave)
+                if anterior is None:
+                    continue
+                frequencia = linha[2]
+                encontrados[chave] = anterior + peso * frequencia / (frequencia + fixo + proporcional * linha[3])
+                if frases:
+                    posicoes.setdefault(chave, {})[termo] = linha[4]
+            pontuacoes = encontrados
+            if not pontuacoes:
+                return 0, [], radicais
+
+        resultados = [(pontuacao, chave) for chave, pontuacao in pontuacoes.items()
+                      if not frases or all(_contem_frase(posicoes[chave], frase) for frase in frases)]
+        melhores = heapq.nlargest(limite, resultados)
+        return len(resultados), [(pontuacao, projeto, mensagem_hash) for pontuacao, (projeto, mensagem_hash) in melhores], radicais
+
+def _contem_frase(posicoes, frase):
+    """
+    Indica se os termos da frase aparecem na sequência, com os mesmos intervalos.
+    `posicoes` tem as posições de cada termo como gravadas no índice.
+    """
+    conjuntos = {termo: set(map(int, posicoes[termo].split())) for termo, _ in frase}
+    (primeiro, _), resto = frase[0], frase[1:]
+    return any(all(inicio + deslocamento in conjuntos[termo] for termo, deslocamento in resto)
+               for inicio in conjuntos[primeiro])
+
+indice_busca = IndiceBusca(BUSCA_INDICE_PATH)
+
+def buscar_mensagens(consulta, projeto_id=None, categoria=None, limite=20):
+    """
+    Busca textual nas mensagens. Retorna (total encontrado, resultados), cada
+    resultado com a mensagem, a pontuação e o trecho destacado.
+    """
+    try:
+        indice_busca.sincronizar()
+    except Exception as e:
+        # Sem sincronizar, a busca usa o índice como estava
+        print(f"⚠️ Erro ao atualizar o índice de busca: {e}")
+    total, encontrados, radicais = indice_busca.buscar(consulta, projeto_id, categoria, limite)
+    resultados = []
+    for pontuacao, projeto, mensagem_hash in encontrados:
+        mensagem = armazenamento.obter_mensagem(projeto, mensagem_hash)
+        if mensagem is None:
+            continue
+        trechos = ((campo, trecho_destacado(mensagem.get(campo) or "", radicais)) for campo in IndiceBM25.CAMPOS)
+        campo, trecho = next(((campo, trecho) for campo, trecho in trechos if trecho), (None, None))
+        resultados.append({
+            "id": mensagem.get("id"),
+            "projeto": mensagem.get("projeto"),
+            "categoria": mensagem.get("categoria"),
+            "timestamp": mensagem.get("timestamp"),
+            "remetente": mensagem.get("remetente"),
+            "lesson_learned": mensagem.get("lesson_learned"),
+            "mensagem_hash": mensagem.get("mensagem_hash"),
+            "mensagem_original": mensagem.get("mensagem_original"),
+            "pontuacao": round(pontuacao, 3),
+            "campo": campo,
+            "trecho": trecho
+        })
+    return total, resultados
+
+class DeepSeekIndisponivel(Exception):
+    """Chamada recusada sem contato com a API: o disjuntor do DeepSeek está aberto"""
+
+class Disjuntor:
+    """
+    Circuit breaker de um serviço externo. Fechado, deixa passar as chamadas e
+    conta as falhas seguidas; com `max_falhas` delas, abre e recusa as
+    chamadas por `aberto_segundos`. Em seguida fica meio aberto: uma única
+    chamada de sondagem passa e, conforme o resultado, o disjuntor fecha ou
+    volta a abrir.
+    """
+
+    def __init__(self, nome, max_falhas, aberto_segundos):
+        self.nome = nome
+        self.max_falhas = max_falhas
+        self.aberto_segundos = aberto_segundos
+        self._estado = "fechado"
+        self._falhas = 0
+        self._aberto_em = 0.0
+        self._sondando = False
+        self._contadores = {"aberturas": 0, "recusadas": 0, "falhas": 0, "lentas": 0}
+        self._lock = threading.Lock()
+
+    def _restante(self):
+        return max(self._aberto_em + self.aberto_segundos - time.monotonic(), 0.0)
+
+    def permitir(self):
+        """Indica se uma chamada pode ser feita; no estado meio aberto, reserva a sondagem"""
+        with self._lock:
+            if self._estado == "fechado":
+                return True
+            if self._estado == "aberto" and self._restante() == 0:
+                self._estado = "meio_aberto"
+                self._sondando = False
+            if self._estado == "aberto" or self._sondando:
+                self._contadores["recusadas"] += 1
+                return False
+            self._sondando = True
+            return True
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self._falhas = 0
+            self._sondando = False
+            if self._estado != "fechado":
+                print(f"✅ {self.nome} respondeu; disjuntor fechado")
+                self._estado = "fechado"
+
+    def registrar_falha(self, lenta=False):
+        with self._lock:
+            self._falhas += 1
+            self._sondando = False
+            self._contadores["lentas" if lenta else "falhas"] += 1
+            if self._estado == "meio_aberto" or (self._estado == "fechado" and self._falhas >= self.max_falhas):
+                print(f"🔌 {self.nome}: {self._falhas} falhas seguidas; disjuntor aberto por {self.aberto_segundos:.0f}s")
+                self._estado = "aberto"
+                self._aberto_em = time.monotonic()
+                self._contadores["aberturas"] += 1
+
+    def aberto(self):
+        """True enquanto as chamadas estão sendo recusadas sem sondagem"""
+        with self._lock:
+            return self._estado == "aberto" and self._restante() > 0
+
+    def segundos_para_sondagem(self):
+        """Tempo até o disjuntor aceitar uma chamada de sondagem (0 se fechado ou meio aberto)"""
+        with self._lock:
+            return self._restante() if self._estado == "aberto" else 0.0
+
+    def situacao(self):
+        """Estado, falhas seguidas e contadores, para monitoramento"""
+        with self._lock:
+            estado = self._estado
+            if estado == "aberto" and self._restante() == 0:
+                estado = "meio_aberto"
+            return dict(self._contadores, estado=estado, falhas_seguidas=self._falhas,
+                        segundos_para_sondagem=round(self._restante(), 1) if estado == "aberto" else 0.0)
+
+class ClienteDeepSeek:
+    """
+    Cliente da API de chat do DeepSeek, compartilhado pelas threads do worker.
+    Registra, por finalidade da chamada, a latência e os tokens consumidos
+    (campo usage da resposta). Um disjuntor recusa as chamadas na hora quando
+    a API está fora do ar ou lenta demais.
+    """
+
+    def __init__(self, api_key, url, max_conexoes, timeout_conexao, timeout_leitura,
+                 max_tentativas, backoff_segundos, disjuntor):
+        self.api_key = api_key
+        self.url = url
+        self.max_conexoes = max_conexoes
+        self.timeout_conexao = timeout_conexao
+        self.timeout_leitura = timeout_leitura
+        self.max_tentativas = max_tentativas
+        self.backoff_segundos = backoff_segundos
+        self.disjuntor = disjuntor
+        self._sessao = None
+        self._sessao_pid = None
+        self._sessao_lock = threading.Lock()
+        self._metricas = {}
+        self._metricas_lock = threading.Lock()
+
+    def _sessao_http(self):
+        """Sessão HTTP do worker, criada uma única vez por processo"""
+        with self._sessao_lock:
+            # Um processo criado por fork não deve reaproveitar as conexões do pai
+            if self._sessao is None or self._sessao_pid != os.getpid():
+                sessao = requests.Session()
+                sessao.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.max_conexoes))
+                sessao.headers.update({
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json"
+                })
+                self._sessao, self._sessao_pid = sessao, os.getpid()
+            return self._sessao
+
+    def _espera(self, tentativa, resposta):
+        retry_after = resposta.headers.get("Retry-After") if resposta is not None else None
+        try:
+            # 429 com Retry-After: espera o pedido pela API, com um pouco de folga
+            return float(retry_after) * random.uniform(1.0, 1.2)
+        except (TypeError, ValueError):
+            return self.backoff_segundos * (2 ** tentativa) * random.uniform(0.5, 1.5)
+
+    def _enviar(self, payload, timeout, finalidade, stream=False):
+        """
+        POST com novas tentativas. Retorna a resposta HTTP bem-sucedida; com o
+        disjuntor aberto, levanta DeepSeekIndisponivel sem chamar a API.
+        """
+        for tentativa in range(self.max_tentativas):
+            if not self.disjuntor.permitir():
+                raise DeepSeekIndisponivel("DeepSeek temporariamente indisponível (disjuntor aberto)")
+            resposta = None
+            inicio = time.monotonic()
+            try:
+                resposta = self._sessao_http().post(self.url, json=payload, timeout=timeout, stream=stream)
+                if resposta.status_code != 429 and resposta.status_code < 500:
+                    # A API respondeu: para o disjuntor só a latência importa
+                    if time.monotonic() - inicio > timeout[1] * DEEPSEEK_DISJUNTOR_LENTIDAO:
+                        self.disjuntor.registrar_falha(lenta=True)
+                    else:
+                        self.disjuntor.registrar_sucesso()
+                    # Outros erros 4xx não melhoram com nova tentativa
+                    resposta.raise_for_status()
+                    return resposta
+                resposta.close()
+                erro = requests.HTTPError(f"{resposta.status_code} {resposta.reason}", response=resposta)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                erro = e
+            except Exception:
+                if resposta is None:
+                    self.disjuntor.registrar_falha()
+                raise
+            self.disjuntor.registrar_falha()
+            if tentativa + 1 == self.max_tentativas:
+                raise erro
+            espera = self._espera(tentativa, resposta)
+            self._registrar(finalidade, nova_tentativa=True)
+            print(f"⚠️ DeepSeek: {erro} (tentativa {tentativa + 1}); nova tentativa em {espera:.2f}s")
+            time.sleep(espera)
+
+    def conversar(self, payload, finalidade, timeout_leitura=None):
+        """
+        Envia o payload ao chat do DeepSeek e retorna a primeira escolha da
+        resposta (choices[0]). Levanta exceção se as tentativas se esgotarem.
+        """
+        timeout = (self.timeout_conexao, timeout_leitura or self.timeout_leitura)
+        inicio = time.monotonic()
+        try:
+            dados = self._enviar(payload, timeout, finalidade).json()
+            escolha = dados["choices"][0]
+        except Exception:
+            self._registrar(finalidade, time.monotonic() - inicio, erro=True)
+            raise
+        self._registrar(finalidade, time.monotonic() - inicio, uso=dados.get("usage"))
+        return escolha
+
+    def conversar_stream(self, payload, finalidade, timeout_leitura=None):
+        """
+        Como conversar, mas com stream: gera os trechos de texto da resposta à
+        medida que o DeepSeek os produz. Só há novas tentativas antes do
+        início da resposta.
+        """
+        payload = dict(payload, stream=True, stream_options={"include_usage": True})
+        timeout = (self.timeout_conexao, timeout_leitura or self.timeout_leitura)
+        inicio = time.monotonic()
+        primeiro_trecho = None
+        uso = None
+        try:
+            with self._enviar(payload, timeout, finalidade, stream=True) as resposta:
+                resposta.encoding = "utf-8"
+                # chunk_size=None: cada evento é lido assim que chega
+                for linha in resposta.iter_lines(chunk_size=None, decode_unicode=True):
+                    if not linha.startswith("data:"):
+                        continue
+                    dados = linha[5:].strip()
+                    if dados == "[DONE]":
+                        break
+                    bloco = json.loads(dados)
+                    uso = bloco.get("usage") or uso
+                    for escolha in bloco.get("choices") or []:
+                        trecho = (escolha.get("delta") or {}).get("content")
+                        if trecho:
+                            if primeiro_trecho is None:
+                                primeiro_trecho = time.monotonic() - inicio
+                            yield trecho
+        except Exception:
+            self._registrar(finalidade, time.monotonic() - inicio, erro=True)
+            raise
+        self._registrar(finalidade, time.monotonic() - inicio, uso=uso, primeiro_trecho=primeiro_trecho)
+
+    def _registrar(self, finalidade, segundos=0.0, erro=False, uso=None, nova_tentativa=False,
+                   primeiro_trecho=None):
+        with self._metricas_lock:
+            metricas = self._metricas.setdefault(finalidade, {
+                "chamadas": 0, "erros": 0, "novas_tentativas": 0,
+                "segundos_total": 0.0, "segundos_max": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+                "prompt_cache_hit_tokens": 0,
+                # Chamadas com stream: tempo até o primeiro trecho da resposta
+                "streams": 0, "segundos_primeiro_trecho_total": 0.0
+            })
+            if nova_tentativa:
+                metricas["novas_tentativas"] += 1
+                return
+            metricas["chamadas"] += 1
+            metricas["erros"] += 1 if erro else 0
+            if primeiro_trecho is not None:
+                metricas["streams"] += 1
+                metricas["segundos_primeiro_trecho_total"] += primeiro_trecho
+            metricas["segundos_total"] += segundos
+            metricas["segundos_max"] = max(metricas["segundos_max"], segundos)
+            for campo in ("prompt_tokens", "completion_tokens", "total_tokens", "prompt_cache_hit_tokens"):
+                metricas[campo] += (uso or {}).get(campo) or 0
+
+    def metricas(self):
+        """Métricas por finalidade, com a latência média das chamadas"""
+        with self._metricas_lock:
+            metricas = {finalidade: dict(valores) for finalidade, valores in self._metricas.items()}
+        for valores in metricas.values():
+            valores["segundos_media"] = valores["segundos_total"] / valores["chamadas"] if valores["chamadas"] else 0.0
+            valores["segundos_primeiro_trecho_media"] = (
+                valores["segundos_primeiro_trecho_total"] / valores["streams"] if valores["streams"] else 0.0)
+        return metricas
+
+deepseek = ClienteDeepSeek(DEEPSEEK_API_KEY, DEEPSEEK_API_URL, DEEPSEEK_MAX_CONEXOES,
+                           DEEPSEEK_TIMEOUT_CONEXAO, DEEPSEEK_TIMEOUT_LEITURA,
+                           DEEPSEEK_MAX_TENTATIVAS, DEEPSEEK_BACKOFF_SEGUNDOS,
+                           Disjuntor("DeepSeek", DEEPSEEK_DISJUNTOR_FALHAS, DEEPSEEK_DISJUNTOR_ABERTO_SEGUNDOS))
+
+class CacheLLM:
+    """
+    Respostas do DeepSeek guardadas num SQLite local, compartilhado pelos
+    workers e mantido entre reinícios. Cada leitura marca a entrada como
+    usada; acima de `max_entradas` as menos usadas recentemente são apagadas.
+    """
+
+    def __init__(self, caminho, max_entradas):
+        self.caminho = caminho
+        self.max_entradas = max_entradas
+        self._local = threading.local()
+        self._metricas = {"acertos": 0, "faltas": 0, "descartes": 0}
+        self._metricas_lock = threading.Lock()
+
+    def _conexao(self):
+        # Conexões SQLite não podem ser compartilhadas entre threads
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=30, isolation_level=None)
+            conexao.execute("PRAGMA journal_mode=WAL")
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            conexao.execute("""
+                CREATE TABLE IF NOT EXISTS respostas (
+                    chave TEXT PRIMARY KEY,
+                    resposta TEXT NOT NULL,
+                    usado_em REAL NOT NULL
+                )
+            """)
+            conexao.execute("CREATE INDEX IF NOT EXISTS idx_respostas_usado_em ON respostas (usado_em)")
+            self._local.conexao = conexao
+        return conexao
+
+    @staticmethod
+    def chave(*partes):
+        """Chave do cache a partir das partes que determinam a resposta"""
+        return hashlib.sha256(json.dumps(partes, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+    def _contar(self, metrica, quantidade=1):
+        with self._metricas_lock:
+            self._metricas[metrica] += quantidade
+
+    def obter(self, chave):
+        """Retorna a resposta guardada para a chave, ou None"""
+        try:
+            conexao = self._conexao()
+            linha = conexao.execute("SELECT resposta FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if linha is None:
+                self._contar("faltas")
+                return None
+            conexao.execute("UPDATE respostas SET usado_em = ? WHERE chave = ?", (time.time(), chave))
+            self._contar("acertos")
+            return json.loads(linha[0])
+        except Exception as e:
+            # Sem cache a extração continua, só mais cara
+            print(f"⚠️ Erro ao ler o cache do DeepSeek: {e}")
+            return None
+
+    def guardar(self, chave, resposta):
+        """Guarda a resposta e descarta as entradas excedentes menos usadas"""
+        try:
+            conexao = self._conexao()
+            conexao.execute("BEGIN IMMEDIATE")
+            try:
+                conexao.execute(
+                    "INSERT OR REPLACE INTO respostas (chave, resposta, usado_em) VALUES (?, ?, ?)",
+                    (chave, json.dumps(resposta, ensure_ascii=False), time.time())
+                )
+                excedentes = conexao.execute("SELECT COUNT(*) FROM respostas").fetchone()[0] - self.max_entradas
+                if excedentes > 0:
+                    conexao.execute(
+                        "DELETE FROM respostas WHERE chave IN "
+                        "(SELECT chave FROM respostas ORDER BY usado_em LIMIT ?)",
+                        (excedentes,)
+                    )
+                    self._contar("descartes", excedentes)
+                conexao.execute("COMMIT")
+            except Exception:
+                conexao.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            print(f"⚠️ Erro ao gravar no cache do DeepSeek: {e}")
+
+    def metricas(self):
+        with self._metricas_lock:
+            metricas = dict(self._metricas)
+        try:
+            metricas["entradas"] = self._conexao().execute("SELECT COUNT(*) FROM respostas").fetchone()[0]
+        except Exception:
+            metricas["entradas"] = None
+        return metricas
+
+cache_llm = CacheLLM(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRADAS) if LLM_CACHE_ENABLED else None
+
+def normalizar_texto(texto):
+    """Texto comparável: Unicode NFC, minúsculas e espaços repetidos colapsados"""
+    return " ".join(unicodedata.normalize("NFC", texto).lower().split())
+
+def _contexto_padrao(mensagem):
+    """Contexto e mudança chave usados quando o DeepSeek não responde"""
+    return {
+        "contexto": "Informação registrada via formulário",
+        "mudanca_chave": mensagem[:100] + "..." if len(mensagem) > 100 else mensagem
+    }
+
+PROMPT_SISTEMA_CONTEXTO = "Você é um assistente especializado em análise de mensagens de projetos de construção civil. Extraia informações de contexto de forma preciso."
+
+def _chave_contexto(mensagem):
+    """Chave da extração no cache, a mesma nas chamadas individuais e em lote"""
+    return CacheLLM.chave("contexto", MODELO_CONTEXTO, PROMPT_CONTEXTO_VERSAO, normalizar_texto(mensagem))
+
+def extrair_contexto_mensagem(mensagem):
+    """
+    Usa o DeepSeek APENAS para extrair o contexto e mudança chave da mensagem.
+    Levanta exceção se a API falhar ou não devolver o JSON esperado. Textos
+    já processados são respondidos pelo cache local, sem chamar a API.
+    """
+    chave = None
+    if cache_llm is not None:
+        chave = _chave_contexto(mensagem)
+        dados = cache_llm.obter(chave)
+        if dados is not None:
+            return dados
+    
+    prompt = f"""
+    Analise a seguinte mensagem relacionada a projetos de construção e extraia APENAS:
+    
+    1. Um breve contexto da informação
+    2. A mudança chave ou registro importante mencionado
+    
+    MENSAGEM: "{mensagem}"
+    
+    Retorne APENAS um JSON com a seguinte estrutura:
+    {{
+        "contexto": "breve descrição do contexto",
+        "mudanca_chave": "descrição clara da mudança ou registro"
+    }}
+    """
+    
+    payload = {
+        "model": MODELO_CONTEXTO,
+        "messages": [
+            {
+                "role": "system", 
+                "content": PROMPT_SISTEMA_CONTEXTO
+            },
+            {
+                "role": "user", 
+                "content": prompt
+            }
+        ],
+        "temperature": 0.1,
+        "max_tokens": 500
+    }
+    
+    conteudo = deepseek.conversar(payload, "contexto")['message']['content']
+    
+    # Extrair JSON da resposta
+    json_match = re.search(r'\{.*\}', conteudo, re.DOTALL)
+    if not json_match:
+        raise ValueError("JSON não encontrado na resposta da API")
+    dados = json.loads(json_match.group())
+    if chave is not None:
+        cache_llm.guardar(chave, dados)
+    return dados
+
+def _estimar_tokens(texto):
+    # Aproximação para português: cerca de 3 caracteres por token
+    return len(texto) // 3 + 1
+
+def _dividir_lotes(itens):
+    """
+    Divide [(id, texto)] em lotes de até LLM_LOTE_MAX_MENSAGENS cuja resposta
+    estimada ocupa no máximo 80% de LLM_LOTE_MAX_TOKENS
+    """
+    lotes, atual, tokens = [], [], 0
+    for item in itens:
+        # Contexto curto mais uma mudança chave que pode repetir parte do texto
+        saida = 80 + _estimar_tokens(item[1]) // 2
+        if atual and (len(atual) >= LLM_LOTE_MAX_MENSAGENS or tokens + saida > LLM_LOTE_MAX_TOKENS * 0.8):
+            lotes.append(atual)
+            atual, tokens = [], 0
+        atual.append(item)
+        tokens += saida
+    if atual:
+        lotes.append(atual)
+    return lotes
+
+def _extrair_lote_deepseek(itens):
+    """
+    Extrai contexto e mudança chave de [(id, texto)] numa única chamada ao
+    DeepSeek. Retorna {id: dados} só com os itens que vieram válidos; se a
+    resposta for cortada pelo max_tokens, o lote é dividido ao meio e refeito.
+    """
+    # Ids curtos no prompt; a resposta é mapeada de volta para os ids originais
+    ids = {str(posicao): id_ for posicao, (id_, _) in enumerate(itens, 1)}
+    entradas = [{"id": str(posicao), "mensagem": texto} for posicao, (_, texto) in enumerate(itens, 1)]
+    
+    prompt = f"""
+    Analise cada uma das mensagens abaixo, relacionadas a projetos de construção, e extraia APENAS:
+    
+    1. Um breve contexto da informação
+    2. A mudança chave ou registro importante mencionado
+    
+    MENSAGENS: {json.dumps(entradas, ensure_ascii=False)}
+    
+    Retorne APENAS um array JSON com um objeto para cada mensagem, na estrutura:
+    [
+        {{
+            "id": "id da mensagem",
+            "contexto": "breve descrição do contexto",
+            "mudanca_chave": "descrição clara da mudança ou registro"
+        }}
+    ]
+    """
+    
+    payload = {
+        "model": MODELO_CONTEXTO,
+        "messages": [
+            {"role": "system", "content": PROMPT_SISTEMA_CONTEXTO},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.1,
+        "max_tokens": LLM_LOTE_MAX_TOKENS
+    }
+    
+    escolha = deepseek.conversar(payload, "contexto_lote", timeout_leitura=LLM_LOTE_TIMEOUT)
+    
+    if escolha.get('finish_reason') == 'length' and len(itens) > 1:
+        print(f"⚠️ Resposta do lote de {len(itens)} mensagens cortada pelo max_tokens; dividindo o lote")
+        meio = len(itens) // 2
+        resultado = _extrair_lote_deepseek(itens[:meio])
+        resultado.update(_extrair_lote_deepseek(itens[meio:]))
+        return resultado
+    
+    resultado = {}
+    json_match = re.search(r'\[.*\]', escolha['message']['content'], re.DOTALL)
+    try:
+        respostas = json.loads(json_match.group()) if json_match else []
+    except ValueError:
+        respostas = []
+    for resposta in respostas if isinstance(respostas, list) else []:
+        if not isinstance(resposta, dict) or str(resposta.get("id")) not in ids:
+            continue
+        if isinstance(resposta.get("contexto"), str) and isinstance(resposta.get("mudanca_chave"), str):
+            resultado[ids[str(resposta["id"])]] = {
+                "contexto": resposta["contexto"],
+                "mudanca_chave": resposta["mudanca_chave"]
+            }
+    return resultado
+
+def extrair_contextos_em_lote(mensagens):
+    """
+    Extrai contexto e mudança chave de muitas mensagens com poucas chamadas
+    ao DeepSeek. `mensagens` é {id: texto}; retorna {id: dados} só com as
+    extrações bem-sucedidas. Itens que voltam do lote sem um JSON válido são
+    refeitos um a um; se a chamada do lote falhar, o lote fica de fora do
+    resultado (sem chamadas individuais, que falhariam pelo mesmo motivo).
+    Com o disjuntor aberto, levanta DeepSeekIndisponivel; as extrações já
+    feitas ficam no cache local.
+    """
+    resultado, faltantes = {}, []
+    for id_, texto in mensagens.items():
+        dados = cache_llm.obter(_chave_contexto(texto)) if cache_llm is not None else None
+        if dados is not None:
+            resultado[id_] = dados
+        else:
+            faltantes.append((id_, texto))
+    
+    for lote in _dividir_lotes(faltantes):
+        try:
+            extraidos = _extrair_lote_deepseek(lote) if len(lote) > 1 else {}
+        except DeepSeekIndisponivel:
+            raise
+        except Exception as e:
+            print(f"⚠️ Erro na extração em lote ({len(lote)} mensagens): {e}")
+            continue
         
-        # Adiciona à lista
-        banco["mensagens"].append(nova_mensagem)
+        for id_, texto in lote:
+            if id_ in extraidos:
+                resultado[id_] = extraidos[id_]
+                if cache_llm is not None:
+                    cache_llm.guardar(_chave_contexto(texto), extraidos[id_])
+                continue
+            try:
+                resultado[id_] = extrair_contexto_mensagem(texto)
+            except DeepSeekIndisponivel:
+                raise
+            except Exception as e:
+                print(f"⚠️ Erro ao extrair contexto: {e}")
         
-        # Atualiza estatísticas
-        banco["estatisticas"]["total_mensagens"] = len(banco["mensagens"])
-        banco["estatisticas"]["ultima_atualizacao"] = datetime.now().isoformat()
+        if len(lote) > 1:
+            print(f"✅ Lote de {len(lote)} mensagens extraído ({len(extraidos)} na chamada em lote)")
+    
+    return resultado
+
+class FilaEnriquecimento:
+    """
+    Pool de threads que preenche contexto e mudança chave das mensagens
+    gravadas com status_enriquecimento "pendente". As mensagens que se
+    acumulam na fila são extraídas juntas, em lote; a extração é repetida com
+    espera exponencial e, esgotadas as tentativas, a mensagem fica com os
+    valores padrão e status "falhou". Enquanto o disjuntor do DeepSeek estiver
+    aberto, as mensagens esperam na fila sem gastar tentativas.
+    """
+
+    def __init__(self, armazenamento, workers, max_tentativas):
+        self.armazenamento = armazenamento
+        self.workers = workers
+        self.max_tentativas = max_tentativas
+        self._fila = queue.Queue()
+        self._em_andamento = set()
+        self._lock = threading.Lock()
+
+    def iniciar(self):
+        """Inicia as threads do pool e, em segundo plano, a recuperação das pendentes"""
+        for _ in range(self.workers):
+            threading.Thread(target=self._executar, daemon=True).start()
+        threading.Thread(target=self._recuperar_pendentes, daemon=True).start()
+
+    def _recuperar_pendentes(self):
+        """Varre as mensagens pendentes na inicialização e a cada ENRIQUECIMENTO_VARREDURA_SEGUNDOS"""
+        while True:
+            self.varrer_pendentes()
+            if ENRIQUECIMENTO_VARREDURA_SEGUNDOS <= 0:
+                return
+            time.sleep(ENRIQUECIMENTO_VARREDURA_SEGUNDOS)
+
+    def varrer_pendentes(self):
+        """
+        Reenfileira as mensagens que ficaram pendentes, como as da fila de um
+        processo que saiu. Um worker varre por vez e solta a trava ao final,
+        para que o substituto de qualquer worker também possa varrer; as
+        mensagens já na fila deste processo não são repetidas.
+        Retorna quantas mensagens pendentes foram encontradas.
+        """
+        with open(ENRIQUECIMENTO_TRAVA, "w") as trava:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return 0  # outro worker está varrendo
+            try:
+                pendentes = [m for m in self.armazenamento.consultar()
+                             if m.get("status_enriquecimento") == "pendente"]
+            except Exception as e:
+                print(f"❌ Erro ao procurar mensagens pendentes de enriquecimento: {e}")
+                return 0
+            for mensagem in pendentes:
+                self.enfileirar(mensagem["projeto"], mensagem["mensagem_hash"], mensagem["mensagem_original"])
+        if pendentes:
+            print(f"♻️ {len(pendentes)} mensagens pendentes de enriquecimento na fila")
+        return len(pendentes)
+
+    def enfileirar(self, projeto_id, mensagem_hash, texto):
+        """Agenda a extração do contexto de uma mensagem já gravada"""
+        with self._lock:
+            if (projeto_id, mensagem_hash) in self._em_andamento:
+                return
+            self._em_andamento.add((projeto_id, mensagem_hash))
+        self._fila.put((projeto_id, mensagem_hash, texto))
+
+    def pendentes(self):
+        """Quantidade de mensagens na fila ou sendo processadas neste processo"""
+        with self._lock:
+            return len(self._em_andamento)
+
+    def _executar(self):
+        while True:
+            lote = [self._fila.get()]
+            while len(lote) < LLM_LOTE_MAX_MENSAGENS:
+                try:
+                    lote.append(self._fila.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.enriquecer(lote)
+            except Exception as e:
+                print(f"❌ Erro no enriquecimento de {len(lote)} mensagens: {e}")
+            finally:
+                with self._lock:
+                    for projeto_id, mensagem_hash, _ in lote:
+                        self._em_andamento.discard((projeto_id, mensagem_hash))
+
+    def _esperar(self, tentativa):
+        time.sleep((2 ** tentativa) * random.uniform(0.5, 1.5))
+
+    def enriquecer(self, lote):
+        """Extrai e grava o contexto de [(projeto_id, mensagem_hash, texto)], de forma síncrona"""
+        textos = {(projeto_id, mensagem_hash): texto for projeto_id, mensagem_hash, texto in lote}
+        extraidos = {}
+        tentativa = 0
+        while tentativa < self.max_tentativas:
+            faltantes = {chave: texto for chave, texto in textos.items() if chave not in extraidos}
+            try:
+                extraidos.update(extrair_contextos_em_lote(faltantes))
+            except DeepSeekIndisponivel:
+                espera = max(deepseek.disjuntor.segundos_para_sondagem(), 1.0)
+                print(f"⏸️ DeepSeek indisponível; {len(faltantes)} mensagens aguardam {espera:.0f}s")
+                time.sleep(espera)
+                continue
+            tentativa += 1
+            if len(extraidos) == len(textos):
+                break
+            print(f"⚠️ {len(textos) - len(extraidos)} extrações falharam (tentativa {tentativa})")
+            if tentativa < self.max_tentativas:
+                self._esperar(tentativa - 1)
+
+        atualizacoes = []
+        for (projeto_id, mensagem_hash), texto in textos.items():
+            dados = extraidos.get((projeto_id, mensagem_hash))
+            status = "concluido" if dados is not None else "falhou"
+            if dados is None:
+                dados = _contexto_padrao(texto)
+            atualizacoes.append({
+                "projeto": projeto_id,
+                "mensagem_hash": mensagem_hash,
+                "campos": {
+                    "contexto": dados.get("contexto", ""),
+                    "mudanca_chave": dados.get("mudanca_chave", ""),
+                    "status_enriquecimento": status
+                }
+            })
+
+        for tentativa in range(self.max_tentativas):
+            sucesso, mensagem, atualizadas = self.armazenamento.atualizar_lote(atualizacoes)
+            gravadas = set(atualizadas)
+            atualizacoes = [a for a in atualizacoes if (a["projeto"], a["mensagem_hash"]) not in gravadas]
+            if gravadas:
+                print(f"✅ Contexto gravado em {len(gravadas)} mensagens")
+            if not atualizacoes:
+                return
+            motivo = mensagem if not sucesso else "mensagens não encontradas"
+            print(f"⚠️ Contexto de {len(atualizacoes)} mensagens não foi gravado: {motivo}")
+            self._esperar(tentativa)
+        print(f"❌ Contexto de {len(atualizacoes)} mensagens não foi gravado; elas continuam pendentes")
+
+def salvar_mensagem(projeto_id, categoria, data_info, mensagem, lesson_learned):
+    """
+    Salva os dados processados no armazenamento configurado.
+    Retorna (sucesso, mensagem, status_enriquecimento gravado ou None).
+    """
+    # Verificar duplicata antes de processar
+    if verificar_duplicata(projeto_id, categoria, mensagem):
+        return False, "Esta informação já foi registrada anteriormente.", None
+    
+    if deepseek.disjuntor.aberto():
+        # DeepSeek fora do ar: valores padrão agora, contexto extraído quando ele voltar
+        dados_processados = _contexto_padrao(mensagem)
+        status_enriquecimento = "pendente"
+    elif ENRIQUECIMENTO_ASYNC_ENABLED:
+        # O contexto é extraído depois, sem prender a requisição ao DeepSeek
+        dados_processados = {"contexto": "", "mudanca_chave": ""}
+        status_enriquecimento = "pendente"
+    else:
+        # Processar apenas o contexto e mudança chave com DeepSeek. Se ele
+        # falhar (timeout, tentativas esgotadas, disjuntor aberto no meio da
+        # chamada), valores padrão agora e contexto extraído depois, pela fila
+        try:
+            dados_processados = extrair_contexto_mensagem(mensagem)
+            status_enriquecimento = "concluido"
+        except Exception as e:
+            print(f"Erro ao processar contexto: {e}")
+            dados_processados = _contexto_padrao(mensagem)
+            status_enriquecimento = "pendente"
+    
+    # Gerar hash único para a mensagem
+    mensagem_hash = gerar_hash_mensagem(projeto_id, categoria, mensagem)
+    
+    try:
+        # Cria nova mensagem (o id é atribuído pelo armazenamento)
+        nova_mensagem = {
+            "id": None,
+            "timestamp": data_info,
+            "remetente": None,
+            "categoria": categoria,
+            "contexto": dados_processados.get("contexto", ""),
+            "mudanca_chave": dados_processados.get("mudanca_chave", ""),
+            "mensagem_original": mensagem,
+            "projeto": projeto_id,
+            "lesson_learned": lesson_learned,
+            "mensagem_hash": mensagem_hash,
+            "status_enriquecimento": status_enriquecimento
+        }
         
-        # Salva no Dropbox
-        if salvar_banco_dropbox(banco):
-            print("✅ Mensagem salva no Dropbox com sucesso!")
-            return True, "Informação registrada com sucesso!"
-        else:
-            return False, "Erro ao salvar no banco de dados"
+        sucesso, resultado = armazenamento.anexar(nova_mensagem)
+        if sucesso:
+            print("✅ Mensagem salva com sucesso!")
+            if status_enriquecimento == "pendente":
+                enriquecimento.enfileirar(projeto_id, mensagem_hash, mensagem)
+        return sucesso, resultado, status_enriquecimento if sucesso else None
         
     except Exception as e:
         print(f"Erro ao salvar mensagem: {e}")
-        return False, f"Erro ao processar a mensagem: {str(e)}"
+        return False, f"Erro ao processar a mensagem: {str(e)}", None
+
+# Campos exportados, tamanho aproximado de cada bloco enviado na exportação em
+# streaming e linhas por grupo nos formatos colunares (Parquet e Arrow)
+CAMPOS_EXPORTACAO = ['id', 'timestamp', 'categoria', 'contexto', 'mudanca_chave', 'mensagem_original', 'projeto', 'lesson_learned']
+EXPORTACAO_BLOCO_BYTES = 64 * 1024
+EXPORTACAO_LINHAS_POR_GRUPO = 10000
+
+def nome_exportacao(projeto_id=None, extensao="csv"):
+    if projeto_id:
+        return f"mensagens_projeto_{projeto_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+    return f"mensagens_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extensao}"
+
+def fim_do_periodo(fim):
+    """Data sem hora como fim de um período: o dia final entra inteiro"""
+    if fim and len(fim) == 10:
+        return f"{fim}T23:59:59"
+    return fim
+
+def linhas_exportacao(projeto_id=None, categoria=None, inicio=None, fim=None):
+    """
+    Iterador comum a todos os formatos de exportação: as mensagens filtradas
+    pelo armazenamento, antes de qualquer serialização, reduzidas aos
+    CAMPOS_EXPORTACAO. `inicio` e `fim` são datas ou timestamps ISO.
+    """
+    for mensagem in armazenamento.consultar(projeto_id, categoria, inicio, fim_do_periodo(fim)):
+        yield {campo: mensagem.get(campo) for campo in CAMPOS_EXPORTACAO}
+
+def gerar_csv(mensagens):
+    """
+    Gera o CSV das mensagens em blocos de bytes (UTF-8) de cerca de
+    EXPORTACAO_BLOCO_BYTES, sem montar o arquivo inteiro em memória
+    """
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CAMPOS_EXPORTACAO)
+    writer.writeheader()
+    for mensagem in mensagens:
+        # Filtrar apenas os campos que queremos
+        writer.writerow({campo: mensagem.get(campo, '') for campo in CAMPOS_EXPORTACAO})
+        if buffer.tell() >= EXPORTACAO_BLOCO_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gerar_ndjson(linhas):
+    """Um objeto JSON por linha (NDJSON), em blocos de bytes de cerca de EXPORTACAO_BLOCO_BYTES"""
+    buffer = io.StringIO()
+    for linha in linhas:
+        buffer.write(json.dumps(linha, ensure_ascii=False))
+        buffer.write("\n")
+        if buffer.tell() >= EXPORTACAO_BLOCO_BYTES:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+class _SaidaEmBlocos:
+    """Arquivo só de escrita cujo conteúdo é retirado aos poucos, para respostas em streaming"""
+
+    def __init__(self):
+        self._partes = []
+        self._posicao = 0
+        self.closed = False
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes = []
+        return dados
+
+def _esquema_arrow():
+    # categoria e projeto se repetem muito: codificados como dicionário.
+    # timestamp vai normalizado em UTC; timestamp_original guarda o texto
+    # gravado, inclusive quando não é uma data ISO
+    categorico = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    return pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("timestamp", pyarrow.timestamp("us", tz="UTC")),
+        ("timestamp_original", pyarrow.string()),
+        ("categoria", categorico),
+        ("contexto", pyarrow.string()),
+        ("mudanca_chave", pyarrow.string()),
+        ("mensagem_original", pyarrow.string()),
+        ("projeto", categorico),
+        ("lesson_learned", pyarrow.bool_())
+    ])
+
+def _data_hora(valor):
+    """
+    Timestamp ISO em UTC. Valores sem fuso são horário local do servidor
+    (datetime.now() na gravação); o que não for ISO vira None
+    """
+    try:
+        data_hora = datetime.fromisoformat(valor.replace("Z", "+00:00")) if valor else None
+    except (AttributeError, ValueError):
+        return None
+    return data_hora.astimezone(timezone.utc) if data_hora else None
+
+def _lotes_arrow(linhas, esquema):
+    """Agrupa as linhas em RecordBatches de EXPORTACAO_LINHAS_POR_GRUPO, com os tipos do esquema"""
+    linhas = iter(linhas)
+    while True:
+        lote = list(itertools.islice(linhas, EXPORTACAO_LINHAS_POR_GRUPO))
+        if not lote:
+            return
+        colunas = {campo: [linha[campo] for linha in lote] for campo in CAMPOS_EXPORTACAO}
+        colunas["id"] = [int(valor) if valor is not None else None for valor in colunas["id"]]
+        colunas["timestamp_original"] = [str(valor) if valor is not None else None for valor in colunas["timestamp"]]
+        colunas["timestamp"] = [_data_hora(valor) for valor in colunas["timestamp_original"]]
+        colunas["lesson_learned"] = [valor == "sim" if valor is not None else None for valor in colunas["lesson_learned"]]
+        yield pyarrow.RecordBatch.from_pydict(colunas, schema=esquema)
+
+def gerar_parquet(linhas):
+    """Arquivo Parquet (compressão zstd), gerado e enviado um grupo de linhas por vez"""
+    esquema = _esquema_arrow()
+    saida = _SaidaEmBlocos()
+    with pyarrow.parquet.ParquetWriter(saida, esquema, compression="zstd") as escritor:
+        for lote in _lotes_arrow(linhas, esquema):
+            escritor.write_batch(lote)
+            dados = saida.retirar()
+            if dados:
+                yield dados
+    yield saida.retirar()
+
+def gerar_arrow(linhas):
+    """Stream IPC do Arrow, um RecordBatch por grupo de linhas"""
+    esquema = _esquema_arrow()
+    saida = _SaidaEmBlocos()
+    with pyarrow.ipc.new_stream(saida, esquema) as escritor:
+        for lote in _lotes_arrow(linhas, esquema):
+            escritor.write_batch(lote)
+            yield saida.retirar()
+    yield saida.retirar()
+
+# Formatos da exportação em streaming: nome -> (gerador de blocos, mimetype,
+# extensão do arquivo, aceita gzip). Parquet e Arrow dependem do pyarrow.
+FORMATOS_EXPORTACAO = {
+    "csv": (gerar_csv, "text/csv; charset=utf-8", "csv", True),
+    "ndjson": (gerar_ndjson, "application/x-ndjson", "ndjson", True),
+    "parquet": (gerar_parquet, "application/vnd.apache.parquet", "parquet", False),
+    "arrow": (gerar_arrow, "application/vnd.apache.arrow.stream", "arrow", False)
+}
+
+def comprimir_gzip(blocos):
+    """Compacta em gzip uma sequência de blocos de bytes, bloco a bloco"""
+    compressor = zlib.compressobj(DB_CODEC_NIVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for bloco in blocos:
+        comprimido = compressor.compress(bloco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
 
 def exportar_para_csv(projeto_id=None):
     """
-    Exporta dados para CSV sem usar pandas
+    Exporta dados para um arquivo CSV no diretório de trabalho. Prefira a
+    exportação em streaming (GET /api/exportar_csv), que não grava arquivos.
     """
     try:
-        banco = carregar_banco_dropbox()
-        mensagens = banco.get("mensagens", [])
-        
-        if projeto_id:
-            mensagens = [msg for msg in mensagens if msg.get("projeto") == projeto_id]
-        
-        if not mensagens:
+        mensagens = iter(linhas_exportacao(projeto_id))
+        primeira = next(mensagens, None)
+        if primeira is None:
             return None, "Nenhum dado encontrado para exportar"
         
-        # Criar arquivo CSV
-        if projeto_id:
-            nome_arquivo = f"mensagens_projeto_{projeto_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        else:
-            nome_arquivo = f"mensagens_completo_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        # Definir cabeçalhos
-        campos = ['id', 'timestamp', 'categoria', 'contexto', 'mudanca_chave', 'mensagem_original', 'projeto', 'lesson_learned']
+        nome_arquivo = nome_exportacao(projeto_id)
+        registros = 0
         
-        with open(nome_arquivo, 'w', newline='', encoding='utf-8') as arquivo:
-            writer = csv.DictWriter(arquivo, fieldnames=campos)
-            writer.writeheader()
-            
+        def contar(mensagens):
+            nonlocal registros
             for mensagem in mensagens:
-                # Filtrar apenas os campos que queremos
-                linha = {campo: mensagem.get(campo, '') for campo in campos}
-                writer.writerow(linha)
+                registros += 1
+                yield mensagem
+        
+        with open(nome_arquivo, 'wb') as arquivo:
+            for bloco in gerar_csv(contar(itertools.chain([primeira], mensagens))):
+                arquivo.write(bloco)
         
-        return nome_arquivo, f"Exportação concluída: {len(mensagens)} registros"
+        return nome_arquivo, f"Exportação concluída: {registros} registros"
         
     except Exception as e:
         return None, f"Erro na exportação: {str(e)}"
@@ -325,42 +3956,459 @@ def obter_estatisticas_banco(projeto_id=None):
     Obtém estatísticas do banco de dados sem pandas
     """
     try:
-        banco = carregar_banco_dropbox()
-        mensagens = banco.get("mensagens", [])
-        
-        if projeto_id:
-            mensagens = [msg for msg in mensagens if msg.get("projeto") == projeto_id]
-        
-        # Por categoria
-        categorias = {}
-        for msg in mensagens:
-            cat = msg.get("categoria", "Outros")
-            categorias[cat] = categorias.get(cat, 0) + 1
+        estatisticas = armazenamento.estatisticas(projeto_id)
         
         # Converter para lista de dicionários
-        por_categoria = [{"categoria": k, "quantidade": v} for k, v in categorias.items()]
-        
-        # Lessons Learned
-        lessons_learned = sum(1 for msg in mensagens if msg.get("lesson_learned") == "sim")
+        por_categoria = [{"categoria": k, "quantidade": v} for k, v in estatisticas["por_categoria"].items()]
         
         return {
-            'total': len(mensagens),
+            'total': estatisticas["total"],
             'por_categoria': por_categoria,
-            'lessons_learned': lessons_learned,
+            'lessons_learned': estatisticas["lessons_learned"],
             'projeto': projeto_id if projeto_id else 'Todos os projetos'
         }
         
     except Exception as e:
         return {'erro': str(e)}
 
+class ExecucaoUnica:
+    """
+    Coalescência de chamadas idênticas simultâneas (single-flight): enquanto
+    a execução de uma chave está em andamento, quem pede a mesma chave espera
+    por ela e recebe o mesmo resultado (ou a mesma exceção). Com `diretorio`,
+    vale também entre os processos da máquina: o líder segura uma trava de
+    arquivo (flock) própria da chave e publica o resultado em JSON para quem
+    esperava a trava; ao concluir, ele remove o arquivo de trava.
+    """
+
+    def __init__(self, diretorio=None, espera_segundos=90):
+        self.diretorio = diretorio if fcntl is not None else None
+        self.espera_segundos = espera_segundos
+        self._execucoes = {}
+        self._lock = threading.Lock()
+        self._metricas = {"execucoes": 0, "coalescidas": 0, "coalescidas_entre_workers": 0}
+        if self.diretorio:
+            os.makedirs(self.diretorio, exist_ok=True)
+
+    def iniciar(self, chave):
+        """
+        Entra na execução da chave. Retorna (execucao, lider): o líder executa
+        e chama concluir(); os demais obtêm o resultado com aguardar().
+        """
+        with self._lock:
+            execucao = self._execucoes.get(chave)
+            if execucao is not None:
+                self._metricas["coalescidas"] += 1
+                return execucao, False
+            execucao = {"chave": chave, "evento": threading.Event(), "resultado": None,
+                        "erro": None, "trava": None}
+            self._execucoes[chave] = execucao
+        if self.diretorio:
+            publicado = self._travar_entre_workers(execucao)
+            if publicado is not None:
+                # Outro worker executou enquanto este esperava a trava
+                self.concluir(execucao, resultado=publicado["resultado"])
+                return execucao, False
+        with self._lock:
+            self._metricas["execucoes"] += 1
+        return execucao, True
+
+    def _arquivos(self, chave):
+        # Uma trava por chave: chaves diferentes nunca esperam umas pelas outras
+        nome = hashlib.sha256(repr(chave).encode("utf-8")).hexdigest()
+        return (os.path.join(self.diretorio, f"{nome}.lock"),
+                os.path.join(self.diretorio, f"{nome}.json"))
+
+    @staticmethod
+    def _travar_arquivo(caminho):
+        """Trava (flock) o arquivo de trava, sem esperar. Retorna o arquivo aberto, ou None"""
+        trava = open(caminho, "a")
+        try:
+            fcntl.flock(trava, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # O dono anterior pode ter removido o arquivo depois da abertura:
+            # a trava só vale se o caminho ainda for o arquivo travado
+            if os.stat(caminho).st_ino == os.fstat(trava.fileno()).st_ino:
+                return trava
+        except OSError:
+            pass
+        trava.close()
+        return None
+
+    def _travar_entre_workers(self, execucao):
+        """Obtém a trava da chave; retorna o resultado publicado por outro worker durante a espera, se houver"""
+        caminho_trava, caminho_resultado = self._arquivos(execucao["chave"])
+        inicio = time.time()
+        limite = time.monotonic() + self.espera_segundos
+        trava = self._travar_arquivo(caminho_trava)
+        if trava is None:
+            while trava is None:
+                if time.monotonic() > limite:
+                    # O outro worker demorou demais: executa sem a trava
+                    return None
+                time.sleep(0.05)
+                trava = self._travar_arquivo(caminho_trava)
+            publicado = self._ler_resultado(caminho_resultado, inicio)
+            if publicado is not None:
+                self._soltar(trava, caminho_trava)
+                with self._lock:
+                    self._metricas["coalescidas_entre_workers"] += 1
+                return publicado
+        execucao["trava"] = (trava, caminho_trava, caminho_resultado)
+        return None
+
+    @staticmethod
+    def _soltar(trava, caminho):
+        """Remove o arquivo de trava (ainda travado, para ninguém o herdar) e solta a trava"""
+        try:
+            os.remove(caminho)
+        except OSError:
+            pass
+        fcntl.flock(trava, fcntl.LOCK_UN)
+        trava.close()
+
+    def _ler_resultado(self, caminho, desde):
+        try:
+            with open(caminho, "r", encoding="utf-8") as f:
+                publicado = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return publicado if publicado.get("gravado_em", 0) >= desde else None
+
+    def _publicar(self, caminho, resultado):
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        with open(temporario, "w", encoding="utf-8") as f:
+            json.dump({"gravado_em": time.time(), "resultado": resultado}, f, ensure_ascii=False)
+        os.replace(temporario, caminho)
+        # Resultados antigos não servem a mais ninguém, e travas antigas e
+        # livres são de processos que saíram sem removê-las
+        for entrada in os.scandir(self.diretorio):
+            try:
+                if entrada.stat().st_mtime >= time.time() - self.espera_segundos:
+                    continue
+                if entrada.name.endswith(".json"):
+                    os.remove(entrada.path)
+                elif entrada.name.endswith(".lock"):
+                    trava = self._travar_arquivo(entrada.path)
+                    if trava is not None:
+                        self._soltar(trava, entrada.path)
+            except OSError:
+                pass
+
+    def concluir(self, execucao, resultado=None, erro=None):
+        """Entrega o resultado (ou a exceção) do líder a quem espera e libera a chave"""
+        if execucao["trava"] is not None:
+            trava, caminho_trava, caminho_resultado = execucao["trava"]
+            try:
+                if erro is None:
+                    self._publicar(caminho_resultado, resultado)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"⚠️ Resultado não publicado para os outros workers: {e}")
+            finally:
+                self._soltar(trava, caminho_trava)
+        with self._lock:
+            if self._execucoes.get(execucao["chave"]) is execucao:
+                del self._execucoes[execucao["chave"]]
+        execucao["resultado"], execucao["erro"] = resultado, erro
+        execucao["evento"].set()
+
+    def aguardar(self, execucao):
+        if not execucao["evento"].wait(self.espera_segundos):
+            raise TimeoutError("Tempo esgotado aguardando execução idêntica em andamento")
+        if execucao["erro"] is not None:
+            raise execucao["erro"]
+        return execucao["resultado"]
+
+    def executar(self, chave, funcao):
+        """Executa funcao() uma única vez para as chamadas simultâneas com a mesma chave"""
+        execucao, lider = self.iniciar(chave)
+        if not lider:
+            return self.aguardar(execucao)
+        try:
+            resultado = funcao()
+        except Exception as e:
+            self.concluir(execucao, erro=e)
+            raise
+        self.concluir(execucao, resultado=resultado)
+        return resultado
+
+    def metricas(self):
+        with self._lock:
+            return dict(self._metricas, em_andamento=len(self._execucoes))
+
+execucao_unica = ExecucaoUnica(EXECUCAO_UNICA_DIR if EXECUCAO_UNICA_ENTRE_WORKERS else None,
+                               EXECUCAO_UNICA_ESPERA_SEGUNDOS)
+
+class CacheRespostas:
+    """Cache em memória com validade (TTL) e descarte das entradas usadas há mais tempo (LRU)"""
+
+    def __init__(self, ttl_segundos, max_entradas):
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        self._entradas = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._metricas = {"acertos": 0, "faltas": 0, "expiradas": 0, "descartes": 0}
+
+    def obter(self, chave):
+        """Retorna o valor guardado e ainda válido para a chave, ou None"""
+        with self._lock:
+            item = self._entradas.get(chave)
+            if item is None:
+                self._metricas["faltas"] += 1
+                return None
+            valor, expira_em = item
+            if time.monotonic() >= expira_em:
+                del self._entradas[chave]
+                self._metricas["expiradas"] += 1
+                self._metricas["faltas"] += 1
+                return None
+            self._entradas.move_to_end(chave)
+            self._metricas["acertos"] += 1
+            return valor
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._entradas[chave] = (valor, time.monotonic() + self.ttl_segundos)
+            self._entradas.move_to_end(chave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self._metricas["descartes"] += 1
+
+    def metricas(self):
+        with self._lock:
+            return dict(self._metricas, entradas=len(self._entradas))
+
+# Consultas locais: perguntas de contagem, agrupamento e listagem respondidas
+# diretamente a partir dos dados, sem chamada ao DeepSeek
+
+MESES_PT = ["janeiro", "fevereiro", "marco", "abril", "maio", "junho", "julho",
+            "agosto", "setembro", "outubro", "novembro", "dezembro"]
+
+# Palavras que uma pergunta respondida localmente pode conter; qualquer outro
+# termo (um assunto, por exemplo) leva a pergunta ao DeepSeek
+VOCABULARIO_CONSULTA_LOCAL = frozenset(tokenizar("""
+quantas quantos quantidade numero total totais contagem contar soma somam distribuicao
+distribuidas agrupadas agrupados separadas mensagem mensagens registro registros
+informacao informacoes item itens entrada entradas registradas registrados cadastradas
+existem existe havia temos tinha teve tiveram houve possui possuem foram cada geral
+todo todos todas banco dados sistema projeto projetos categoria categorias tipo tipos
+mes meses mensal mensais mensalmente ano anos dia dias semana hoje ontem desde partir apos
+antes durante periodo ultimos ultimas ultimo ultima passado passada atual corrente
+top maior maiores menor menores menos ranking principais lessons lesson learned
+licoes licao aprendidas aprendida mostre mostrar mostra liste listar lista exiba exibir
+recentes recente novas novos
+""" + " ".join(MESES_PT)))
+
+_PADRAO_PERIODO = re.compile(
+    r"(?P<dia>\d{1,2})/(?P<mes>\d{1,2})/(?P<ano>\d{4})"
+    r"|(?P<iso>\d{4}-\d{2}-\d{2})"
+    r"|\b(?P<mes_nome>" + "|".join(MESES_PT) + r")\b(?:\s+de)?(?:\s+(?P<ano_mes>\d{4})\b)?"
+    r"|\b(?P<mes_num>\d{1,2})/(?P<ano_num>\d{4})\b"
+    r"|\b(?P<ano_solo>(?:19|20)\d{2})\b"
+)
+
+def _fim_do_mes(ano, mes):
+    return (datetime(ano + mes // 12, mes % 12 + 1, 1) - timedelta(days=1)).date()
+
+def _periodo_citado(trecho, ano_padrao):
+    """(primeiro dia, último dia) do período de uma ocorrência de _PADRAO_PERIODO"""
+    if trecho.group("dia"):
+        dia = datetime(int(trecho.group("ano")), int(trecho.group("mes")), int(trecho.group("dia"))).date()
+        return dia, dia
+    if trecho.group("iso"):
+        dia = datetime.strptime(trecho.group("iso"), "%Y-%m-%d").date()
+        return dia, dia
+    if trecho.group("mes_nome") or trecho.group("mes_num"):
+        if trecho.group("mes_nome"):
+            mes = MESES_PT.index(trecho.group("mes_nome")) + 1
+            ano = int(trecho.group("ano_mes") or ano_padrao)
+        else:
+            mes, ano = int(trecho.group("mes_num")), int(trecho.group("ano_num"))
+        return datetime(ano, mes, 1).date(), _fim_do_mes(ano, mes)
+    ano = int(trecho.group("ano_solo"))
+    return datetime(ano, 1, 1).date(), datetime(ano, 12, 31).date()
+
+def _periodo_relativo(texto, hoje):
+    """Período de expressões como "hoje", "mês passado" ou "últimos 7 dias"; None se não houver"""
+    ultimos = re.search(r"\bultim[oa]s\s+(\d+)\s+dias\b", texto)
+    if ultimos:
+        return hoje - timedelta(days=int(ultimos.group(1)) - 1), hoje
+    if re.search(r"\bhoje\b", texto):
+        return hoje, hoje
+    if re.search(r"\bontem\b", texto):
+        return hoje - timedelta(days=1), hoje - timedelta(days=1)
+    if re.search(r"\b(mes passado|ultimo mes)\b", texto):
+        anterior = hoje.replace(day=1) - timedelta(days=1)
+        return anterior.replace(day=1), anterior
+    if re.search(r"\b((n?est|n?ess|d?est|d?ess)e mes|mes atual|mes corrente)\b", texto):
+        return hoje.replace(day=1), _fim_do_mes(hoje.year, hoje.month)
+    if re.search(r"\b(ano passado|ultimo ano)\b", texto):
+        return hoje.replace(year=hoje.year - 1, month=1, day=1), hoje.replace(year=hoje.year - 1, month=12, day=31)
+    if re.search(r"\b((n?est|n?ess|d?est|d?ess)e ano|ano atual|ano corrente)\b", texto):
+        return hoje.replace(month=1, day=1), hoje.replace(month=12, day=31)
+    return None
+
+def interpretar_periodo(texto, hoje=None):
+    """
+    Intervalo de datas citado na pergunta (já sem acentos), como (inicio, fim)
+    em ISO, prontos para o filtro de timestamps; (None, None) se não houver.
+    """
+    hoje = hoje or datetime.now().date()
+    ano_citado = re.search(r"\b(?:19|20)\d{2}\b", texto)
+    ano_padrao = int(ano_citado.group()) if ano_citado else hoje.year
+    trechos = list(_PADRAO_PERIODO.finditer(texto))
+    # Um ano logo após o nome do mês já faz parte do mês
+    trechos = [t for t in trechos if not (t.group("ano_solo") and any(
+        o.group("ano_mes") and o.start() < t.start() < o.end() for o in trechos))]
+    inicio = fim = None
+    if len(trechos) >= 2:
+        inicio, fim = _periodo_citado(trechos[0], ano_padrao)[0], _periodo_citado(trechos[-1], ano_padrao)[1]
+    elif trechos:
+        inicio, fim = _periodo_citado(trechos[0], ano_padrao)
+        anterior = texto[:trechos[0].start()]
+        # "desde" e "até" incluem o período citado; "após" e "antes de", não
+        if re.search(r"\b(desde|a partir d[eoa]s?)\s+(\S+\s+){0,3}$", anterior):
+            fim = None
+        elif re.search(r"\b(apos|depois d[eoa]s?)\s+(\S+\s+){0,3}$", anterior):
+            inicio, fim = fim + timedelta(days=1), None
+        elif re.search(r"\bate\s+(\S+\s+){0,3}$", anterior):
+            inicio = None
+        elif re.search(r"\bantes d[eoa]s?\s+(\S+\s+){0,3}$", anterior):
+            inicio, fim = None, inicio - timedelta(days=1)
+    else:
+        periodo = _periodo_relativo(texto, hoje)
+        if periodo:
+            inicio, fim = periodo
+    return (inicio.isoformat() if inicio else None,
+            f"{fim.isoformat()}T23:59:59" if fim else None)
+
+def interpretar_pergunta(pergunta, categorias=(), projetos=()):
+    """
+    Reconhece perguntas que a consulta local responde com exatidão: contagens
+    (totais, por projeto, categoria ou mês, ranking dos N maiores) e listagem
+    das mensagens mais recentes, com filtros de período, categoria, projeto e
+    Lessons Learned. Retorna a consulta como dicionário, ou None se a pergunta
+    precisar do DeepSeek.
+    """
+    texto = dobrar_acentos(pergunta)
+    listagem = re.search(r"\bmais recentes?\b|\bultim[oa]s\s+(\d+\s+)?(mensagens|registros|informacoes)\b", texto)
+    ranking = re.search(r"\b(mais|maior|maiores|menos|menor|menores|top|ranking|principais)\b", texto)
+    contagem = re.search(r"\b(quant[oa]s?|quantidade|numero|total|contagem|distribuicao)\b", texto)
+    
+    agrupamento = re.search(r"\b(por|cada|pelos?|pelas?|entre os|entre as)\s+(projeto|categoria|mes)", texto)
+    if agrupamento:
+        agrupar_por = agrupamento.group(2)
+    elif re.search(r"\b(mensa(l|is|lmente)|mes a mes)\b", texto):
+        agrupar_por = "mes"
+    else:
+        citado = re.search(r"\b(projetos?|categorias?|mes|meses)\b", texto)
+        plural = re.search(r"\b(projetos|categorias|meses)\b", texto)
+        if ranking and citado and not listagem:
+            agrupar_por = {"projetos": "projeto", "categorias": "categoria", "meses": "mes"}.get(
+                citado.group(1), citado.group(1))
+        elif contagem and plural:
+            agrupar_por = {"projetos": "projeto", "categorias": "categoria", "meses": "mes"}[plural.group(1)]
+        else:
+            agrupar_por = None
+    
+    if listagem:
+        tipo = "listagem"
+    elif contagem or agrupar_por:
+        tipo = "contagem"
+    else:
+        return None
+    
+    # Filtros citados na pergunta
+    categoria = None
+    for candidata in sorted(categorias, key=len, reverse=True):
+        if candidata and re.search(rf"\b{re.escape(dobrar_acentos(candidata))}\b", texto):
+            categoria = candidata
+            break
+    projeto = re.search(r"\bprojeto\s+(\d+)\b", texto)
+    if projeto and projeto.group(1) not in projetos:
+        return None
+    projeto_id = projeto.group(1) if projeto else None
+    
+    # Termos que a consulta local não entende: a pergunta vai ao DeepSeek
+    conhecidos = set(VOCABULARIO_CONSULTA_LOCAL)
+    if categoria:
+        conhecidos.update(tokenizar(categoria))
+    restantes = [t for t in tokenizar(texto) if t not in conhecidos and not t.isdigit()]
+    if restantes:
+        return None
+    
+    limite = None
+    numero = re.search(r"\btop\s*(\d+)\b|\b(\d+)\s+(projetos|categorias|meses|mensagens|registros|informacoes)\b", texto)
+    if numero:
+        limite = int(numero.group(1) or numero.group(2))
+    elif tipo == "listagem":
+        limite = 5
+    elif ranking and agrupar_por:
+        singular = re.search(r"\b(qual|que)\s+(o\s+|a\s+)?(projeto|categoria|mes)\b", texto)
+        limite = 1 if singular else 5
+    
+    inicio, fim = interpretar_periodo(texto)
+    return {
+        "tipo": tipo,
+        "agrupar_por": agrupar_por if tipo == "contagem" else None,
+        "limite": limite,
+        "crescente": bool(re.search(r"\b(menos|menor|menores)\b", texto)),
+        "projeto_id": projeto_id,
+        "categoria": categoria,
+        "apenas_lessons": bool(re.search(r"\blessons? learned\b|\blico(es)? aprendidas?\b|\blicao aprendida\b", texto)),
+        "inicio": inicio,
+        "fim": fim
+    }
+
+def _filtrar_consulta(projeto_id=None, categoria=None, inicio=None, fim=None, apenas_lessons=False):
+    for msg in armazenamento.consultar(projeto_id, categoria, inicio, fim):
+        if apenas_lessons and msg.get("lesson_learned") != "sim":
+            continue
+        yield msg
+
+def consulta_agregada(projeto_id=None, agrupar_por=None, categoria=None, inicio=None, fim=None,
+                      apenas_lessons=False, limite=None, crescente=False):
+    """
+    Conta as mensagens que passam pelos filtros. Sem `agrupar_por`, retorna o
+    total; com "projeto", "categoria" ou "mes", retorna [(grupo, quantidade)]
+    da maior para a menor quantidade (ou o inverso, com `crescente`), limitada
+    aos `limite` primeiros grupos. Meses sem limite saem em ordem cronológica.
+    """
+    if not (categoria or inicio or fim) and agrupar_por is None:
+        # Contadores mantidos a cada gravação, sem percorrer as mensagens
+        estatisticas = armazenamento.estatisticas(projeto_id)
+        return estatisticas["lessons_learned"] if apenas_lessons else estatisticas["total"]
+    if not (categoria or inicio or fim or apenas_lessons) and agrupar_por == "categoria":
+        contagem = collections.Counter(armazenamento.estatisticas(projeto_id)["por_categoria"])
+    else:
+        contagem = collections.Counter()
+        for msg in _filtrar_consulta(projeto_id, categoria, inicio, fim, apenas_lessons):
+            if agrupar_por == "mes":
+                grupo = (msg.get("timestamp") or "")[:7] or "sem data"
+            elif agrupar_por:
+                grupo = msg.get(agrupar_por)
+            else:
+                grupo = None
+            contagem[grupo] += 1
+        if agrupar_por is None:
+            return contagem[None]
+    
+    grupos = [(grupo, quantidade) for grupo, quantidade in contagem.items() if quantidade]
+    if agrupar_por == "mes" and limite is None:
+        return sorted(grupos)
+    grupos.sort(key=lambda item: (item[1] if crescente else -item[1], str(item[0])))
+    return grupos[:limite] if limite else grupos
+
+def mensagens_recentes(projeto_id=None, categoria=None, inicio=None, fim=None,
+                       apenas_lessons=False, limite=5):
+    """As `limite` mensagens filtradas de timestamp mais recente"""
+    return heapq.nlargest(limite, _filtrar_consulta(projeto_id, categoria, inicio, fim, apenas_lessons),
+                          key=lambda msg: msg.get("timestamp") or "")
+
 class DBAnalyzer:
-    def __init__(self, api_key):
-        self.api_key = api_key
-        self.api_url = "https://api.deepseek.com/v1/chat/completions"
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+    def __init__(self, cliente, cache=None, single_flight=None):
+        self.cliente = cliente
+        self.cache = cache
+        self.single_flight = single_flight
     
     def extract_db_schema(self):
         return """
@@ -377,27 +4425,47 @@ class DBAnalyzer:
         - lesson_learned: se é lesson learned
         """
     
-    def extract_data_samples(self, projeto_id=None):
+    def _format_sample(self, i, msg):
+        sample = f"MENSAGEM {i+1}:\n"
+        sample += f"  Projeto: {msg.get('projeto', 'N/A')}\n"
+        sample += f"  Categoria: {msg.get('categoria', 'N/A')}\n"
+        sample += f"  Contexto: {msg.get('contexto', 'N/A')}\n"
+        sample += f"  Mudança Chave: {msg.get('mudanca_chave', 'N/A')}\n"
+        sample += f"  Lesson Learned: {msg.get('lesson_learned', 'não')}\n"
+        sample += f"  Data: {msg.get('timestamp', 'N/A')}\n\n"
+        return sample
+    
+    def select_samples(self, question=None, projeto_id=None):
+        """Mensagens mais relevantes para a pergunta, dentro do orçamento de tokens"""
+        candidatos = []
+        if question:
+            indice = armazenamento.obter_indice("bm25", projeto_id)
+            candidatos = [msg for _, msg in indice.buscar(question, projeto_id, CONSULTA_CONTEXTO_MAX_MENSAGENS)]
+        if not candidatos:
+            # Pergunta sem termos em comum com as mensagens: usar as mais recentes
+            recentes = collections.deque(armazenamento.consultar(projeto_id), maxlen=CONSULTA_CONTEXTO_MAX_MENSAGENS)
+            candidatos = list(reversed(recentes))
+        
+        selecionadas, tokens = [], 0
+        for msg in candidatos:
+            custo = _estimar_tokens(self._format_sample(len(selecionadas), msg))
+            if selecionadas and tokens + custo > CONSULTA_CONTEXTO_MAX_TOKENS:
+                break
+            selecionadas.append(msg)
+            tokens += custo
+        return selecionadas
+    
+    def extract_data_samples(self, projeto_id=None, question=None):
         try:
-            banco = carregar_banco_dropbox()
-            mensagens = banco.get("mensagens", [])
+            total = armazenamento.estatisticas(projeto_id)["total"]
             
-            if projeto_id:
-                mensagens = [msg for msg in mensagens if msg.get("projeto") == projeto_id]
-            
-            if not mensagens:
+            if not total:
                 return "Nenhuma mensagem encontrada para análise."
             
-            data_samples = f"AMOSTRAS DE DADOS ({len(mensagens)} mensagens):\n\n"
-            
-            for i, msg in enumerate(mensagens[:5]):  # Limitar a 5 amostras
-                data_samples += f"MENSAGEM {i+1}:\n"
-                data_samples += f"  Projeto: {msg.get('projeto', 'N/A')}\n"
-                data_samples += f"  Categoria: {msg.get('categoria', 'N/A')}\n"
-                data_samples += f"  Contexto: {msg.get('contexto', 'N/A')}\n"
-                data_samples += f"  Mudança Chave: {msg.get('mudanca_chave', 'N/A')}\n"
-                data_samples += f"  Lesson Learned: {msg.get('lesson_learned', 'não')}\n"
-                data_samples += f"  Data: {msg.get('timestamp', 'N/A')}\n\n"
+            amostras = self.select_samples(question, projeto_id)
+            data_samples = f"AMOSTRAS DE DADOS ({len(amostras)} de {total} mensagens, as mais relevantes para a pergunta):\n\n"
+            for i, msg in enumerate(amostras):
+                data_samples += self._format_sample(i, msg)
             
             return data_samples
             
@@ -406,53 +4474,99 @@ class DBAnalyzer:
     
     def execute_query(self, query_type, projeto_id=None):
         try:
-            banco = carregar_banco_dropbox()
-            mensagens = banco.get("mensagens", [])
-            
-            if projeto_id:
-                mensagens = [msg for msg in mensagens if msg.get("projeto") == projeto_id]
+            estatisticas = armazenamento.estatisticas(projeto_id)
             
             if query_type == "count_total":
-                return len(mensagens)
+                return estatisticas["total"]
             
             elif query_type == "count_by_category":
-                categorias = {}
-                for msg in mensagens:
-                    cat = msg.get("categoria", "Outros")
-                    categorias[cat] = categorias.get(cat, 0) + 1
-                return [{"categoria": k, "count": v} for k, v in categorias.items()]
+                return [{"categoria": k, "count": v} for k, v in estatisticas["por_categoria"].items()]
             
             elif query_type == "count_lessons_learned":
-                return sum(1 for msg in mensagens if msg.get("lesson_learned") == "sim")
+                return estatisticas["lessons_learned"]
             
             return None
         except:
             return None
     
-    def ask_question(self, question, projeto_id=None):
-        schema = self.extract_db_schema()
-        samples = self.extract_data_samples(projeto_id)
-        
-        # Consultas básicas
-        question_lower = question.lower()
-        
-        if "quantas mensagens" in question_lower:
-            count = self.execute_query("count_total", projeto_id)
-            if count is not None:
-                return f"Existem {count} mensagens{' neste projeto' if projeto_id else ' no total'}."
-        
-        if "categorias" in question_lower and "quantas" in question_lower:
-            categorias = self.execute_query("count_by_category", projeto_id)
-            if categorias:
-                resposta = "Distribuição por categorias:\n"
-                for item in categorias:
-                    resposta += f"- {item['categoria']}: {item['count']} mensagens\n"
-                return resposta
+    def _describe_filters(self, query):
+        """Trecho da resposta que descreve projeto, categoria e período consultados"""
+        def data(valor):
+            return datetime.strptime(valor[:10], "%Y-%m-%d").strftime("%d/%m/%Y")
         
-        if "lessons learned" in question_lower or "lições aprendidas" in question_lower:
-            count = self.execute_query("count_lessons_learned", projeto_id)
-            if count is not None:
-                return f"Existem {count} Lessons Learned{' neste projeto' if projeto_id else ' no total'}."
+        description = f" no projeto {self._project_label(query['projeto_id'])}" if query["projeto_id"] else ""
+        if query["categoria"]:
+            description += f" na categoria {query['categoria']}"
+        if query["inicio"] and query["fim"]:
+            if query["inicio"][:10] == query["fim"][:10]:
+                description += f" em {data(query['inicio'])}"
+            else:
+                description += f" entre {data(query['inicio'])} e {data(query['fim'])}"
+        elif query["inicio"]:
+            description += f" desde {data(query['inicio'])}"
+        elif query["fim"]:
+            description += f" até {data(query['fim'])}"
+        return description
+    
+    def _project_label(self, projeto_id):
+        projeto = next((p for p in PROJETOS if p['id'] == projeto_id), None)
+        return projeto['display'] if projeto else str(projeto_id)
+    
+    def _group_label(self, group_by, group):
+        if group_by == "projeto":
+            return self._project_label(group)
+        if group_by == "mes" and group != "sem data":
+            return f"{group[5:7]}/{group[:4]}"
+        return group or "N/A"
+    
+    def _answer_directly(self, question, projeto_id=None):
+        """Responde sem o DeepSeek as perguntas de contagem e listagem; None para as demais"""
+        try:
+            estatisticas = armazenamento.estatisticas(projeto_id)
+            query = interpretar_pergunta(question, estatisticas["por_categoria"].keys(), [p['id'] for p in PROJETOS])
+            if query is None:
+                return None
+            query["projeto_id"] = query["projeto_id"] or projeto_id
+            filtros = {k: query[k] for k in ("projeto_id", "categoria", "inicio", "fim", "apenas_lessons")}
+            description = self._describe_filters(query)
+            itens = "Lessons Learned" if query["apenas_lessons"] else "mensagens"
+            
+            if query["tipo"] == "listagem":
+                mensagens = mensagens_recentes(limite=query["limite"], **filtros)
+                if not mensagens:
+                    return f"Nenhuma mensagem encontrada{description}."
+                resposta = f"{'Lessons Learned' if query['apenas_lessons'] else 'Mensagens'} mais recentes{description}:\n"
+                for msg in mensagens:
+                    resposta += f"- {msg.get('timestamp', 'N/A')} | {self._project_label(msg.get('projeto'))} | {msg.get('categoria', 'N/A')}: {msg.get('mensagem_original', '')}\n"
+                return resposta
+            
+            resultado = consulta_agregada(agrupar_por=query["agrupar_por"], limite=query["limite"],
+                                          crescente=query["crescente"], **filtros)
+            if query["agrupar_por"] is None:
+                escopo = description or (" neste projeto" if projeto_id else " no total")
+                return f"Existem {resultado} {itens}{escopo}."
+            
+            if not resultado:
+                return f"Nenhuma mensagem encontrada{description}."
+            nomes = {"projeto": "projeto", "categoria": "categorias", "mes": "mês"}
+            if query["limite"]:
+                ordem = "menos" if query["crescente"] else "mais"
+                plural = {"projeto": "Projetos", "categoria": "Categorias", "mes": "Meses"}[query["agrupar_por"]]
+                resposta = f"{plural} com {ordem} {itens}{description}:\n"
+                for posicao, (grupo, quantidade) in enumerate(resultado, 1):
+                    resposta += f"{posicao}. {self._group_label(query['agrupar_por'], grupo)}: {quantidade} {itens}\n"
+            else:
+                resposta = f"Distribuição por {nomes[query['agrupar_por']]}{description}:\n"
+                for grupo, quantidade in resultado:
+                    resposta += f"- {self._group_label(query['agrupar_por'], grupo)}: {quantidade} {itens}\n"
+            return resposta
+        except Exception as e:
+            print(f"⚠️ Consulta local falhou, usando o DeepSeek: {e}")
+            return None
+    
+    def _question_payload(self, question, projeto_id=None):
+        schema = self.extract_db_schema()
+        samples = self.extract_data_samples(projeto_id, question)
         
         # Consulta à API DeepSeek para perguntas complexas
         prompt = f"""
@@ -476,22 +4590,150 @@ class DBAnalyzer:
             "temperature": 0.1,
             "max_tokens": 1000
         }
-        
+        return payload
+    
+    def _degraded_answer(self, question, projeto_id=None):
+        """Resposta imediata quando o DeepSeek está indisponível: as mensagens mais relevantes"""
+        answer = ("⚠️ O assistente de análise está temporariamente indisponível. "
+                  "Perguntas de contagem continuam sendo respondidas; para as demais, "
+                  "estas são as mensagens mais relevantes:\n")
         try:
-            response = requests.post(self.api_url, headers=self.headers, json=payload, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-            return result['choices'][0]['message']['content']
+            for msg in self.select_samples(question, projeto_id)[:5]:
+                answer += f"- {msg.get('timestamp', 'N/A')} | {msg.get('categoria', 'N/A')}: {msg.get('mensagem_original', '')}\n"
         except Exception as e:
-            return f"Desculpe, não consegui processar sua pergunta no momento. Erro: {str(e)}"
+            print(f"Erro ao selecionar mensagens para a resposta degradada: {e}")
+        return answer
+    
+    def _cache_key(self, question, projeto_id=None):
+        """Chave da resposta no cache; None (sem cache) se a versão dos dados for desconhecida"""
+        if self.cache is None:
+            return None
+        # A versão é lida antes da resposta: dados que mudarem durante a
+        # consulta deixam a resposta guardada numa versão já superada
+        version = armazenamento.versao(projeto_id)
+        if version is None:
+            return None
+        return (normalizar_texto(question).rstrip("?!. "), projeto_id or None, str(version))
+    
+    def _flight_key(self, question, projeto_id, key):
+        """Chave da execução única: a do cache ou, sem ela, a pergunta normalizada"""
+        return ("consulta",) + (key or (normalizar_texto(question).rstrip("?!. "), projeto_id or None))
+    
+    def _compute_answer(self, question, projeto_id=None):
+        """Retorna [resposta, pode_ir_para_o_cache]"""
+        answer = self._answer_directly(question, projeto_id)
+        if answer is None:
+            payload = self._question_payload(question, projeto_id)
+            try:
+                answer = self.cliente.conversar(payload, "consulta")['message']['content']
+            except DeepSeekIndisponivel:
+                return [self._degraded_answer(question, projeto_id), False]
+            except Exception as e:
+                return [f"Desculpe, não consegui processar sua pergunta no momento. Erro: {str(e)}", False]
+        return [answer, True]
+    
+    def ask_question(self, question, projeto_id=None):
+        key = self._cache_key(question, projeto_id)
+        if key is not None:
+            cached = self.cache.obter(key)
+            if cached is not None:
+                return cached
+        
+        if self.single_flight is not None:
+            # Perguntas idênticas simultâneas: uma só consulta ao DeepSeek
+            try:
+                answer, cacheable = self.single_flight.executar(
+                    self._flight_key(question, projeto_id, key),
+                    lambda: self._compute_answer(question, projeto_id))
+            except Exception:
+                # A execução compartilhada foi interrompida: responde por conta própria
+                answer, cacheable = self._compute_answer(question, projeto_id)
+        else:
+            answer, cacheable = self._compute_answer(question, projeto_id)
+        
+        if key is not None and cacheable:
+            self.cache.guardar(key, answer)
+        return answer
+    
+    def ask_question_stream(self, question, projeto_id=None):
+        """Como ask_question, mas gera a resposta em trechos, à medida que o DeepSeek a produz"""
+        key = self._cache_key(question, projeto_id)
+        if key is not None:
+            cached = self.cache.obter(key)
+            if cached is not None:
+                yield cached
+                return
+        
+        answer = self._answer_directly(question, projeto_id)
+        if answer is not None:
+            if key is not None:
+                self.cache.guardar(key, answer)
+            yield answer
+            return
+        
+        if self.cliente.disjuntor.aberto():
+            yield self._degraded_answer(question, projeto_id)
+            return
+        
+        flight = None
+        if self.single_flight is not None:
+            flight, leader = self.single_flight.iniciar(self._flight_key(question, projeto_id, key))
+            if not leader:
+                # A mesma pergunta já está sendo respondida: a resposta chega inteira
+                try:
+                    answer, cacheable = self.single_flight.aguardar(flight)
+                except Exception:
+                    answer, cacheable = self._compute_answer(question, projeto_id)
+                if key is not None and cacheable:
+                    self.cache.guardar(key, answer)
+                yield answer
+                return
+        
+        answer, cacheable = None, False
+        try:
+            payload = self._question_payload(question, projeto_id)
+            chunks = []
+            try:
+                for chunk in self.cliente.conversar_stream(payload, "consulta"):
+                    chunks.append(chunk)
+                    yield chunk
+                answer, cacheable = "".join(chunks), True
+            except DeepSeekIndisponivel:
+                answer = self._degraded_answer(question, projeto_id)
+                yield answer
+                return
+            except Exception as e:
+                if chunks:
+                    raise
+                answer = f"Desculpe, não consegui processar sua pergunta no momento. Erro: {str(e)}"
+                yield answer
+                return
+        finally:
+            if flight is not None:
+                if answer is None:
+                    # Resposta interrompida: quem esperava recebe o erro
+                    self.single_flight.concluir(flight, erro=RuntimeError("consulta interrompida"))
+                else:
+                    self.single_flight.concluir(flight, resultado=[answer, cacheable])
+        
+        # Só respostas completas vão para o cache
+        if key is not None:
+            self.cache.guardar(key, answer)
 
 # Inicialização
 print("🔄 Inicializando aplicação...")
 PROJETOS = carregar_projetos_csv()
-db_analyzer = DBAnalyzer(DEEPSEEK_API_KEY)
+db_analyzer = DBAnalyzer(deepseek, CacheRespostas(CONSULTA_CACHE_TTL_SEGUNDOS, CONSULTA_CACHE_MAX_ENTRADAS),
+                         execucao_unica)
+
+# Inicializar o armazenamento (cria o banco no Dropbox se não existir)
+armazenamento = criar_armazenamento()
+armazenamento.inicializar()
 
-# Inicializar banco no Dropbox se não existir
-carregar_banco_dropbox()
+# Pool que extrai o contexto das mensagens fora da requisição. Sem o modo
+# assíncrono, recebe só as mensagens gravadas com o DeepSeek indisponível.
+enriquecimento = FilaEnriquecimento(armazenamento, ENRIQUECIMENTO_WORKERS, ENRIQUECIMENTO_MAX_TENTATIVAS)
+enriquecimento.iniciar()
 
 print("✅ Aplicação inicializada")
 # HTML para a página principal com seleção de projeto no menu
@@ -1091,44 +5333,21 @@ HTML_BASE = '''
             const projetoId = tipo === 'projeto' && projetoSelecionado ? projetoSelecionado.id : null;
             const statusDiv = document.getElementById('backup-status');
             
+            // O CSV é gerado em streaming e baixado direto pelo navegador
+            const params = new URLSearchParams();
+            if (projetoId) params.set('projeto_id', projetoId);
+            const link = document.createElement('a');
+            link.href = `/api/exportar_csv?${params.toString()}`;
+            link.download = '';
+            document.body.appendChild(link);
+            link.click();
+            link.remove();
+            
             if (statusDiv) {
-                statusDiv.className = 'export-status';
-                statusDiv.textContent = '⏳ Gerando arquivo...';
+                statusDiv.className = 'export-status export-success';
+                statusDiv.textContent = '✅ Download iniciado';
                 statusDiv.classList.remove('hidden');
             }
-            
-            fetch('/api/exportar_csv', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json'
-                },
-                body: JSON.stringify({ projeto_id: projetoId })
-            })
-            .then(response => response.json())
-            .then(data => {
-                if (data.success) {
-                    if (statusDiv) {
-                        statusDiv.className = 'export-status export-success';
-                        statusDiv.textContent = '✅ ' + data.message;
-                    }
-                    
-                    // Download automático do arquivo
-                    window.open(`/api/download_csv/${data.arquivo}`, '_blank');
-                    
-                } else {
-                    if (statusDiv) {
-                        statusDiv.className = 'export-status export-error';
-                        statusDiv.textContent = '❌ ' + data.message;
-                    }
-                }
-            })
-            .catch(error => {
-                console.error('Erro na exportação:', error);
-                if (statusDiv) {
-                    statusDiv.className = 'export-status export-error';
-                    statusDiv.textContent = '❌ Erro na exportação';
-                }
-            });
         }
         
         // ===== FUNÇÕES PARA ENTRADA DE INFORMAÇÃO =====
@@ -1210,9 +5429,21 @@ HTML_BASE = '''
                 }
                 
                 if (warningDiv) {
+                    const similares = data.similares || [];
                     if (data.is_duplicata) {
                         warningDiv.style.display = 'block';
                         warningDiv.innerHTML = '⚠️ <strong>Atenção:</strong> Esta informação parece já ter sido registrada anteriormente.';
+                    } else if (similares.length) {
+                        // Quase duplicatas: apenas aviso, o registro continua liberado
+                        warningDiv.style.display = 'block';
+                        warningDiv.innerHTML = '⚠️ <strong>Atenção:</strong> Existem informações parecidas já registradas:';
+                        const lista = document.createElement('ul');
+                        similares.forEach(similar => {
+                            const item = document.createElement('li');
+                            item.textContent = `${Math.round(similar.similaridade * 100)}% — ${similar.mensagem_original} (${similar.categoria})`;
+                            lista.appendChild(item);
+                        });
+                        warningDiv.appendChild(lista);
                     } else {
                         warningDiv.style.display = 'none';
                     }
@@ -1380,12 +5611,19 @@ HTML_BASE = '''
                 }
                 
                 if (data.success) {
+                    const analise = data.status_enriquecimento === 'pendente'
+                        ? "O contexto será analisado automaticamente em instantes."
+                        : "O contexto foi analisado automaticamente.";
                     const successMsg = entradaState.isLessonLearned 
-                        ? "✅ Lesson Learned registrada com sucesso! O contexto foi analisado automaticamente." 
-                        : "✅ Informação registrada com sucesso! O contexto foi analisado automaticamente.";
+                        ? `✅ Lesson Learned registrada com sucesso! ${analise}` 
+                        : `✅ Informação registrada com sucesso! ${analise}`;
                     
                     addMessage(successMsg, "bot");
                     
+                    if (data.status_enriquecimento === 'pendente') {
+                        acompanharEnriquecimento(projetoSelecionado.id, data.mensagem_hash);
+                    }
+                    
                     // Resetar o formulário
                     setTimeout(() => {
                         resetFormEntrada();
@@ -1493,7 +5731,28 @@ HTML_BASE = '''
             chatMessages.appendChild(messageDiv);
             chatMessages.scrollTop = chatMessages.scrollHeight;
         }
-        
+
+        // Consulta a extração de contexto feita em segundo plano até ela terminar
+        function acompanharEnriquecimento(projetoId, mensagemHash, tentativas = 0) {
+            if (tentativas >= 30) return;
+
+            const params = new URLSearchParams({projeto_id: projetoId, mensagem_hash: mensagemHash});
+            fetch(`/api/status_enriquecimento?${params}`)
+            .then(response => response.json())
+            .then(data => {
+                if (data.success && data.status === 'concluido') {
+                    addMessage(`🧠 Contexto: ${data.contexto} — Mudança chave: ${data.mudanca_chave}`, "bot");
+                } else if (data.success && data.status === 'falhou') {
+                    addMessage("⚠️ Não foi possível analisar o contexto; a informação foi registrada com os dados padrão.", "bot");
+                } else {
+                    setTimeout(() => acompanharEnriquecimento(projetoId, mensagemHash, tentativas + 1), 2000);
+                }
+            })
+            .catch(() => {
+                setTimeout(() => acompanharEnriquecimento(projetoId, mensagemHash, tentativas + 1), 2000);
+            });
+        }
+
         function formatDateTime(dateTimeStr) {
             const date = new Date(dateTimeStr);
             return date.toLocaleString('pt-BR');
@@ -1546,13 +5805,88 @@ HTML_BASE = '''
             // Enviar projeto_id se estiver selecionado
             const projetoId = projetoSelecionado ? projetoSelecionado.id : null;
 
-            // Envia a pergunta para o servidor
+            // Navegadores sem leitura de respostas em stream usam a rota completa
+            if (!window.ReadableStream || !window.TextDecoder) {
+                askQuestionCompleta(question, projetoId, loadingId);
+                return;
+            }
+
+            // Envia a pergunta para o servidor e mostra a resposta à medida que chega
+            fetch('/api/consultar_dados_stream', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json'
+                },
+                body: JSON.stringify({
+                    question: question,
+                    projeto_id: projetoId
+                })
+            })
+            .then(response => {
+                if (!response.ok || !response.body) {
+                    throw new Error('HTTP ' + response.status);
+                }
+
+                const leitor = response.body.getReader();
+                const decodificador = new TextDecoder();
+                let buffer = '';
+                let respostaDiv = null;
+
+                function processarEvento(bloco) {
+                    let evento = 'message';
+                    let dados = '';
+                    bloco.split('\\n').forEach(linha => {
+                        if (linha.startsWith('event:')) evento = linha.slice(6).trim();
+                        else if (linha.startsWith('data:')) dados += linha.slice(5).trim();
+                    });
+                    if (!dados) return;
+
+                    const conteudo = JSON.parse(dados);
+                    if (evento === 'erro') {
+                        removeLoadingMessage(loadingId);
+                        addMessageConsulta('❌ Erro: ' + conteudo.message, 'bot');
+                    } else if (evento === 'message' && conteudo.delta) {
+                        if (!respostaDiv) {
+                            // Primeiro trecho: substitui a mensagem de carregamento
+                            removeLoadingMessage(loadingId);
+                            respostaDiv = addMessageConsulta('', 'bot');
+                        }
+                        respostaDiv.textContent += conteudo.delta;
+                        const chatMessages = document.getElementById('chat-messages');
+                        if (chatMessages) chatMessages.scrollTop = chatMessages.scrollHeight;
+                    }
+                }
+
+                function ler() {
+                    return leitor.read().then(({ done, value }) => {
+                        if (done) {
+                            removeLoadingMessage(loadingId);
+                            return;
+                        }
+                        buffer += decodificador.decode(value, { stream: true });
+                        // Eventos SSE são separados por uma linha em branco
+                        const blocos = buffer.split('\\n\\n');
+                        buffer = blocos.pop();
+                        blocos.forEach(processarEvento);
+                        return ler();
+                    });
+                }
+
+                return ler();
+            })
+            .catch(error => {
+                removeLoadingMessage(loadingId);
+                addMessageConsulta('❌ Erro ao conectar com o servidor: ' + error, 'bot');
+            });
+        };
+
+        function askQuestionCompleta(question, projetoId, loadingId) {
             fetch('/api/consultar_dados', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json'
                 },
-                body: JSON.stringify({ 
+                body: JSON.stringify({
                     question: question,
                     projeto_id: projetoId
                 })
@@ -1572,7 +5906,7 @@ HTML_BASE = '''
                 removeLoadingMessage(loadingId);
                 addMessageConsulta('❌ Erro ao conectar com o servidor: ' + error, 'bot');
             });
-        };
+        }
 
         function addMessageConsulta(text, sender, isTemp = false) {
             const chatMessages = document.getElementById('chat-messages');
@@ -1592,7 +5926,7 @@ HTML_BASE = '''
             chatMessages.appendChild(messageDiv);
             chatMessages.scrollTop = chatMessages.scrollHeight;
             
-            return isTemp ? messageDiv.id : null;
+            return isTemp ? messageDiv.id : messageDiv;
         }
 
         function removeLoadingMessage(id) {
@@ -1756,13 +6090,14 @@ def api_verificar_duplicata():
         mensagem = data.get('mensagem')
         
         if not all([projeto_id, categoria, mensagem]):
-            return jsonify({'success': False, 'is_duplicata': False})
+            return jsonify({'success': False, 'is_duplicata': False, 'similares': []})
         
         is_duplicata = verificar_duplicata(projeto_id, categoria, mensagem)
-        return jsonify({'success': True, 'is_duplicata': is_duplicata})
+        similares = buscar_similares(projeto_id, mensagem)
+        return jsonify({'success': True, 'is_duplicata': is_duplicata, 'similares': similares})
         
     except Exception as e:
-        return jsonify({'success': False, 'is_duplicata': False})
+        return jsonify({'success': False, 'is_duplicata': False, 'similares': []})
 
 @app.route('/api/registrar_mensagem', methods=['POST'])
 def registrar_mensagem():
@@ -1777,12 +6112,44 @@ def registrar_mensagem():
         if not all([projeto_id, categoria, data_info, mensagem, lesson_learned]):
             return jsonify({'success': False, 'message': 'Todos os campos são obrigatórios'})
         
-        success, message = salvar_mensagem(projeto_id, categoria, data_info, mensagem, lesson_learned)
-        return jsonify({'success': success, 'message': message})
+        success, message, status = salvar_mensagem(projeto_id, categoria, data_info, mensagem, lesson_learned)
+        return jsonify({
+            'success': success,
+            'message': message,
+            # Para acompanhar o enriquecimento em /api/status_enriquecimento
+            # (também sem o modo assíncrono, se o DeepSeek estava fora do ar)
+            'mensagem_hash': gerar_hash_mensagem(projeto_id, categoria, mensagem),
+            'status_enriquecimento': status
+        })
             
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'})
 
+@app.route('/api/status_enriquecimento')
+def api_status_enriquecimento():
+    """Situação da extração de contexto de uma mensagem (projeto_id e mensagem_hash na query string)"""
+    try:
+        projeto_id = request.args.get('projeto_id')
+        mensagem_hash = request.args.get('mensagem_hash')
+        
+        if not all([projeto_id, mensagem_hash]):
+            return jsonify({'success': False, 'message': 'projeto_id e mensagem_hash são obrigatórios'})
+        
+        mensagem = armazenamento.obter_mensagem(projeto_id, mensagem_hash)
+        if mensagem is None:
+            return jsonify({'success': False, 'message': 'Mensagem não encontrada'})
+        
+        return jsonify({
+            'success': True,
+            # Mensagens anteriores ao enriquecimento assíncrono não têm o campo
+            'status': mensagem.get('status_enriquecimento') or 'concluido',
+            'contexto': mensagem.get('contexto', ''),
+            'mudanca_chave': mensagem.get('mudanca_chave', '')
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro: {str(e)}'})
+
 @app.route('/api/consultar_dados', methods=['POST'])
 def consultar_dados():
     try:
@@ -1799,6 +6166,37 @@ def consultar_dados():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'})
 
+@app.route('/api/consultar_dados_stream', methods=['POST'])
+def consultar_dados_stream():
+    """
+    Versão de /api/consultar_dados que envia a resposta aos poucos, como
+    Server-Sent Events: eventos com {"delta": trecho}, terminados pelo evento
+    "fim" (ou "erro", com {"message"})
+    """
+    data = request.get_json() or {}
+    question = data.get('question')
+    projeto_id = data.get('projeto_id')
+    
+    def evento(dados, nome=None):
+        prefixo = f"event: {nome}\n" if nome else ""
+        return f"{prefixo}data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+    
+    def gerar():
+        if not question:
+            yield evento({'message': 'Pergunta não fornecida'}, 'erro')
+            return
+        try:
+            for trecho in db_analyzer.ask_question_stream(question, projeto_id):
+                yield evento({'delta': trecho})
+        except Exception as e:
+            yield evento({'message': f'Erro: {str(e)}'}, 'erro')
+            return
+        yield evento({}, 'fim')
+    
+    return Response(stream_with_context(gerar()), mimetype='text/event-stream',
+                    # Sem cache nem buffer em proxies, para os trechos chegarem na hora
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/exportar_csv', methods=['POST'])
 def api_exportar_csv():
     try:
@@ -1822,6 +6220,137 @@ def api_exportar_csv():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'})
 
+@app.route('/api/exportar_csv', methods=['GET'])
+def api_exportar_csv_stream():
+    """
+    Exportação em streaming: o arquivo é gerado direto na resposta
+    (transferência chunked), sem arquivo temporário e com memória constante.
+    Parâmetros (todos opcionais): formato (csv, ndjson, parquet ou arrow),
+    projeto_id, categoria, inicio e fim (datas ISO) e gzip=1 para compactar
+    CSV e NDJSON. Os filtros são aplicados pelo armazenamento.
+    """
+    formato = (request.args.get('formato') or 'csv').lower()
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({'success': False, 'message': f'Formato desconhecido: {formato}'}), 400
+    if formato in ('parquet', 'arrow') and pyarrow is None:
+        return jsonify({'success': False, 'message': f'Exportação em {formato} requer o pacote pyarrow'}), 400
+    gerar, mimetype, extensao, aceita_gzip = FORMATOS_EXPORTACAO[formato]
+    
+    projeto_id = request.args.get('projeto_id') or None
+    compactar = aceita_gzip and request.args.get('gzip', '').lower() in ('1', 'true', 'sim')
+    
+    blocos = gerar(linhas_exportacao(projeto_id, request.args.get('categoria') or None,
+                                     request.args.get('inicio') or None, request.args.get('fim') or None))
+    nome_arquivo = nome_exportacao(projeto_id, extensao)
+    if compactar:
+        blocos = comprimir_gzip(blocos)
+        nome_arquivo += '.gz'
+        mimetype = 'application/gzip'
+    
+    return Response(blocos, mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{nome_arquivo}"',
+                             'X-Accel-Buffering': 'no'})
+
+def codificar_cursor(mensagem):
+    """Cursor opaco da listagem paginada: (id, projeto) da última mensagem da página"""
+    dados = json.dumps([mensagem.get("id") or 0, mensagem.get("projeto") or ""])
+    return base64.urlsafe_b64encode(dados.encode()).decode().rstrip("=")
+
+def decodificar_cursor(cursor):
+    """(id, projeto) de um cursor gerado por codificar_cursor; ValueError se for inválido"""
+    try:
+        id_mensagem, projeto = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError("Cursor inválido")
+    if not isinstance(id_mensagem, int) or not isinstance(projeto, str):
+        raise ValueError("Cursor inválido")
+    return id_mensagem, projeto
+
+@app.route('/api/mensagens', methods=['GET'])
+def api_mensagens():
+    """
+    Listagem paginada das mensagens, das mais recentes para as mais antigas
+    (ordem=asc inverte). Filtros opcionais: projeto_id, categoria,
+    lesson_learned (sim ou não), inicio e fim (datas ou timestamps ISO).
+    `campos` escolhe os campos devolvidos (separados por vírgula) e `limite`
+    o tamanho da página. A próxima página é pedida repassando proximo_cursor
+    em `cursor`; na última página ele vem nulo.
+    """
+    args = request.args
+    try:
+        limite = int(args.get('limite') or MENSAGENS_PAGINA_PADRAO)
+    except ValueError:
+        limite = 0
+    if limite < 1:
+        return jsonify({'success': False, 'message': 'Limite inválido'}), 400
+    limite = min(limite, MENSAGENS_PAGINA_MAXIMA)
+    
+    campos = [campo.strip() for campo in (args.get('campos') or '').split(',') if campo.strip()]
+    desconhecidos = [campo for campo in campos if campo not in CAMPOS_MENSAGEM]
+    if desconhecidos:
+        return jsonify({'success': False, 'message': f'Campos desconhecidos: {", ".join(desconhecidos)}'}), 400
+    campos = campos or CAMPOS_MENSAGEM
+    
+    lesson_learned = (args.get('lesson_learned') or '').strip().lower()
+    if lesson_learned in ('sim', 'true', '1'):
+        lesson_learned = 'sim'
+    elif lesson_learned in ('não', 'nao', 'false', '0'):
+        lesson_learned = 'não'
+    elif lesson_learned:
+        return jsonify({'success': False, 'message': 'lesson_learned deve ser sim ou não'}), 400
+    
+    ordem = (args.get('ordem') or 'desc').lower()
+    if ordem not in ('asc', 'desc'):
+        return jsonify({'success': False, 'message': 'ordem deve ser asc ou desc'}), 400
+    
+    try:
+        cursor = decodificar_cursor(args['cursor']) if args.get('cursor') else None
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    try:
+        # Um item a mais indica se existe a página seguinte
+        pagina = armazenamento.paginar(args.get('projeto_id') or None, args.get('categoria') or None,
+                                       lesson_learned or None, args.get('inicio') or None,
+                                       fim_do_periodo(args.get('fim') or None), cursor=cursor,
+                                       limite=limite + 1, crescente=ordem == 'asc', campos=campos)
+    except Exception as e:
+        print(f"❌ Erro ao listar mensagens: {e}")
+        return jsonify({'success': False, 'message': 'Erro ao listar mensagens'}), 500
+    
+    proximo_cursor = codificar_cursor(pagina[limite - 1]) if len(pagina) > limite else None
+    return jsonify({
+        'success': True,
+        'mensagens': [{campo: mensagem.get(campo) for campo in campos} for mensagem in pagina[:limite]],
+        'proximo_cursor': proximo_cursor
+    })
+
+@app.route('/api/buscar', methods=['GET'])
+def api_buscar():
+    """
+    Busca textual nas mensagens (mensagem original, contexto e mudança-chave),
+    sem diferenciar acentos nem flexões. Termos entre aspas são buscados como
+    frase. Parâmetros: q (obrigatório), projeto_id, categoria e limite.
+    """
+    consulta = (request.args.get('q') or '').strip()
+    if not consulta:
+        return jsonify({'success': False, 'message': 'Informe o texto a buscar'}), 400
+    try:
+        limite = int(request.args.get('limite') or 20)
+    except ValueError:
+        limite = 0
+    if limite < 1:
+        return jsonify({'success': False, 'message': 'Limite inválido'}), 400
+    
+    try:
+        total, resultados = buscar_mensagens(consulta, request.args.get('projeto_id') or None,
+                                             request.args.get('categoria') or None,
+                                             min(limite, BUSCA_MAX_RESULTADOS))
+    except Exception as e:
+        print(f"❌ Erro na busca: {e}")
+        return jsonify({'success': False, 'message': 'Erro ao buscar mensagens'}), 500
+    return jsonify({'success': True, 'total': total, 'resultados': resultados})
+
 @app.route('/api/download_csv/<filename>')
 def api_download_csv(filename):
     try:
@@ -1835,7 +6364,9 @@ def api_estatisticas():
         data = request.get_json()
         projeto_id = data.get('projeto_id')
         
-        estatisticas = obter_estatisticas_banco(projeto_id)
+        # Pedidos simultâneos do mesmo projeto: uma só leitura do banco
+        estatisticas = execucao_unica.executar(("estatisticas", projeto_id or None),
+                                               lambda: obter_estatisticas_banco(projeto_id))
         
         if 'erro' in estatisticas:
             return jsonify({'success': False, 'message': estatisticas['erro']})
@@ -1848,6 +6379,44 @@ def api_estatisticas():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'})
 
+@app.cli.command("reconstruir-estatisticas")
+def comando_reconstruir_estatisticas():
+    """Recalcula os contadores de estatísticas (flask --app app reconstruir-estatisticas)"""
+    sucesso, mensagem = armazenamento.reconstruir_estatisticas()
+    print(("✅ " if sucesso else "❌ ") + mensagem)
+
+@app.cli.command("reenriquecer")
+@click.option("--projeto", "projeto_id", default=None, help="Só as mensagens deste projeto")
+@click.option("--todas", is_flag=True, help="Inclui as mensagens já enriquecidas")
+def comando_reenriquecer(projeto_id, todas):
+    """Extrai de novo, em lote, o contexto das mensagens pendentes ou que falharam"""
+    mensagens = [m for m in armazenamento.consultar(projeto_id)
+                 if todas or m.get("status_enriquecimento") in ("pendente", "falhou")]
+    # Cada grupo é gravado de uma vez, depois de passar por algumas chamadas em lote
+    tamanho_grupo = LLM_LOTE_MAX_MENSAGENS * 5
+    for inicio in range(0, len(mensagens), tamanho_grupo):
+        grupo = mensagens[inicio:inicio + tamanho_grupo]
+        enriquecimento.enriquecer([(m["projeto"], m["mensagem_hash"], m["mensagem_original"]) for m in grupo])
+        print(f"🔄 {inicio + len(grupo)}/{len(mensagens)} mensagens processadas")
+    print(f"✅ Reenriquecimento concluído ({len(mensagens)} mensagens)")
+
+@app.route('/api/metricas')
+def api_metricas():
+    """Métricas de transferência com o Dropbox, das chamadas ao DeepSeek (e do seu disjuntor) e da fila de enriquecimento"""
+    with _metricas_lock:
+        dropbox_metricas = dict(METRICAS_DROPBOX)
+    return jsonify({
+        'success': True,
+        'codec': DB_CODEC,
+        'dropbox': dropbox_metricas,
+        'deepseek': deepseek.metricas(),
+        'deepseek_disjuntor': deepseek.disjuntor.situacao(),
+        'enriquecimento': {'pendentes': enriquecimento.pendentes()},
+        'cache_llm': cache_llm.metricas() if cache_llm is not None else None,
+        'cache_consultas': db_analyzer.cache.metricas(),
+        'execucao_unica': execucao_unica.metricas()
+    })
+
 @app.route('/api/fazer_backup', methods=['POST'])
 def api_fazer_backup():
     """API para fazer backup na nuvem"""
@@ -0,0 +1,164 @@
+"""
+Dropbox falso em memória e carregamento de vários "workers" do app.py no
+mesmo processo: cada worker é uma instância independente do módulo, com
+seu próprio cache, como os processos do gunicorn, e todos compartilham o
+mesmo Dropbox falso.
+"""
+import contextlib
+import hashlib
+import importlib.util
+import io
+import itertools
+import os
+import threading
+from datetime import datetime
+
+import dropbox
+import pytest
+from dropbox import files
+from dropbox.exceptions import ApiError
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+class _Resposta:
+    def __init__(self, conteudo):
+        self.content = conteudo
+
+
+def _erro_nao_encontrado(erro):
+    return ApiError("requisicao", erro, None, None)
+
+
+def _erro_conflito():
+    falha = files.UploadWriteFailed(
+        reason=files.WriteError.conflict(files.WriteConflictError.file),
+        upload_session_id="falso"
+    )
+    return ApiError("requisicao", files.UploadError.path(falha), None, None)
+
+
+class DropboxFalso:
+    """
+    Subconjunto da API do Dropbox usado pelo app, com as mesmas regras de
+    WriteMode: update(rev) falha se o arquivo mudou e add falha se o arquivo
+    existe. Os arquivos ficam em `self.arquivos` ({caminho: (bytes, rev)}).
+    """
+
+    def __init__(self):
+        self.arquivos = {}
+        self.gravados_em = {}
+        self.modos = []
+        self._lock = threading.Lock()
+        self._revisoes = itertools.count(1)
+
+    def _metadata(self, caminho):
+        conteudo, rev = self.arquivos[caminho]
+        return files.FileMetadata(
+            name=caminho.rsplit("/", 1)[-1], id="id:" + caminho, path_display=caminho,
+            path_lower=caminho.lower(), rev=f"{rev:09x}", size=len(conteudo),
+            client_modified=self.gravados_em[caminho], server_modified=self.gravados_em[caminho],
+            content_hash=hashlib.sha256(conteudo).hexdigest()
+        )
+
+    # Cliente: dropbox.Dropbox(...) devolve esta mesma instância
+    def __call__(self, *args, **kwargs):
+        return self
+
+    def files_download(self, caminho):
+        with self._lock:
+            if caminho not in self.arquivos:
+                raise _erro_nao_encontrado(files.DownloadError.path(files.LookupError.not_found))
+            return self._metadata(caminho), _Resposta(self.arquivos[caminho][0])
+
+    def files_get_metadata(self, caminho):
+        with self._lock:
+            if caminho not in self.arquivos:
+                raise _erro_nao_encontrado(files.GetMetadataError.path(files.LookupError.not_found))
+            return self._metadata(caminho)
+
+    def files_upload(self, conteudo, caminho, mode=files.WriteMode.add, **kwargs):
+        with self._lock:
+            atual = self.arquivos.get(caminho)
+            self.modos.append((caminho, mode._tag))
+            if mode.is_update() and (atual is None or f"{atual[1]:09x}" != mode.get_update()):
+                raise _erro_conflito()
+            if mode.is_add() and atual is not None:
+                raise _erro_conflito()
+            self.arquivos[caminho] = (bytes(conteudo), next(self._revisoes))
+            self.gravados_em[caminho] = datetime.utcnow()
+            return self._metadata(caminho)
+
+    def files_list_folder(self, pasta, **kwargs):
+        with self._lock:
+            prefixo = pasta.rstrip("/") + "/"
+            entradas = [self._metadata(caminho) for caminho in sorted(self.arquivos)
+                        if caminho.startswith(prefixo) and "/" not in caminho[len(prefixo):]]
+        if not entradas:
+            raise _erro_nao_encontrado(files.ListFolderError.path(files.LookupError.not_found))
+        return files.ListFolderResult(entries=entradas, cursor="fim", has_more=False)
+
+    def files_list_folder_continue(self, cursor):
+        return files.ListFolderResult(entries=[], cursor="fim", has_more=False)
+
+    def files_delete_v2(self, caminho):
+        with self._lock:
+            if caminho not in self.arquivos:
+                raise _erro_nao_encontrado(files.DeleteError.path_lookup(files.LookupError.not_found))
+            metadata = self._metadata(caminho)
+            del self.arquivos[caminho]
+            return files.DeleteResult(metadata=metadata)
+
+    def files_delete_batch(self, entradas):
+        for entrada in entradas:
+            with contextlib.suppress(ApiError):
+                self.files_delete_v2(entrada.path)
+
+
+@pytest.fixture
+def dropbox_falso(monkeypatch):
+    falso = DropboxFalso()
+    monkeypatch.setattr(dropbox, "Dropbox", falso)
+    monkeypatch.setattr(dropbox, "create_session", lambda **kwargs: None)
+    return falso
+
+
+@pytest.fixture
+def carregar_workers(dropbox_falso, monkeypatch, tmp_path):
+    """
+    Fábrica de workers: carregar_workers(n, **variaveis) carrega n instâncias
+    do app.py com as variáveis de ambiente dadas (além das de teste abaixo).
+    """
+    contador = itertools.count()
+
+    def carregar(quantidade, **variaveis):
+        ambiente = {
+            "DB_BACKEND": "dropbox",
+            "DB_CACHE_STALENESS_SECONDS": "0.05",
+            "DB_WRITE_BACKOFF_SECONDS": "0.005",
+            "DB_WRITE_MAX_TENTATIVAS": "30",
+            "ENRIQUECIMENTO_ASYNC_ENABLED": "false",
+            "ENRIQUECIMENTO_TRAVA": str(tmp_path / "enriquecimento.lock"),
+            "EXECUCAO_UNICA_DIR": str(tmp_path / "execucao_unica"),
+            "DB_WRITE_BEHIND_DIR": str(tmp_path / "fila_gravacao"),
+            "DB_SQLITE_PATH": str(tmp_path / "mensagens_projetos.db"),
+            "LLM_CACHE_PATH": str(tmp_path / "cache_llm.db"),
+            "BUSCA_INDICE_PATH": str(tmp_path / "busca.db"),
+        }
+        ambiente.update(variaveis)
+        for nome, valor in ambiente.items():
+            monkeypatch.setenv(nome, valor)
+        # projetos.csv é lido do diretório atual
+        monkeypatch.chdir(os.path.dirname(APP_PATH))
+
+        workers = []
+        for _ in range(quantidade):
+            spec = importlib.util.spec_from_file_location(f"app_worker_{next(contador)}", APP_PATH)
+            modulo = importlib.util.module_from_spec(spec)
+            with contextlib.redirect_stdout(io.StringIO()):
+                spec.loader.exec_module(modulo)
+            modulo.print = lambda *args, **kwargs: None
+            workers.append(modulo)
+        return workers
+
+    return carregar
@@ -0,0 +1,24 @@
+"""Formatos dos arquivos gravados no Dropbox (DB_CODEC)"""
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+CABECALHOS = {"json": b"{", "json-compacto": b"{", "gzip": b"\x1f\x8b", "zstd": b"\x28\xb5\x2f\xfd"}
+
+
+@pytest.mark.parametrize("codec", sorted(CABECALHOS))
+def test_banco_gravado_em_cada_codec_e_lido_por_qualquer_worker(carregar_workers, dropbox_falso, codec):
+    if codec == "zstd":
+        pytest.importorskip("zstandard")
+    gravador, = carregar_workers(1, DB_CODEC=codec)
+    assert gravador.armazenamento.anexar(_nova_mensagem(gravador, "mensagem comprimida"))[0]
+
+    assert dropbox_falso.arquivos["/mensagens_projetos.json"][0].startswith(CABECALHOS[codec])
+    # A leitura detecta o formato, qualquer que seja o codec do leitor
+    leitor, = carregar_workers(1, DB_CODEC="json")
+    assert [m["mensagem_original"] for m in leitor.carregar_banco_dropbox()["mensagens"]] == ["mensagem comprimida"]
+
+
+def test_codec_desconhecido_impede_a_inicializacao(carregar_workers):
+    with pytest.raises(ValueError, match="DB_CODEC=brotli"):
+        carregar_workers(1, DB_CODEC="brotli")
@@ -0,0 +1,60 @@
+"""Interpretação das perguntas respondidas localmente, sem o DeepSeek"""
+from datetime import date
+
+import pytest
+
+HOJE = date(2024, 6, 15)
+
+
+@pytest.fixture
+def worker(carregar_workers):
+    worker, = carregar_workers(1)
+    return worker
+
+
+@pytest.mark.parametrize("pergunta, periodo", [
+    ("quantas mensagens em 2024?", ("2024-01-01", "2024-12-31T23:59:59")),
+    ("quantas mensagens em marco de 2024?", ("2024-03-01", "2024-03-31T23:59:59")),
+    ("quantas mensagens entre janeiro e marco?", ("2024-01-01", "2024-03-31T23:59:59")),
+    ("quantas mensagens desde marco?", ("2024-03-01", None)),
+    ("quantas mensagens a partir de 10/03/2024?", ("2024-03-10", None)),
+    ("quantas mensagens ate marco?", (None, "2024-03-31T23:59:59")),
+    # "antes de" e "depois de" não incluem o período citado
+    ("quantas mensagens antes de 2024?", (None, "2023-12-31T23:59:59")),
+    ("quantas mensagens antes de marco?", (None, "2024-02-29T23:59:59")),
+    ("quantas mensagens antes do dia 2024-03-10?", (None, "2024-03-09T23:59:59")),
+    ("quantas mensagens depois de marco?", ("2024-04-01", None)),
+    ("quantas mensagens apos 2023?", ("2024-01-01", None)),
+    ("quantas mensagens apos dezembro de 2023?", ("2024-01-01", None)),
+    ("quantas mensagens nos ultimos 7 dias?", ("2024-06-09", "2024-06-15T23:59:59")),
+    ("quantas mensagens no mes passado?", ("2024-05-01", "2024-05-31T23:59:59")),
+    ("quantas mensagens existem?", (None, None)),
+])
+def test_periodo(worker, pergunta, periodo):
+    assert worker.interpretar_periodo(worker.dobrar_acentos(pergunta), hoje=HOJE) == periodo
+
+
+def test_contagem_por_categoria_com_filtros(worker):
+    consulta = worker.interpretar_pergunta("Quantas lessons learned por categoria no projeto 12345 antes de 2024?",
+                                           ["Prazo", "Qualidade"], ["12345"])
+    assert consulta["tipo"] == "contagem"
+    assert consulta["agrupar_por"] == "categoria"
+    assert consulta["projeto_id"] == "12345"
+    assert consulta["apenas_lessons"]
+    assert (consulta["inicio"], consulta["fim"]) == (None, "2023-12-31T23:59:59")
+
+
+def test_ranking_e_listagem(worker):
+    ranking = worker.interpretar_pergunta("Qual a categoria com mais mensagens?", ["Prazo"], [])
+    assert (ranking["tipo"], ranking["agrupar_por"], ranking["limite"]) == ("contagem", "categoria", 1)
+    listagem = worker.interpretar_pergunta("Mostre as 3 mensagens mais recentes de Prazo", ["Prazo"], [])
+    assert (listagem["tipo"], listagem["limite"], listagem["categoria"]) == ("listagem", 3, "Prazo")
+
+
+@pytest.mark.parametrize("pergunta", [
+    "Quantas mensagens falam de concreto?",   # assunto: só o DeepSeek responde
+    "Quantas mensagens no projeto 99999?",    # projeto desconhecido
+    "O que aconteceu na obra?",               # nem contagem nem listagem
+])
+def test_perguntas_que_vao_ao_deepseek(worker, pergunta):
+    assert worker.interpretar_pergunta(pergunta, ["Prazo"], ["12345"]) is None
@@ -0,0 +1,64 @@
+"""Enriquecimento das mensagens com o contexto extraído pelo DeepSeek"""
+import time
+
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+
+@pytest.fixture
+def enfileiradas(monkeypatch):
+    """Troca a fila de enriquecimento dos workers por uma lista, sem chamar o DeepSeek"""
+    registro = []
+
+    def capturar(*workers):
+        for worker in workers:
+            monkeypatch.setattr(worker.enriquecimento, "enfileirar",
+                                lambda projeto_id, mensagem_hash, texto, w=worker: registro.append((w, mensagem_hash)))
+        return registro
+
+    return capturar
+
+
+def test_falha_do_deepseek_na_gravacao_sincrona_fica_pendente(carregar_workers, enfileiradas, monkeypatch):
+    worker, = carregar_workers(1)
+    registro = enfileiradas(worker)
+
+    def falha(mensagem):
+        raise TimeoutError("DeepSeek não respondeu")
+
+    monkeypatch.setattr(worker, "extrair_contexto_mensagem", falha)
+    sucesso, _, status = worker.salvar_mensagem("12345", "Prazo", "2024-01-15T10:00", "Concreto atrasou", "não")
+
+    assert sucesso and status == "pendente"
+    mensagem_hash = worker.gerar_hash_mensagem("12345", "Prazo", "Concreto atrasou")
+    gravada = worker.armazenamento.obter_mensagem("12345", mensagem_hash)
+    assert gravada["status_enriquecimento"] == "pendente"
+    assert gravada["contexto"] == "Informação registrada via formulário"
+    assert registro == [(worker, mensagem_hash)]
+
+
+def test_extracao_sincrona_bem_sucedida_fica_concluida(carregar_workers, enfileiradas, monkeypatch):
+    worker, = carregar_workers(1)
+    registro = enfileiradas(worker)
+    monkeypatch.setattr(worker, "extrair_contexto_mensagem",
+                        lambda mensagem: {"contexto": "Fundação", "mudanca_chave": "Atraso"})
+
+    _, _, status = worker.salvar_mensagem("12345", "Prazo", "2024-01-15T10:00", "Concreto atrasou", "não")
+
+    assert status == "concluido" and registro == []
+
+
+def test_qualquer_worker_varre_as_pendentes(carregar_workers, enfileiradas):
+    # O primeiro worker já varreu na inicialização; o substituto de um worker
+    # encerrado também precisa conseguir varrer
+    primeiro, substituto = carregar_workers(2)
+    registro = enfileiradas(primeiro, substituto)
+    mensagem = _nova_mensagem(primeiro, "ficou na fila de um worker encerrado")
+    mensagem["status_enriquecimento"] = "pendente"
+    assert primeiro.armazenamento.anexar(mensagem)[0]
+    time.sleep(0.1)
+
+    assert substituto.enriquecimento.varrer_pendentes() == 1
+    assert primeiro.enriquecimento.varrer_pendentes() == 1
+    assert [w for w, _ in registro] == [substituto, primeiro]
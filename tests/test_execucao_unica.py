@@ -0,0 +1,75 @@
+"""Coalescência de chamadas idênticas entre threads e workers (ExecucaoUnica)"""
+import hashlib
+import os
+import threading
+import time
+
+
+def _faixa_antiga(chave):
+    # Faixa que a chave ocupava quando as travas eram divididas em 256 arquivos
+    return int(hashlib.sha256(repr(chave).encode("utf-8")).hexdigest()[:8], 16) % 256
+
+
+def test_chaves_diferentes_nao_esperam_umas_pelas_outras(carregar_workers, tmp_path):
+    worker, = carregar_workers(1)
+    execucao_unica = worker.ExecucaoUnica(str(tmp_path / "unica"), espera_segundos=2)
+    primeira = ("pergunta", 0)
+    segunda = next(("pergunta", i) for i in range(1, 10000)
+                   if _faixa_antiga(("pergunta", i)) == _faixa_antiga(primeira))
+
+    lider, eh_lider = execucao_unica.iniciar(primeira)
+    assert eh_lider
+    resultado = {}
+    outra = threading.Thread(target=lambda: resultado.update(
+        inicio=time.monotonic(), par=execucao_unica.iniciar(segunda), fim=time.monotonic()))
+    outra.start()
+    outra.join(5)
+
+    assert resultado["par"][1] and resultado["fim"] - resultado["inicio"] < 1
+    execucao_unica.concluir(resultado["par"][0], resultado="b")
+    execucao_unica.concluir(lider, resultado="a")
+    assert not [n for n in os.listdir(tmp_path / "unica") if n.endswith(".lock")]
+
+
+def test_mesma_chave_em_dois_workers_executa_uma_vez(carregar_workers, tmp_path):
+    worker, = carregar_workers(1)
+    diretorio = str(tmp_path / "unica")
+    primeiro = worker.ExecucaoUnica(diretorio, espera_segundos=5)
+    segundo = worker.ExecucaoUnica(diretorio, espera_segundos=5)
+    chamadas = []
+    liberar = threading.Event()
+
+    def lenta():
+        chamadas.append("primeiro")
+        liberar.wait(5)
+        return {"resposta": 42}
+
+    resultados = {}
+    lider = threading.Thread(target=lambda: resultados.update(primeiro=primeiro.executar("chave", lenta)))
+    lider.start()
+    while not chamadas:
+        time.sleep(0.01)
+    seguidor = threading.Thread(target=lambda: resultados.update(
+        segundo=segundo.executar("chave", lambda: chamadas.append("segundo"))))
+    seguidor.start()
+    time.sleep(0.2)
+    liberar.set()
+    lider.join(5)
+    seguidor.join(5)
+
+    assert chamadas == ["primeiro"]
+    assert resultados == {"primeiro": {"resposta": 42}, "segundo": {"resposta": 42}}
+    assert segundo.metricas()["coalescidas_entre_workers"] == 1
+    assert not [n for n in os.listdir(diretorio) if n.endswith(".lock")]
+
+
+def test_trava_abandonada_e_removida(carregar_workers, tmp_path):
+    worker, = carregar_workers(1)
+    diretorio = tmp_path / "unica"
+    execucao_unica = worker.ExecucaoUnica(str(diretorio), espera_segundos=1)
+    abandonada = diretorio / ("0" * 64 + ".lock")
+    abandonada.write_text("")
+    os.utime(abandonada, (time.time() - 60, time.time() - 60))
+
+    assert execucao_unica.executar("chave", lambda: "ok") == "ok"
+    assert not abandonada.exists()
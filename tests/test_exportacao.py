@@ -0,0 +1,70 @@
+"""Exportação em streaming (GET /api/exportar_csv) em cada formato"""
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+TIMESTAMPS = {
+    "local": "2024-01-15T10:00:00.250000",
+    "com fuso": "2024-03-01T10:00:00-03:00",
+    "fora do padrao": "15/03/2024",
+}
+
+
+@pytest.fixture
+def cliente(carregar_workers):
+    worker, = carregar_workers(1)
+    for texto, timestamp in TIMESTAMPS.items():
+        mensagem = _nova_mensagem(worker, texto)
+        mensagem["timestamp"] = timestamp
+        assert worker.armazenamento.anexar(mensagem)[0]
+    return worker.app.test_client()
+
+
+def _exportar(cliente, formato, **parametros):
+    resposta = cliente.get("/api/exportar_csv", query_string={"formato": formato, **parametros})
+    assert resposta.status_code == 200
+    return resposta.data
+
+
+def test_csv(cliente):
+    linhas = list(csv.DictReader(io.StringIO(_exportar(cliente, "csv").decode("utf-8"))))
+    assert {linha["mensagem_original"]: linha["timestamp"] for linha in linhas} == TIMESTAMPS
+    assert gzip.decompress(_exportar(cliente, "csv", gzip="1")).decode("utf-8").startswith("id,timestamp,")
+
+
+def test_ndjson(cliente):
+    linhas = [json.loads(linha) for linha in _exportar(cliente, "ndjson").decode("utf-8").splitlines()]
+    assert {linha["mensagem_original"]: linha["timestamp"] for linha in linhas} == TIMESTAMPS
+
+
+@pytest.mark.parametrize("formato", ["parquet", "arrow"])
+def test_colunares_mantem_o_timestamp_gravado(cliente, formato):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    dados = _exportar(cliente, formato)
+    if formato == "parquet":
+        tabela = pyarrow.parquet.read_table(io.BytesIO(dados))
+    else:
+        tabela = pyarrow.ipc.open_stream(dados).read_all()
+    linhas = {linha["mensagem_original"]: linha for linha in tabela.to_pylist()}
+
+    assert {texto: linha["timestamp_original"] for texto, linha in linhas.items()} == TIMESTAMPS
+    assert linhas["fora do padrao"]["timestamp"] is None
+    assert linhas["com fuso"]["timestamp"] == datetime(2024, 3, 1, 13, tzinfo=timezone.utc)
+    # Sem fuso: horário local do servidor, convertido para UTC
+    esperado = datetime.fromisoformat(TIMESTAMPS["local"]).astimezone(timezone.utc)
+    assert linhas["local"]["timestamp"] == esperado
+    assert [linha["lesson_learned"] for linha in linhas.values()] == [False] * 3
+
+
+def test_formato_desconhecido(cliente):
+    assert cliente.get("/api/exportar_csv?formato=xlsx").status_code == 400
+
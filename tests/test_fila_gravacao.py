@@ -0,0 +1,126 @@
+"""Fila write-behind: log local durável e recuperação de mensagens confirmadas"""
+import atexit
+import json
+import os
+
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+
+class Envio:
+    """`enviar` da fila: guarda os lotes e só resolve as mensagens quando liberado"""
+
+    def __init__(self):
+        self.lotes = []
+        self.liberado = False
+
+    def __call__(self, lote):
+        self.lotes.append([m["mensagem_hash"] for m in lote])
+        return list(lote) if self.liberado else []
+
+
+@pytest.fixture
+def criar_fila(carregar_workers, monkeypatch, tmp_path):
+    worker, = carregar_workers(1)
+    # O encerramento do processo de teste não deve mexer nas pastas temporárias
+    monkeypatch.setattr(atexit, "register", lambda funcao: None)
+    pasta = tmp_path / "fila"
+    pasta.mkdir()
+
+    def criar(envio=None):
+        fila = worker.FilaGravacao(envio or Envio(), str(pasta), 0.01, 20)
+        fila.iniciar()
+        return fila
+
+    return pasta, criar
+
+
+def _mensagem(mensagem_hash):
+    return {"projeto": "12345", "mensagem_hash": mensagem_hash, "mensagem_original": mensagem_hash}
+
+
+def _gravar_log(caminho, *hashes, incompleta=None):
+    with open(caminho, "w", encoding="utf-8") as log:
+        for mensagem_hash in hashes:
+            log.write(json.dumps(_mensagem(mensagem_hash)) + "\n")
+        if incompleta:
+            log.write(incompleta)
+
+
+def _hashes_no_log(caminho):
+    with open(caminho, encoding="utf-8") as log:
+        return [json.loads(linha)["mensagem_hash"] for linha in log]
+
+
+def test_log_do_mesmo_pid_e_recuperado(criar_fila):
+    pasta, criar = criar_fila
+    # Worker anterior com o mesmo pid, encerrado com mensagens confirmadas
+    _gravar_log(pasta / f"fila_{os.getpid()}.jsonl", "a", "b", incompleta='{"projeto": "123')
+
+    envio = Envio()
+    fila = criar(envio)
+
+    assert fila.contem_hash("12345", "a") and fila.contem_hash("12345", "b")
+    envio.liberado = True
+    assert fila.descarregar()
+    assert ["a", "b"] in envio.lotes
+
+
+@pytest.mark.parametrize("com_trava", [True, False])
+def test_log_orfao_e_adotado(criar_fila, com_trava):
+    pasta, criar = criar_fila
+    _gravar_log(pasta / "fila_1.jsonl", "orfa")
+    if com_trava:
+        (pasta / "fila_1.jsonl.lock").touch()
+
+    fila = criar()
+
+    assert fila.contem_hash("12345", "orfa")
+    assert sorted(os.listdir(pasta)) == [f"fila_{os.getpid()}.jsonl", f"fila_{os.getpid()}.jsonl.lock"]
+    assert _hashes_no_log(pasta / f"fila_{os.getpid()}.jsonl") == ["orfa"]
+
+
+def test_log_orfao_adotado_por_outro_worker_no_meio(criar_fila, monkeypatch):
+    pasta, criar = criar_fila
+    listar = os.listdir
+    # O log aparece na listagem, mas outro worker o adota antes da trava
+    monkeypatch.setattr(os, "listdir", lambda caminho: listar(caminho) + ["fila_2.jsonl"])
+
+    criar()
+
+    assert not (pasta / "fila_2.jsonl.lock").exists()
+
+
+def test_queda_na_regravacao_nao_perde_mensagens(criar_fila, monkeypatch):
+    pasta, criar = criar_fila
+    fila = criar()
+    fila.enfileirar(_mensagem("a"))
+    fila.enfileirar(_mensagem("b"))
+    log = pasta / f"fila_{os.getpid()}.jsonl"
+
+    def queda(*args):
+        raise OSError("queda no meio da regravação")
+
+    monkeypatch.setattr(os, "replace", queda)
+    with fila._condicao:
+        fila._pendentes = fila._pendentes[1:]
+        with pytest.raises(OSError):
+            fila._regravar_log()
+
+    assert _hashes_no_log(log) == ["a", "b"]
+    monkeypatch.undo()
+    with fila._condicao:
+        fila._regravar_log()
+    assert _hashes_no_log(log) == ["b"]
+
+
+def test_mensagens_confirmadas_chegam_ao_dropbox(carregar_workers, dropbox_falso):
+    worker, = carregar_workers(1, DB_WRITE_BEHIND_ENABLED="true", DB_WRITE_BEHIND_JANELA_MS="10")
+
+    for texto in ("um", "dois", "tres"):
+        assert worker.armazenamento.anexar(_nova_mensagem(worker, texto))[0]
+    assert worker.armazenamento.fila.descarregar()
+
+    novo, = carregar_workers(1, DB_WRITE_BEHIND_ENABLED="false")
+    assert sorted(m["mensagem_original"] for m in novo.carregar_banco_dropbox()["mensagens"]) == ["dois", "tres", "um"]
@@ -0,0 +1,145 @@
+"""
+Estresse da gravação concorrente: vários workers, com várias threads cada,
+gravando mensagens no mesmo banco do Dropbox falso.
+"""
+import json
+import threading
+import time
+
+import pytest
+
+WORKERS = 4
+THREADS_POR_WORKER = 2
+MENSAGENS_POR_THREAD = 10
+CAMINHO_BANCO = "/mensagens_projetos.json"
+
+
+def _nova_mensagem(worker, texto):
+    return {
+        "id": None,
+        "timestamp": "2024-01-15T10:00",
+        "remetente": None,
+        "categoria": "Prazo",
+        "contexto": "",
+        "mudanca_chave": "",
+        "mensagem_original": texto,
+        "projeto": "12345",
+        "lesson_learned": "não",
+        "mensagem_hash": worker.gerar_hash_mensagem("12345", "Prazo", texto),
+        "status_enriquecimento": "concluido"
+    }
+
+
+def _gravar_em_paralelo(workers):
+    resultados = []
+
+    def gravar(worker, numero_worker, numero_thread):
+        for i in range(MENSAGENS_POR_THREAD):
+            texto = f"worker {numero_worker} thread {numero_thread} mensagem {i}"
+            sucesso, _ = worker.armazenamento.anexar(_nova_mensagem(worker, texto))
+            resultados.append(sucesso)
+
+    threads = [threading.Thread(target=gravar, args=(worker, w, t))
+               for w, worker in enumerate(workers) for t in range(THREADS_POR_WORKER)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return resultados
+
+
+def _ids_por_hash(banco):
+    return {mensagem["mensagem_hash"]: mensagem["id"] for mensagem in banco["mensagens"]}
+
+
+@pytest.mark.parametrize("journal", ["false", "true"])
+def test_gravacoes_simultaneas_nao_se_perdem(carregar_workers, dropbox_falso, journal):
+    workers = carregar_workers(WORKERS, DB_JOURNAL_ENABLED=journal)
+    total = WORKERS * THREADS_POR_WORKER * MENSAGENS_POR_THREAD
+
+    resultados = _gravar_em_paralelo(workers)
+
+    assert len(resultados) == total and all(resultados)
+    # O banco principal nunca é sobrescrito às cegas
+    assert (CAMINHO_BANCO, "overwrite") not in dropbox_falso.modos
+
+    # Cada worker, atualizando o próprio cache, e um worker novo, sem cache,
+    # veem as mesmas mensagens com os mesmos ids
+    time.sleep(0.1)
+    novo, = carregar_workers(1, DB_JOURNAL_ENABLED=journal)
+    vistas = [_ids_por_hash(worker.carregar_banco_dropbox()) for worker in workers + [novo]]
+    assert len(vistas[0]) == total
+    assert sorted(vistas[0].values()) == list(range(1, total + 1))
+    for vista in vistas[1:]:
+        assert vista == vistas[0]
+
+    if journal == "true":
+        # A compactação incorpora os segmentos sem mudar os ids
+        novo.DB_JOURNAL_RETENCAO_SECONDS = 0
+        assert novo.compactar_journal()
+        assert not any("_journal/" in caminho for caminho in dropbox_falso.arquivos)
+
+    snapshot = json.loads(dropbox_falso.arquivos[CAMINHO_BANCO][0])
+    assert _ids_por_hash(snapshot) == vistas[0]
+    assert snapshot["estatisticas"]["total_mensagens"] == total
+
+
+def test_upload_lento_nao_trava_as_leituras(carregar_workers, dropbox_falso):
+    worker, = carregar_workers(1)
+    assert worker.armazenamento.anexar(_nova_mensagem(worker, "primeira"))[0]
+
+    liberar_upload = threading.Event()
+    upload_original = dropbox_falso.files_upload
+
+    def upload_lento(*args, **kwargs):
+        liberar_upload.wait(5)
+        return upload_original(*args, **kwargs)
+
+    dropbox_falso.files_upload = upload_lento
+    gravacao = threading.Thread(
+        target=worker.armazenamento.anexar, args=(_nova_mensagem(worker, "segunda"),))
+    gravacao.start()
+    try:
+        # Com o upload parado, a leitura do banco em cache não espera por ele
+        leitura = threading.Thread(target=worker.armazenamento.obter_mensagem, args=(
+            "12345", worker.gerar_hash_mensagem("12345", "Prazo", "primeira")))
+        time.sleep(0.1)
+        leitura.start()
+        leitura.join(2)
+        assert not leitura.is_alive()
+    finally:
+        liberar_upload.set()
+        gravacao.join()
+    assert worker.armazenamento.existe_hash("12345", worker.gerar_hash_mensagem("12345", "Prazo", "segunda"))
+
+
+@pytest.mark.parametrize("journal", ["false", "true"])
+def test_indice_acompanha_gravacoes_de_outro_worker(carregar_workers, journal):
+    leitor, escritor = carregar_workers(2, DB_JOURNAL_ENABLED=journal)
+    assert leitor.armazenamento.anexar(_nova_mensagem(leitor, "primeira"))[0]
+    indice = leitor.armazenamento.obter_indice("similares", "12345")
+
+    assert escritor.armazenamento.anexar(_nova_mensagem(escritor, "segunda mensagem do outro worker"))[0]
+    time.sleep(0.1)
+
+    # A nova revisão do banco reaproveita o índice, com a mensagem do outro worker
+    assert leitor.armazenamento.obter_indice("similares", "12345", apenas_pronto=True) is indice
+    similares = leitor.buscar_similares("12345", "segunda mensagem do outro worker!")
+    assert [msg["mensagem_original"] for msg in similares] == ["segunda mensagem do outro worker"]
+
+
+@pytest.mark.parametrize("sharding", ["false", "true"])
+def test_backup_nao_sobrescreve_gravacao_de_outro_worker(carregar_workers, dropbox_falso, sharding):
+    gravador, outro = carregar_workers(2, DB_SHARDING_ENABLED=sharding,
+                                       DB_CACHE_STALENESS_SECONDS="60")
+    outro.carregar_banco_dropbox()
+    assert gravador.armazenamento.anexar(_nova_mensagem(gravador, "gravada antes do backup"))[0]
+
+    # O cache do outro worker ainda não viu a mensagem
+    resposta = outro.app.test_client().post("/api/fazer_backup").get_json()
+
+    assert resposta["success"]
+    assert "(1 mensagens)" in resposta["message"]
+    assert all(modo != "overwrite" for _, modo in dropbox_falso.modos)
+    novo, = carregar_workers(1, DB_SHARDING_ENABLED=sharding)
+    assert len(novo.carregar_banco_dropbox()["mensagens"]) == 1
@@ -0,0 +1,72 @@
+"""Índice de busca compartilhado por vários workers"""
+import sqlite3
+import time
+
+import pytest
+
+from test_gravacao_concorrente import (MENSAGENS_POR_THREAD, THREADS_POR_WORKER, _gravar_em_paralelo,
+                                       _ids_por_hash, _nova_mensagem)
+
+
+def _ids_indexados(worker):
+    with sqlite3.connect(worker.BUSCA_INDICE_PATH) as conexao:
+        return dict(conexao.execute("SELECT mensagem_hash, id FROM documentos"))
+
+
+@pytest.mark.parametrize("journal", ["false", "true"])
+def test_workers_compartilham_o_indice_sem_refazer(carregar_workers, journal):
+    # Todos os workers usam o mesmo busca.db
+    workers = carregar_workers(2, DB_JOURNAL_ENABLED=journal)
+    primeiro, segundo = workers
+    total = len(workers) * THREADS_POR_WORKER * MENSAGENS_POR_THREAD
+
+    assert all(_gravar_em_paralelo(workers))
+    time.sleep(0.1)
+    assert primeiro.indice_busca.sincronizar() == total
+
+    # O cursor gravado por um worker vale para o outro: os ids são os mesmos,
+    # e nada é indexado de novo
+    assert segundo.indice_busca.sincronizar() == 0
+    for worker in workers:
+        assert _ids_por_hash(worker.carregar_banco_dropbox()) == _ids_indexados(worker)
+
+    if journal == "true":
+        # A compactação não muda os ids, e o índice continua valendo
+        segundo.DB_JOURNAL_RETENCAO_SECONDS = 0
+        assert segundo.compactar_journal()
+        time.sleep(0.1)
+        assert primeiro.indice_busca.sincronizar() == 0
+        assert _ids_por_hash(primeiro.carregar_banco_dropbox()) == _ids_indexados(primeiro)
+
+    for worker in workers:
+        encontrados, _, _ = worker.indice_busca.buscar("mensagem", "12345")
+        assert encontrados == total
+
+
+@pytest.mark.parametrize("backend, layout", [("dropbox", {}), ("dropbox", {"DB_JOURNAL_ENABLED": "true"}),
+                                             ("dropbox", {"DB_SHARDING_ENABLED": "true"}), ("sqlite", {})])
+def test_mensagem_alterada_depois_de_indexada_e_reindexada(carregar_workers, backend, layout):
+    worker, = carregar_workers(1, DB_BACKEND=backend, **layout)
+    worker.armazenamento.inicializar()
+    mensagens = []
+    for texto in ("valvula trocada", "bomba revisada"):
+        mensagem = _nova_mensagem(worker, texto)
+        mensagem.update(contexto="contexto provisorio", status_enriquecimento="falhou")
+        assert worker.armazenamento.anexar(mensagem)[0]
+        mensagens.append(mensagem)
+    assert worker.indice_busca.sincronizar() == 2
+
+    # Enriquecimento refeito depois da indexação (ou reenriquecer pela CLI)
+    assert worker.armazenamento.atualizar("12345", mensagens[0]["mensagem_hash"], {
+        "contexto": "vazamento no flange", "status_enriquecimento": "concluido"})[0]
+    time.sleep(0.1)
+    assert worker.indice_busca.sincronizar() == 1
+    assert worker.indice_busca.buscar("flange")[0] == 1
+    assert worker.indice_busca.buscar("provisorio")[0] == 1
+
+    # Uma nova alteração também é vista, e sem alterações nada é reindexado
+    assert worker.armazenamento.atualizar("12345", mensagens[1]["mensagem_hash"], {"contexto": "rotor"})[0]
+    time.sleep(0.1)
+    assert worker.indice_busca.sincronizar() == 1
+    assert worker.indice_busca.buscar("provisorio")[0] == 0
+    assert worker.indice_busca.sincronizar() == 0
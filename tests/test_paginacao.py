@@ -0,0 +1,116 @@
+"""Listagem paginada por cursor (paginar) nos backends Dropbox e SQLite"""
+import random
+import sqlite3
+
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+PROJETOS = ["12345", "67890"]
+CATEGORIAS = ["Prazo", "Qualidade", "Custo"]
+
+
+def _mensagens(worker, quantidade=120):
+    aleatorio = random.Random(7)
+    mensagens = []
+    for numero in range(quantidade):
+        mensagem = _nova_mensagem(worker, f"mensagem {numero}")
+        mensagem.update(projeto=aleatorio.choice(PROJETOS), categoria=aleatorio.choice(CATEGORIAS),
+                        lesson_learned=aleatorio.choice(["sim", "não", "não"]),
+                        timestamp=f"2024-{aleatorio.randint(1, 12):02d}-{aleatorio.randint(1, 28):02d}T10:00")
+        mensagem["mensagem_hash"] = worker.gerar_hash_mensagem(mensagem["projeto"], mensagem["categoria"],
+                                                               mensagem["mensagem_original"])
+        mensagens.append(mensagem)
+    return mensagens
+
+
+@pytest.fixture(params=["dropbox", "sqlite"])
+def worker(request, carregar_workers):
+    worker, = carregar_workers(1, DB_BACKEND=request.param)
+    if request.param == "sqlite":
+        worker.armazenamento.inicializar()
+        for mensagem in _mensagens(worker):
+            assert worker.armazenamento.anexar(mensagem)[0]
+    else:
+        assert len(worker.armazenamento.anexar_lote(_mensagens(worker))) == 120
+    return worker
+
+
+def _todas_as_paginas(worker, limite=7, **filtros):
+    paginas, cursor = [], None
+    while True:
+        pagina = worker.armazenamento.paginar(cursor=cursor, limite=limite, campos=["timestamp"], **filtros)
+        paginas.extend(pagina)
+        if len(pagina) < limite:
+            return paginas
+        cursor = (pagina[-1]["id"], pagina[-1]["projeto"])
+
+
+@pytest.mark.parametrize("filtros", [
+    {},
+    {"projeto_id": "12345"},
+    {"categoria": "Prazo"},
+    {"lesson_learned": "sim"},
+    {"projeto_id": "67890", "categoria": "Custo", "lesson_learned": "não"},
+    {"inicio": "2024-03-01", "fim": "2024-06-30T23:59:59"},
+    {"projeto_id": "12345", "inicio": "2024-10-01"},
+    {"categoria": "Qualidade", "fim": "2024-04-15T23:59:59"},
+])
+@pytest.mark.parametrize("crescente", [False, True])
+def test_paginas_seguem_os_filtros_em_ordem_de_id(worker, filtros, crescente):
+    esperadas = sorted(
+        (m["id"], m["projeto"]) for m in worker.armazenamento.consultar()
+        if all(m[campo] == filtros[filtro] for filtro, campo in (("projeto_id", "projeto"), ("categoria", "categoria"),
+                                                                  ("lesson_learned", "lesson_learned"))
+               if filtro in filtros)
+        and m["timestamp"] >= filtros.get("inicio", "") and m["timestamp"] <= filtros.get("fim", "9999"))
+    paginas = _todas_as_paginas(worker, crescente=crescente, **filtros)
+
+    assert esperadas
+    assert [(m["id"], m["projeto"]) for m in paginas] == (esperadas if crescente else esperadas[::-1])
+
+
+def test_indice_do_dropbox_guarda_cada_mensagem_uma_vez(carregar_workers):
+    worker, = carregar_workers(1)
+    indice = worker._construir_indice_paginacao(_mensagens(worker))
+    assert sum(len(lista["ids"]) for lista in indice.values()) == 120
+    assert all(lista["tempos"] == sorted(lista["tempos"]) for lista in indice.values())
+
+
+@pytest.mark.parametrize("filtros", [
+    {"projeto_id": "12345"},
+    {"projeto_id": "12345", "categoria": "Prazo"},
+    {"projeto_id": "12345", "lesson_learned": "sim"},
+    {"projeto_id": "12345", "inicio": "2024-03-01", "fim": "2024-06-30T23:59:59"},
+    {"inicio": "2024-03-01"},
+])
+def test_paginas_do_sqlite_saem_do_indice_sem_ordenar(carregar_workers, filtros):
+    worker, = carregar_workers(1, DB_BACKEND="sqlite")
+    worker.armazenamento.inicializar()
+    conexao = worker.armazenamento._conexao()
+    consultas = []
+    conexao.set_trace_callback(consultas.append)
+    worker.armazenamento.paginar(cursor=(50, "12345"), **filtros)
+    conexao.set_trace_callback(None)
+
+    consulta, = [sql for sql in consultas if sql.startswith("SELECT")]
+    plano = " ".join(linha[3] for linha in conexao.execute("EXPLAIN QUERY PLAN " + consulta))
+    assert "TEMP B-TREE" not in plano
+    if "projeto_id" in filtros:
+        assert "USING" in plano and "INDEX" in plano
+
+
+def test_hash_unico_por_projeto_no_sqlite(carregar_workers):
+    worker, = carregar_workers(1, DB_BACKEND="sqlite")
+    worker.armazenamento.inicializar()
+    mensagem = _nova_mensagem(worker, "repetida")
+    assert worker.armazenamento.anexar(dict(mensagem))[0]
+    assert not worker.armazenamento.anexar(dict(mensagem))[0]
+    with pytest.raises(sqlite3.IntegrityError):
+        worker.armazenamento._conexao().execute(
+            "INSERT INTO mensagens (projeto, mensagem_hash) VALUES (?, ?)", (mensagem["projeto"], mensagem["mensagem_hash"]))
+
+    # Mensagens repetidas no JSON de origem são importadas uma vez só
+    repetidas = [dict(mensagem, id=1), dict(mensagem, id=2), dict(_nova_mensagem(worker, "outra"), id=2)]
+    assert worker.armazenamento._importar(repetidas, substituir=True) == 2
+    assert sorted(m["mensagem_original"] for m in worker.armazenamento.consultar()) == ["outra", "repetida"]
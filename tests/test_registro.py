@@ -0,0 +1,19 @@
+"""Registro de mensagens pela API"""
+
+
+def test_registro_com_deepseek_fora_do_ar_fica_pendente(carregar_workers):
+    worker, = carregar_workers(1)
+    for _ in range(worker.deepseek.disjuntor.max_falhas):
+        worker.deepseek.disjuntor.registrar_falha()
+    assert worker.deepseek.disjuntor.aberto()
+
+    resposta = worker.app.test_client().post("/api/registrar_mensagem", json={
+        "projeto_id": "12345", "categoria": "Prazo", "data_info": "2024-01-15T10:00",
+        "mensagem": "Entrega do concreto adiada", "lesson_learned": "não"
+    }).get_json()
+
+    # Sem o modo assíncrono, mas com o disjuntor aberto, o contexto fica para depois
+    assert resposta["success"]
+    assert resposta["status_enriquecimento"] == "pendente"
+    mensagem = worker.armazenamento.obter_mensagem("12345", resposta["mensagem_hash"])
+    assert mensagem["status_enriquecimento"] == "pendente"
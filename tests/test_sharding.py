@@ -0,0 +1,63 @@
+"""Layout com um arquivo por projeto no Dropbox"""
+import pytest
+
+from test_gravacao_concorrente import _nova_mensagem
+
+
+def _arquivos_de_projeto(dropbox_falso):
+    return sorted(caminho for caminho in dropbox_falso.arquivos if "/projeto_" in caminho)
+
+
+@pytest.fixture
+def worker(carregar_workers):
+    worker, = carregar_workers(1, DB_SHARDING_ENABLED="true")
+    return worker
+
+
+def test_gravacao_cria_o_arquivo_do_projeto(worker, dropbox_falso):
+    assert worker.armazenamento.anexar(_nova_mensagem(worker, "primeira"))[0]
+
+    assert _arquivos_de_projeto(dropbox_falso) == [worker.caminho_banco("12345")]
+    assert list(worker.carregar_manifesto(forcar_download=True)["projetos"]) == ["12345"]
+    assert len(worker.carregar_banco_dropbox(projeto_id="12345")["mensagens"]) == 1
+
+
+def test_projeto_desconhecido_nao_e_gravado(worker, dropbox_falso):
+    mensagem = _nova_mensagem(worker, "projeto inventado")
+    mensagem["projeto"] = "NAO_EXISTE"
+
+    assert worker.armazenamento.anexar(mensagem) == (False, "Projeto não encontrado")
+    assert _arquivos_de_projeto(dropbox_falso) == []
+
+
+def test_leituras_de_projeto_desconhecido_nao_gravam(worker, dropbox_falso):
+    cliente = worker.app.test_client()
+    gravacoes = len(dropbox_falso.modos)
+
+    resposta = cliente.get("/api/mensagens?projeto_id=LIXO_QUALQUER").get_json()
+    assert resposta["success"] and resposta["mensagens"] == []
+    resposta = cliente.post("/api/verificar_duplicata", json={
+        "projeto_id": "OUTRO_LIXO", "categoria": "Prazo", "mensagem": "qualquer coisa"}).get_json()
+    assert resposta["success"] and not resposta["is_duplicata"]
+    assert worker.armazenamento.estatisticas("LIXO_QUALQUER")["total"] == 0
+
+    assert len(dropbox_falso.modos) == gravacoes
+    assert _arquivos_de_projeto(dropbox_falso) == []
+
+
+def test_migracao_do_arquivo_unico(carregar_workers, dropbox_falso):
+    legado, = carregar_workers(1)
+    for projeto_id, texto in (("12345", "alfa"), ("67890", "beta"), ("12345", "gama")):
+        mensagem = _nova_mensagem(legado, texto)
+        mensagem["projeto"] = projeto_id
+        mensagem["mensagem_hash"] = legado.gerar_hash_mensagem(projeto_id, "Prazo", texto)
+        assert legado.armazenamento.anexar(mensagem)[0]
+
+    worker, = carregar_workers(1, DB_SHARDING_ENABLED="true")
+
+    assert _arquivos_de_projeto(dropbox_falso) == [worker.caminho_banco("12345"), worker.caminho_banco("67890")]
+    por_projeto = {projeto_id: [(m["id"], m["mensagem_original"]) for m in
+                                worker.carregar_banco_dropbox(projeto_id=projeto_id)["mensagens"]]
+                   for projeto_id in ("12345", "67890")}
+    assert por_projeto == {"12345": [(1, "alfa"), (3, "gama")], "67890": [(2, "beta")]}
+    assert worker.armazenamento.estatisticas()["total"] == 3